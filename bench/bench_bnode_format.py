@@ -0,0 +1,84 @@
+"""micro-benchmark, per-node cost of BNodeFormat load and dump.
+
+run it from the repository root:
+
+    python bench/bench_bnode_format.py
+"""
+
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'),
+)
+
+# local imports
+from modb.format import BNodeFormat, Pointer
+
+
+# the old way, one Pointer object (and one f.read / f.write) per pointer.
+# kept here only as the baseline we compare with.
+
+def legacy_load(f):
+    keys = [Pointer.load(f) for _ in range(BNodeFormat.capacity)]
+    values = [Pointer.load(f) for _ in range(BNodeFormat.capacity)]
+    children = [Pointer.load(f) for _ in range(BNodeFormat.order)]
+    return keys, values, children
+
+
+def legacy_dump(f, keys, values, children):
+    for i in keys:
+        Pointer(i).dump(f)
+    for i in values:
+        Pointer(i).dump(f)
+    for i in children:
+        Pointer(i).dump(f)
+
+
+def main(number=20000):
+    capacity = BNodeFormat.capacity
+
+    # a full internal node, the worst case for both codecs.
+    keys = list(range(1000, 1000 + capacity))
+    values = list(range(2000, 2000 + capacity))
+    children = list(range(3000, 3000 + BNodeFormat.order))
+
+    blob = BNodeFormat(list(keys), list(values), list(children)).dumps()
+
+    # make sure we are comparing the same bytes.
+    with io.BytesIO() as f:
+        legacy_dump(f, keys, values, children)
+        assert f.getvalue() == blob
+
+    def new_load():
+        BNodeFormat.load(io.BytesIO(blob))
+
+    def old_load():
+        legacy_load(io.BytesIO(blob))
+
+    def new_dump():
+        BNodeFormat(list(keys), list(values), list(children)).dump(
+            io.BytesIO()
+        )
+
+    def old_dump():
+        legacy_dump(io.BytesIO(), keys, values, children)
+
+    for name, old, new in [
+        ('load', old_load, new_load),
+        ('dump', old_dump, new_dump),
+    ]:
+        t_old = min(timeit.repeat(old, number=number, repeat=3)) / number
+        t_new = min(timeit.repeat(new, number=number, repeat=3)) / number
+        print(
+            f'{name}: per-pointer {t_old * 1e6:8.2f} us/node'
+            f' | struct {t_new * 1e6:8.2f} us/node'
+            f' | x{t_old / t_new:.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""asyncio front-end, the blocking calls (disk-IO) run on threads so the event
+loop is never blocked."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# local imports
+from modb import high
+from modb import low
+
+
+# how many pairs `AsyncNode.items` / `AsyncNode.range` grab in one go.
+CHUNK_SIZE = 256
+
+
+# note, the database is opened in thread-safe mode (go check
+# `modb.low.ThreadSafeIO`), the reads run on a pool of `max_workers` threads
+# at the same time, while the writes (and .freeze) run one by one on one
+# single thread, in the order they are called. so a write never takes every
+# thread of the pool waiting for the lock.
+
+# note, a write holds the write lock (go check `modb.util.RWLock`) from start
+# to end, the reads started meanwhile wait for it, the event loop does not.
+# not .freeze, the reads keep running while it writes the modified nodes,
+# they only wait for its last short steps (go check `modb.low.freezing`).
+
+
+def wrap(db, value):
+    # the async version of the trees and arrays, anything else as it is.
+    type_ = type(value)
+    if type_ is low.VirtualBNode:
+        return AsyncNode(db, value)
+    elif type_ is low.VirtualArray:
+        return AsyncArray(db, value)
+    return value
+
+
+class AsyncDatabase:
+    # async version of `modb.high.Database`, same parameters plus
+    # `max_workers`, the number of reading threads.
+
+    def __init__(self, filename, max_workers=4, **kwargs):
+        self.filename = filename
+        self.max_workers = max_workers
+        self.kwargs = kwargs
+
+        # set by .connect
+        self.db = None
+
+        # (node, key) -> future of the lookup in flight, so concurrent
+        # lookups of the same key are done once. emptied by every write, a
+        # lookup started after a write never gets a value from before it.
+        self.lookups = {}
+
+        self.reader = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='modb-read',
+        )
+        self.writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='modb-write',
+        )
+
+    async def read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.reader,
+            functools.partial(func, *args, **kwargs),
+        )
+
+    async def write(self, func, *args, **kwargs):
+        self.lookups.clear()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.writer,
+            functools.partial(func, *args, **kwargs),
+        )
+
+    async def connect(self):
+        # open the database (a write-ahead log may be replayed) then return
+        # the root node.
+
+        if self.db is None:
+            self.db = await self.write(
+                high.Database,
+                self.filename,
+                thread_safe=True,
+                **self.kwargs,
+            )
+
+        node = await self.write(self.db.connect)
+        return AsyncNode(self, node)
+
+    async def close(self):
+        if self.db is not None:
+            await self.write(self.db.close)
+            self.db = None
+
+        self.reader.shutdown()
+        self.writer.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncNode:
+    # async version of `modb.low.VirtualBNode`.
+
+    # note, unlike the sync one, .get, .items and .range give the actual
+    # values (loaded on the reading threads), not Data objects, so nothing
+    # touches the disk on the event loop afterwards.
+
+    def __init__(self, db, node):
+        self.db = db
+        self.node = node
+
+    # reads
+
+    def _get(self, key):
+        return self.node.search(key).get()
+
+    async def get(self, key):
+        # search the key, return the value. modb.error.KeyNotFound is raised
+        # if not found.
+
+        lookups = self.db.lookups
+        name = (self.node, key)
+
+        try:
+            future = lookups.get(name)
+        except TypeError:
+            # not hashable, no coalescing.
+            return wrap(self.db, await self.db.read(self._get, key))
+
+        if future is None:
+            future = asyncio.ensure_future(self.db.read(self._get, key))
+            lookups[name] = future
+            future.add_done_callback(
+                functools.partial(self.forget, name)
+            )
+
+        # note, shield, one of the callers being cancelled must not cancel
+        # the lookup of the others.
+        return wrap(self.db, await asyncio.shield(future))
+
+    def forget(self, name, future):
+        lookups = self.db.lookups
+        if lookups.get(name) is future:
+            del lookups[name]
+
+    async def search(self, key):
+        # same as the sync one, return the Data object.
+        return await self.db.read(self.node.search, key)
+
+    async def contains(self, key):
+        return await self.db.read(self.node.__contains__, key)
+
+    async def follow(self, key_path):
+        return await self.db.read(self.node.follow, key_path)
+
+    async def pretty(self):
+        return await self.db.read(self.node.pretty)
+
+    def items(self, reverse=False, chunk_size=CHUNK_SIZE):
+        # async iterator of (key, value) pairs.
+        return self.stream(
+            self.node.items(reverse),
+            chunk_size,
+        )
+
+    def range(self, key_low, key_high, reverse=False, chunk_size=CHUNK_SIZE):
+        # async iterator of (key, value) pairs, key_high is not included.
+        return self.stream(
+            self.node.range(key_low, key_high, reverse),
+            chunk_size,
+        )
+
+    def next_chunk(self, it, chunk_size):
+        chunk = []
+        for key, value in it:
+            chunk.append((key.get(), value.get()))
+            if len(chunk) == chunk_size:
+                break
+        return chunk
+
+    async def stream(self, it, chunk_size):
+        # the pairs are grabbed by chunks on a reading thread, the next chunk
+        # is grabbed while the caller consumes the current one.
+
+        future = asyncio.ensure_future(
+            self.db.read(self.next_chunk, it, chunk_size)
+        )
+        try:
+            while True:
+                chunk = await future
+                if not chunk:
+                    return
+
+                future = asyncio.ensure_future(
+                    self.db.read(self.next_chunk, it, chunk_size)
+                )
+                for key, value in chunk:
+                    yield key, wrap(self.db, value)
+        finally:
+            # stopped early, let the prefetch finish before the generator
+            # goes away.
+            if not future.done():
+                await asyncio.wait([future])
+
+    # writes
+
+    async def insert(self, key, value):
+        return await self.db.write(self.node.insert, key, value)
+
+    async def insert_many(self, pairs):
+        return await self.db.write(self.node.insert_many, list(pairs))
+
+    async def update(self, key, new_value):
+        return await self.db.write(self.node.update, key, new_value)
+
+    async def delete(self, key):
+        return await self.db.write(self.node.delete, key)
+
+    async def create(self, key):
+        return await self.db.write(self.node.create, key)
+
+    async def bulk_load(self, pairs, fill_factor=1.0):
+        return await self.db.write(
+            self.node.bulk_load,
+            list(pairs),
+            fill_factor=fill_factor,
+        )
+
+    async def freeze(self):
+        return await self.db.write(self.node.freeze)
+
+
+class AsyncArray:
+    # async version of `modb.low.VirtualArray`.
+
+    def __init__(self, db, array):
+        self.db = db
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def _get(self, idx):
+        return self.array.access(idx).get()
+
+    async def get(self, idx):
+        return wrap(self.db, await self.db.read(self._get, idx))
+
+    async def append(self, value):
+        return await self.db.write(self.array.append, value)
+
+    async def set(self, idx, value):
+        return await self.db.write(self.array.set, idx, value)
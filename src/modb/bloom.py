@@ -0,0 +1,147 @@
+"""Bloom filter of the keys of a tree, a key the filter has never seen is not
+in the tree, so looking up a missing key mostly reads no node at all."""
+
+import hashlib
+import struct
+
+# local imports
+from modb.constant import (
+    BLOOM_BITS_PER_KEY,
+    BLOOM_HASHES,
+    BLOOM_MIN_CAPACITY,
+)
+from modb.format import zigzag_varint
+
+
+# note, a filter only grows, a deleted key stays in it (it is a false
+# positive from then on, the lookup reads the nodes as usual). the filter is
+# built again, without the deleted keys, by `VirtualBNode.compact` and
+# `VirtualBNode.vacuum`.
+
+# the filter is a list of layers, a new one (twice as big) is added when the
+# last one is full, so the false positives stay about the same however many
+# keys are inserted, without building the filter again. rough layout:
+#       n  ( capacity  count  bits )*n
+# n, capacity and count are U32, bits is capacity * BLOOM_BITS_PER_KEY bits.
+
+count_struct = struct.Struct('>I')
+layer_struct = struct.Struct('>II')
+
+
+def key_bytes(key):
+    # the bytes hashed for a key, None if key can not be a key. note, the
+    # keys which may be equal for the tree are equal here too (a false
+    # positive is fine), 1, 1.0 and True for example.
+    type_ = type(key)
+
+    if type_ is str:
+        return b's' + key.encode('utf-8')
+    elif type_ is bytes:
+        return b'b' + key
+    elif type_ is bool or (type_ is float and key.is_integer()):
+        key = int(key)
+        type_ = int
+
+    if type_ is int:
+        return b'i' + zigzag_varint(key)
+    elif type_ is float:
+        return b'f' + struct.pack('>d', key)
+    return None
+
+
+def hash_key(key):
+    # two independent hashes, the BLOOM_HASHES bits of a key are
+    # h1 + i * h2 (double hashing). None if key can not be a key.
+    b = key_bytes(key)
+    if b is None:
+        return None
+    digest = hashlib.blake2b(b, digest_size=16).digest()
+    return (
+        int.from_bytes(digest[:8], 'big'),
+        int.from_bytes(digest[8:], 'big') | 1,
+    )
+
+
+class BloomFilter:
+    def __init__(self, capacity=BLOOM_MIN_CAPACITY):
+        # [[capacity, count, bits], ...]
+        self.layers = []
+        self.add_layer(max(capacity, BLOOM_MIN_CAPACITY))
+
+        # whether the filter changed since it was written, go check
+        # `VirtualBNode.write_bloom`.
+        self.dirty = True
+
+    def add_layer(self, capacity):
+        size = (capacity * BLOOM_BITS_PER_KEY + 7) // 8
+        self.layers.append([capacity, 0, bytearray(size)])
+
+    def count(self):
+        # how many keys were added (the deleted ones included)
+        return sum(layer[1] for layer in self.layers)
+
+    def add(self, key):
+        hashes = hash_key(key)
+        if hashes is None:
+            return
+
+        layer = self.layers[-1]
+        if layer[1] >= layer[0]:
+            self.add_layer(layer[0] * 2)
+            layer = self.layers[-1]
+
+        h1, h2 = hashes
+        bits = layer[2]
+        size = len(bits) * 8
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) % size
+            bits[bit >> 3] |= 1 << (bit & 7)
+
+        layer[1] += 1
+        self.dirty = True
+
+    def __contains__(self, key):
+        # False if key was never added, True if it may have been.
+        hashes = hash_key(key)
+        if hashes is None:
+            # not a key, the tree tells.
+            return True
+
+        h1, h2 = hashes
+        for _, count, bits in self.layers:
+            if count == 0:
+                continue
+
+            size = len(bits) * 8
+            for i in range(BLOOM_HASHES):
+                bit = (h1 + i * h2) % size
+                if not bits[bit >> 3] & (1 << (bit & 7)):
+                    break
+            else:
+                return True
+
+        return False
+
+    def dumps(self):
+        blob = bytearray(count_struct.pack(len(self.layers)))
+        for capacity, count, bits in self.layers:
+            blob += layer_struct.pack(capacity, count)
+            blob += bits
+        return bytes(blob)
+
+    @classmethod
+    def loads(cls, blob):
+        inst = cls.__new__(cls)
+        inst.layers = []
+        inst.dirty = False
+
+        n, = count_struct.unpack_from(blob)
+        pos = count_struct.size
+        for _ in range(n):
+            capacity, count = layer_struct.unpack_from(blob, pos)
+            pos += layer_struct.size
+            size = (capacity * BLOOM_BITS_PER_KEY + 7) // 8
+            inst.layers.append([capacity, count, bytearray(blob[pos:pos + size])])
+            pos += size
+
+        return inst
@@ -0,0 +1,72 @@
+"""value compression, the str and bytes values of at least `min_size` bytes
+are written compressed (zlib or lzma, both in the standard library) and
+decompressed when read, go check `Database(compress=...)`."""
+
+import lzma
+import zlib
+
+# local imports
+from modb.constant import COMPRESS_MIN_SIZE
+
+
+# the method codes, written in every compressed value (go check
+# `modb.format.Compressed`), so a file can hold values of many methods.
+ZLIB = 0
+LZMA = 1
+# zlib with the shared dictionary of the file (go check
+# `Header.compress_dict`). a small value compresses well only if its bytes
+# are in the dictionary, for example, JSON documents of the same shape.
+ZLIB_DICT = 2
+
+METHODS = ('zlib', 'lzma')
+
+
+class Codec:
+    def __init__(
+        self,
+        method=None,
+        min_size=COMPRESS_MIN_SIZE,
+        dictionary=None,
+    ):
+        # method is 'zlib', 'lzma' or None (nothing is compressed, what is
+        # already compressed is still read).
+        if method is not None and method not in METHODS:
+            raise ValueError(f'Unknown compression method {method!r}')
+
+        self.method = method
+        self.min_size = min_size
+        # bytes or None, zlib only.
+        self.dictionary = dictionary
+
+    def compress(self, b):
+        # return (method code, compressed bytes), None if b is better written
+        # as it is.
+
+        if self.method is None or len(b) < self.min_size:
+            return None
+
+        if self.method == 'lzma':
+            code, blob = LZMA, lzma.compress(b)
+        elif self.dictionary:
+            compressor = zlib.compressobj(zdict=self.dictionary)
+            code, blob = ZLIB_DICT, compressor.compress(b) + compressor.flush()
+        else:
+            code, blob = ZLIB, zlib.compress(b)
+
+        # note, random bytes (or already compressed ones) get bigger.
+        if len(blob) >= len(b):
+            return None
+        return code, blob
+
+    def decompress(self, code, blob):
+        if code == ZLIB:
+            return zlib.decompress(blob)
+        elif code == LZMA:
+            return lzma.decompress(blob)
+        elif code == ZLIB_DICT:
+            if not self.dictionary:
+                raise RuntimeError('The compression dictionary is missing')
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+            return decompressor.decompress(blob) + decompressor.flush()
+
+        raise RuntimeError('Unknown compression method', code)
@@ -4,6 +4,8 @@ import math
 # , but there is also a growing chance correspondingly 
 # that memory space will be wasted. (occupied but never used.)
 # note, in this context, order is alias for page.
+# note, this is the order of new files, the order of a file is in its header
+# (`Database(order=...)`).
 BNODE_ORDER = 64
 
 # used for btree insertion
@@ -14,5 +16,51 @@ BNODE_MIN_CAPACITY = math.ceil(
     BNODE_ORDER / 2
 ) - 1
 
+# node format 1 (`modb.format.InlineBNodeFormat`) keeps the first bytes of
+# every key in the node, a longer key is compared with its first
+# INLINE_KEY_SIZE bytes, then read from the disk only if they are the same.
+INLINE_KEY_SIZE = 16
+
+# `Database(prefetch_keys=True)`, the keys of an accessed node are read
+# together: keys less than PREFETCH_GAP bytes apart share one read, which
+# spans PREFETCH_SPAN bytes at most. PREFETCH_TAIL bytes are read after the
+# last key of a read, a key going past that is read on its own as usual.
+PREFETCH_GAP = 64 * 1024
+PREFETCH_SPAN = 256 * 1024
+PREFETCH_TAIL = 256
+
+# writable mmap backend (`Database(use_mmap=True)`) grows the mapping by at
+# least this many bytes every time a write goes past the end of the mapping.
+# note, the file itself is truncated back to its real size when closed.
+MMAP_GROW_SIZE = 16 * 1024 * 1024
+
+# size of MyIO's write-behind buffer. appended data is kept in RAM and
+# written to the file in chunks of about this size (or when flushed).
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# group commit interval of the write-ahead log (`Database(wal='group')`), in
+# milliseconds. records are fsync-ed together once per interval.
+WAL_GROUP_MS = 10
+
+# `VirtualBNode.compact`, the nodes visited by one step (by default). a new
+# pass is started only if at least COMPACT_MIN_FREE of the file is free.
+COMPACT_STEP_NODES = 256
+COMPACT_MIN_FREE = 0.1
+
+# `Database(compress=...)`, the str and bytes values shorter than this (in
+# bytes) are never compressed, see `modb.compress`.
+COMPRESS_MIN_SIZE = 256
+
+# `Database(bloom_filter=True)`, bits per key and hash functions of the
+# Bloom filter of a tree (about 1% of false positives), and the keys of its
+# first layer, go check `modb.bloom`.
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+BLOOM_MIN_CAPACITY = 1024
+
+# `Database(hash_index=True)`, the keys per bucket of the hash index, on
+# average, go check `modb.hashindex`.
+HASH_BUCKET_SIZE = 64
+
 # for `.pretty` and `modb.util.make_indent`
 INDENT_TEMPLATE = " | "
@@ -1,3 +1,4 @@
+import math
 import struct
 from typing import List
 
@@ -56,6 +57,38 @@ class Bytes(Base):
         f.write(self.b)
 
 
+class Compressed(Base):
+    # a value stored compressed, method tells how (go check `modb.compress`).
+    def __init__(self, method: int, b: bytes):
+        self.method = method
+        self.b = b
+
+    @classmethod
+    def load(cls, f):
+        method = U8.load(f).n
+        data_length = U32.load(f).n
+
+        return cls(
+            method=method,
+            b=f.read(data_length),
+        )
+
+    def dump(self, f):
+        U8(self.method).dump(f)
+        U32(len(self.b)).dump(f)
+
+        f.write(self.b)
+
+
+# what is decompressed is a str, or bytes.
+class CompressedString(Compressed):
+    pass
+
+
+class CompressedBytes(Compressed):
+    pass
+
+
 class Boolean(Base):
     def __init__(self, value: bool):
         self.value = value
@@ -104,7 +137,29 @@ class Tree(Base):
         self.root_node.dump(f)
 
 
+class FilteredTree(Base):
+    # a Tree with a Bloom filter of its keys (go check `modb.bloom`), the
+    # filter is a Bytes blob at `bloom`.
+    def __init__(self, root_node: Pointer, bloom: Pointer):
+        self.root_node = root_node
+        self.bloom = bloom
+
+    @classmethod
+    def load(cls, f):
+        return cls(
+            root_node=Pointer.load(f),
+            bloom=Pointer.load(f),
+        )
+
+    def dump(self, f):
+        self.root_node.dump(f)
+        self.bloom.dump(f)
+
+
 class Number(Base):
+    # IEEE 754 binary32. note, not written anymore, the ints and the floats
+    # are Integer and Float64, the Number data of the files written before
+    # are still read (as floats).
     def __init__(
         self,
         n: int,
@@ -125,6 +180,86 @@ class Number(Base):
         )
 
 
+def zigzag_varint(n):
+    # the bytes of n (any int), go check Integer.
+    zigzag = n << 1 if n >= 0 else (-n << 1) - 1
+
+    data = bytearray()
+    while zigzag >= 0x80:
+        data.append(zigzag & 0x7f | 0x80)
+        zigzag >>= 7
+    data.append(zigzag)
+    return bytes(data)
+
+
+def unzigzag(zigzag):
+    return (zigzag >> 1) if zigzag & 1 == 0 else -(zigzag >> 1) - 1
+
+
+def read_zigzag_varint(blob, pos):
+    # the int at pos of blob, and where it ends.
+    zigzag = 0
+    shift = 0
+    while True:
+        byte = blob[pos]
+        pos += 1
+        zigzag |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return unzigzag(zigzag), pos
+
+
+class Integer(Base):
+    # an int of any size, exact. ZigZag-encoded first (0, -1, 1, -2, ...
+    # become 0, 1, 2, 3, ...), so the small negative ints are small too, then
+    # written 7 bits per byte, lowest bits first, the high bit of a byte
+    # telling that another one follows. an int in (-2**20, 2**20) takes 3
+    # bytes at most.
+    def __init__(
+        self,
+        n: int,
+    ):
+        self.n = n
+
+    @classmethod
+    def load(cls, f):
+        zigzag = 0
+        shift = 0
+        while True:
+            byte = f.read(1)[0]
+            zigzag |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+
+        return cls(
+            n=unzigzag(zigzag),
+        )
+
+    def dump(self, f):
+        f.write(zigzag_varint(self.n))
+
+
+class Float64(Base):
+    # IEEE 754 binary64, the python float itself, unlike Number.
+    def __init__(
+        self,
+        n: float,
+    ):
+        self.n = n
+
+    @classmethod
+    def load(cls, f):
+        return cls(
+            n=struct.unpack('>d', f.read(8))[0],
+        )
+
+    def dump(self, f):
+        f.write(
+            struct.pack('>d', self.n)
+        )
+
+
 class String(Base):
     def __init__(
         self,
@@ -152,20 +287,42 @@ class String(Base):
 
 
 class BNodeFormat(Base):
+    # note, the order of a file is in its header, the nodes of a file whose
+    # order is not BNODE_ORDER use a subclass, go check `make_node_format`.
     order = BNODE_ORDER
     capacity = order - 1
+    # except for the root node
+    min_capacity = math.ceil(order / 2) - 1
+
+    # index in NODE_FORMATS (Header.node_format)
+    code = 0
+
+    # whether the keys are inline, go check InlineBNodeFormat.
+    inlined = False
+
+    # whether every node has its own size, go check PackedBNodeFormat.
+    variable = False
+
+    # a node is nothing but `capacity` key pointers, `capacity` value pointers
+    # and `order` child pointers in a row, all of them big-endian U64. so one
+    # precompiled struct can decode or encode the whole node in a single
+    # read or write, instead of going through Pointer.load / Pointer.dump 190
+    # times (for order 64).
+    codec = struct.Struct(f'>{capacity * 2 + order}Q')
+    size = codec.size
 
     def __init__(
         self,
-        keys: List[Pointer],
-        values: List[Pointer],
-        children: List[Pointer],
+        keys: List[int],
+        values: List[int],
+        children: List[int],
     ):
 
-        p = Pointer(0)
-        self.keys = fill(keys, self.capacity, p)
-        self.values = fill(values, self.capacity, p)
-        self.children = fill(children, self.order, p)
+        # note, from now on the pointers are plain ints, not Pointer, there is
+        # no need to build one object per pointer just to read it or write it.
+        self.keys = fill(keys, self.capacity, 0)
+        self.values = fill(values, self.capacity, 0)
+        self.children = fill(children, self.order, 0)
 
         # note:
         # key pointer -> data (like number or string), used to compare
@@ -174,37 +331,544 @@ class BNodeFormat(Base):
 
     @classmethod
     def load(cls, f):
+        ptrs = cls.codec.unpack(
+            f.read(cls.size)
+        )
 
-        keys = [
-            Pointer.load(f)
-            for _ in range(cls.capacity)
-        ]
-        values = [
-            Pointer.load(f)
-            for _ in range(cls.capacity)
-        ]
-        children = [
-            Pointer.load(f)
-            for _ in range(cls.order)
-        ]
+        capacity = cls.capacity
 
         inst = cls(
-            keys=keys,
-            values=values,
-            children=children,
+            keys=list(ptrs[:capacity]),
+            values=list(ptrs[capacity:capacity * 2]),
+            children=list(ptrs[capacity * 2:]),
         )
 
         return inst
 
     def dump(self, f):
-        for i in self.keys:
-            i.dump(f)
+        f.write(
+            self.codec.pack(
+                *self.keys,
+                *self.values,
+                *self.children,
+            )
+        )
+
+    def slot_size(self):
+        # the space the node takes on the disk
+        return self.size
+
+
+# the inline part of a key (go check InlineBNodeFormat) is a tag, telling the
+# type of the key, then the key itself, encoded so that comparing the bytes
+# is comparing the keys (for strings and bytes).
+INLINE_NONE = 0
+INLINE_STRING = 1
+INLINE_NUMBER = 2
+INLINE_BYTES = 3
+# the ints of int64 range (a bigger one is never inline) and the floats,
+# exact. note, INLINE_NUMBER (binary32) is only found in the files written
+# before, see Number.
+INLINE_INTEGER = 4
+INLINE_FLOAT = 5
+
+# length of a key which does not fit, only its first INLINE_KEY_SIZE bytes
+# are inline.
+INLINE_TRUNCATED = 255
+
+
+def make_inline(value):
+    # return (tag, encoded key, complete) of a python key, or None if this
+    # type of key is not inlined.
+    type_ = type(value)
+
+    if type_ is str:
+        data = value.encode('utf-8')
+        return INLINE_STRING, data, len(data) <= INLINE_KEY_SIZE
+    elif type_ is int:
+        if -2 ** 63 <= value < 2 ** 63:
+            return INLINE_INTEGER, struct.pack('>q', value), True
+        return None
+    elif type_ is float:
+        return INLINE_FLOAT, struct.pack('>d', value), True
+    elif type_ is bytes:
+        return INLINE_BYTES, value, len(value) <= INLINE_KEY_SIZE
+
+    return None
+
+
+def inline_value(inline):
+    # the python key of a complete inline key.
+    tag, data, _ = inline
+
+    if tag == INLINE_STRING:
+        return data.decode('utf-8')
+    elif tag == INLINE_NUMBER:
+        return struct.unpack('>f', data)[0]
+    elif tag == INLINE_INTEGER:
+        return struct.unpack('>q', data)[0]
+    elif tag == INLINE_FLOAT:
+        return struct.unpack('>d', data)[0]
+    return data
+
+
+def inline_less(inline, other):
+    # whether the key (only its first INLINE_KEY_SIZE bytes are known) is
+    # less than other, a python key. None if the known bytes can't tell.
+    tag, prefix, _ = inline
+
+    other_inline = make_inline(other)
+    if other_inline is None or other_inline[0] != tag:
+        return None
+
+    data = other_inline[1]
+    other_prefix = data[:INLINE_KEY_SIZE]
+
+    if prefix != other_prefix:
+        return prefix < other_prefix
+    if len(data) <= INLINE_KEY_SIZE:
+        # other is the beginning of the key, which is longer.
+        return False
+    return None
+
+
+class InlineBNodeFormat(BNodeFormat):
+    # node format 1 (go check Header.node_format), the same pointers as
+    # BNodeFormat, followed by the keys themselves, (tag, length, first
+    # INLINE_KEY_SIZE bytes) per key. the whole key is there most of the
+    # time (length is not INLINE_TRUNCATED), so searching a node does not
+    # read any key data, and the first bytes decide most of the comparisons
+    # anyway.
+
+    # note, the key data is still written outside of the node, like it is
+    # with BNodeFormat.
+
+    code = 1
+    inlined = True
+
+    @staticmethod
+    def make_inline_attrs(capacity):
+        # the class attributes depending on the capacity, `inline_size` is
+        # what the keys take after the pointers. go check `make_node_format`.
+        inline_codec = struct.Struct('>' + f'BB{INLINE_KEY_SIZE}s' * capacity)
+        return {
+            'inline_codec': inline_codec,
+            'inline_size': inline_codec.size,
+        }
+
+    inline_codec = struct.Struct(
+        '>' + f'BB{INLINE_KEY_SIZE}s' * BNodeFormat.capacity
+    )
+    inline_size = inline_codec.size
+    size = BNodeFormat.size + inline_size
+
+    def __init__(
+        self,
+        keys: List[int],
+        values: List[int],
+        children: List[int],
+        inline: list = None,
+    ):
+        super().__init__(keys, values, children)
+
+        # (tag, encoded key, complete) or None per key, see make_inline.
+        self.inline = fill(list(inline or []), self.capacity, None)
+
+    @classmethod
+    def load(cls, f):
+        blob = f.read(cls.size)
+        ptrs = cls.codec.unpack_from(blob)
+        fields = cls.inline_codec.unpack_from(blob, cls.codec.size)
+
+        capacity = cls.capacity
+
+        inline = []
+        for idx in range(capacity):
+            tag, length, data = fields[idx * 3:idx * 3 + 3]
+            if tag == INLINE_NONE:
+                inline.append(None)
+            elif length == INLINE_TRUNCATED:
+                inline.append((tag, data, False))
+            else:
+                inline.append((tag, data[:length], True))
+
+        return cls(
+            keys=list(ptrs[:capacity]),
+            values=list(ptrs[capacity:capacity * 2]),
+            children=list(ptrs[capacity * 2:]),
+            inline=inline,
+        )
+
+    def dump(self, f):
+        super().dump(f)
 
-        for i in self.values:
-            i.dump(f)
+        fields = []
+        for inline in self.inline:
+            if inline is None:
+                fields += [INLINE_NONE, 0, b'']
+                continue
 
-        for i in self.children:
-            i.dump(f)
+            tag, data, complete = inline
+            fields += [
+                tag,
+                len(data) if complete else INLINE_TRUNCATED,
+                data[:INLINE_KEY_SIZE],
+            ]
+
+        f.write(self.inline_codec.pack(*fields))
+
+
+def front_code(inlines, size=None):
+    # the front-coded keys (go check PrefixBNodeFormat) of inlines, the
+    # inline slots of the keys of a node (see make_inline), in size bytes
+    # at most if given.
+    area = bytearray()
+    previous = None
+    count = len(inlines)
+    for idx, inline in enumerate(inlines):
+        room = None
+        if size is not None:
+            # at least one byte must be left for every key after this one.
+            room = size - len(area) - (count - idx - 1)
+
+        if inline is not None:
+            tag, data, _ = inline
+            shared = 0
+            if previous is not None and previous[0] == tag:
+                shared = common_prefix(previous[1], data)
+            rest = data[shared:]
+
+            if len(data) <= 255 and (room is None or 3 + len(rest) <= room):
+                area += bytes([tag, shared, len(rest)]) + rest
+                previous = (tag, data)
+                continue
+
+        area.append(INLINE_NONE)
+        previous = None
+
+    return bytes(area)
+
+
+def front_decode(blob, pos, count):
+    # the reverse of front_code, the inline slots of count keys front-coded
+    # at pos of blob, and where they end. the keys are rebuilt one by one,
+    # from the one before.
+    inline = []
+    previous = b''
+    for _ in range(count):
+        tag = blob[pos]
+        if tag == INLINE_NONE:
+            pos += 1
+            inline.append(None)
+            previous = b''
+            continue
+
+        shared, length = blob[pos + 1], blob[pos + 2]
+        pos += 3
+        previous = previous[:shared] + blob[pos:pos + length]
+        pos += length
+        inline.append((tag, previous, True))
+
+    return inline, pos
+
+
+def common_prefix(a, b):
+    # the length of the beginning a and b share
+    n = min(len(a), len(b))
+    for idx in range(n):
+        if a[idx] != b[idx]:
+            return idx
+    return n
+
+
+class PrefixBNodeFormat(InlineBNodeFormat):
+    # node format 2, the same pointers as BNodeFormat, followed by the keys
+    # front-coded: the keys of a node are sorted, so a key mostly starts
+    # like the one before it (think of `tenant/123/user/456/...`), only the
+    # length of the shared beginning and the rest are written. per key:
+    #       tag  shared  length  rest
+    #       U8   U8      U8      (length bytes)
+    # the key is the first `shared` bytes of the key before, then `rest`.
+    # the keys take the same space as with InlineBNodeFormat, but the long
+    # keys are whole, so searching a node does not read any key data.
+
+    # note, a key is not in the node (tag INLINE_NONE, nothing else) if it
+    # is longer than 255 bytes, or if the keys before it took all the space,
+    # it is read from its data (which is still written outside of the node,
+    # like it is with BNodeFormat), and the next key is written whole.
+
+    code = 2
+
+    @staticmethod
+    def make_inline_attrs(capacity):
+        return {
+            'inline_size': capacity * (2 + INLINE_KEY_SIZE),
+        }
+
+    inline_size = BNodeFormat.capacity * (2 + INLINE_KEY_SIZE)
+    size = BNodeFormat.size + inline_size
+
+    @classmethod
+    def load(cls, f):
+        blob = f.read(cls.size)
+        ptrs = cls.codec.unpack_from(blob)
+
+        capacity = cls.capacity
+        count = capacity - ptrs[:capacity].count(0)
+        inline, _ = front_decode(blob, cls.codec.size, count)
+
+        return cls(
+            keys=list(ptrs[:capacity]),
+            values=list(ptrs[capacity:capacity * 2]),
+            children=list(ptrs[capacity * 2:]),
+            inline=inline,
+        )
+
+    def dump(self, f):
+        BNodeFormat.dump(self, f)
+
+        count = self.capacity - self.keys.count(0)
+        area = front_code(self.inline[:count], self.inline_size)
+        f.write(area.ljust(self.inline_size, b'\0'))
+
+
+class PackedBNodeFormat(PrefixBNodeFormat):
+    # node format 3, every node takes the space it needs, not the space of a
+    # full node. rough layout:
+    #       slot  leaf  count  pointers  keys
+    #       U8    U8    U16    (varints) (front-coded)
+    # only the count keys, count values and count + 1 children (none for a
+    # leaf) are there. every pointer is written as the difference to the
+    # pointer before it (ZigZag varint, go check Integer), the nodes often
+    # point to data close to each other. the keys are front-coded as with
+    # PrefixBNodeFormat (without running out of space).
+
+    # a node has a slot of 2 ** slot bytes (MIN_SLOT at least) on the disk,
+    # and is written in place as long as it fits in its slot, otherwise it
+    # moves to a bigger one (the parent points to the new place). a slot
+    # twice as big as needed leaves room to grow, and the slots of the same
+    # size are reused by each other, go check `modb.freespace`.
+
+    code = 3
+    variable = True
+
+    MIN_SLOT = 64
+
+    head = struct.Struct('>BBH')
+
+    # no fixed size
+    size = None
+
+    @staticmethod
+    def make_inline_attrs(capacity):
+        return {
+            'inline_size': 0,
+        }
+
+    def __init__(
+        self,
+        keys: List[int],
+        values: List[int],
+        children: List[int],
+        inline: list = None,
+        slot: int = None,
+    ):
+        # note, no padding
+        self.keys = list(keys)
+        self.values = list(values)
+        self.children = list(children)
+        self.inline = list(inline or [None] * len(self.keys))
+
+        # the size of the slot of the node, if it has one already (loaded,
+        # or written in place).
+        self.slot = slot
+
+        self.blob = None
+
+    @classmethod
+    def load(cls, f):
+        power, leaf, count = cls.head.unpack(f.read(cls.head.size))
+        slot = 1 << power
+        blob = f.read(slot - cls.head.size)
+
+        ptrs = []
+        pos = 0
+        p = 0
+        for _ in range(count * 2 + (0 if leaf else count + 1)):
+            delta, pos = read_zigzag_varint(blob, pos)
+            p += delta
+            ptrs.append(p)
+        inline, _ = front_decode(blob, pos, count)
+
+        return cls(
+            keys=ptrs[:count],
+            values=ptrs[count:count * 2],
+            children=ptrs[count * 2:],
+            inline=inline,
+            slot=slot,
+        )
+
+    def encode(self):
+        # the node, after the head (see above).
+        if self.blob is None:
+            blob = bytearray()
+            previous = 0
+            for p in self.keys + self.values + self.children:
+                blob += zigzag_varint(p - previous)
+                previous = p
+            blob += front_code(self.inline[:len(self.keys)])
+            self.blob = bytes(blob)
+        return self.blob
+
+    @classmethod
+    def slot_of(cls, size):
+        return max(cls.MIN_SLOT, 1 << (size - 1).bit_length())
+
+    @classmethod
+    def max_slot_size(cls, inline, leaf):
+        # the slot a node with these keys (their inline slots) needs at most,
+        # whatever its pointers. used when the pointers are not known yet.
+        count = len(inline)
+        pointers = count * 2 + (0 if leaf else count + 1)
+        return cls.slot_of(
+            # note, the pointers are less than 2 ** 63, their differences
+            # take 10 bytes at most.
+            cls.head.size + pointers * 10 + len(front_code(inline))
+        )
+
+    def slot_size(self):
+        if self.slot is not None:
+            return self.slot
+        return self.slot_of(self.head.size + len(self.encode()))
+
+    def dump(self, f):
+        blob = self.encode()
+        slot = self.slot_size()
+        assert self.head.size + len(blob) <= slot, 'the node outgrew its slot'
+
+        f.write(
+            self.head.pack(
+                slot.bit_length() - 1,
+                0 if self.children else 1,
+                len(self.keys),
+            )
+            # the whole slot is taken, even at the end of the file.
+            + blob.ljust(slot - self.head.size, b'\0')
+        )
+
+
+# Header.node_format -> format of the nodes
+NODE_FORMATS = [
+    BNodeFormat,  # 0
+    InlineBNodeFormat,  # 1
+    PrefixBNodeFormat,  # 2
+    PackedBNodeFormat,  # 3
+]
+
+# the smallest and the biggest order a file can have. note, a node must be
+# able to hold at least one key once split.
+MIN_BNODE_ORDER = 4
+MAX_BNODE_ORDER = 4096
+
+# (format, order) -> format with that order, see make_node_format
+node_formats = {}
+
+
+def make_node_format(node_format, order):
+    # return node_format (one of NODE_FORMATS) with its own order, the
+    # pointers and the inline keys are resized accordingly.
+
+    if order == node_format.order:
+        return node_format
+
+    assert MIN_BNODE_ORDER <= order <= MAX_BNODE_ORDER, \
+        f'order must be in [{MIN_BNODE_ORDER}, {MAX_BNODE_ORDER}]'
+
+    name = (node_format, order)
+    if name not in node_formats:
+        capacity = order - 1
+        attrs = {
+            'order': order,
+            'capacity': capacity,
+            'min_capacity': math.ceil(order / 2) - 1,
+            'codec': struct.Struct(f'>{capacity * 2 + order}Q'),
+        }
+        attrs['size'] = attrs['codec'].size
+
+        if node_format.inlined:
+            attrs.update(node_format.make_inline_attrs(capacity))
+            attrs['size'] += attrs['inline_size']
+        if node_format.variable:
+            attrs['size'] = None
+
+        node_formats[name] = type(
+            f'{node_format.__name__}{order}',
+            (node_format,),
+            attrs,
+        )
+
+    return node_formats[name]
+
+
+def node_format_of(header):
+    # the format of the nodes of a file
+    return make_node_format(
+        NODE_FORMATS[header.node_format.n],
+        header.btree_order.n,
+    )
+
+
+class FreeMapFormat(Base):
+    # the free-space map of a file (go check `modb.freespace`), pointed by
+    # Header.free_map. rough layout:
+    #       tracks_blobs  U8
+    #       n  ( p  size )*n                  free extents
+    #       n  ( p  size  generation )*n      extents freed, not reusable yet
+    #       n  ( p )*n                        data shared by many keys
+    # n and size are U32, p and generation are U64 (big endian).
+
+    count = struct.Struct('>I')
+    extent = struct.Struct('>QI')
+    pending_extent = struct.Struct('>QIQ')
+    pointer = struct.Struct('>Q')
+
+    def __init__(self, tracks_blobs, free, pending, kept):
+        self.tracks_blobs = tracks_blobs
+        # [(p, size), ...]
+        self.free = free
+        # [(p, size, generation), ...]
+        self.pending = pending
+        # [p, ...]
+        self.kept = kept
+
+    @classmethod
+    def load(cls, f):
+        tracks_blobs = U8.load(f).n == 1
+
+        lists = []
+        for codec in [cls.extent, cls.pending_extent, cls.pointer]:
+            n, = cls.count.unpack(f.read(cls.count.size))
+            blob = f.read(codec.size * n)
+            lists.append(list(codec.iter_unpack(blob)))
+
+        free, pending, kept = lists
+        return cls(
+            tracks_blobs=tracks_blobs,
+            free=free,
+            pending=pending,
+            kept=[p for p, in kept],
+        )
+
+    def dump(self, f):
+        parts = [U8(1 if self.tracks_blobs else 0).to_bytes()]
+        for codec, items in [
+            (self.extent, self.free),
+            (self.pending_extent, self.pending),
+            (self.pointer, [(p,) for p in self.kept]),
+        ]:
+            parts.append(self.count.pack(len(items)))
+            parts += [codec.pack(*item) for item in items]
+        f.write(b''.join(parts))
 
 
 class Signature(Base):
@@ -230,41 +894,135 @@ class Signature(Base):
             f.write(c.encode())
 
 
+class RootExtras(Base):
+    # what the database tree has besides its nodes, pointed to by the
+    # header: its Bloom filter (go check `modb.bloom`) and its hash index
+    # (go check `modb.hashindex`), 0 if it has none.
+    size = 2 * U64.length
+
+    def __init__(self, bloom: Pointer, hash_index: Pointer):
+        self.bloom = bloom
+        self.hash_index = hash_index
+
+    @classmethod
+    def load(cls, f):
+        return cls(
+            bloom=Pointer.load(f),
+            hash_index=Pointer.load(f),
+        )
+
+    def dump(self, f):
+        self.bloom.dump(f)
+        self.hash_index.dump(f)
+
+
 class Header(Base):
+    # where root_node is in the file, so the root pointer can be swapped with
+    # one single write (go check `VirtualBNode.freeze`, copy-on-write mode).
+    root_node_offset = 3 + U16.length
+
+    # version 1 ('BTR') ends right after root_node. version 2 ('BT2') goes on
+    # with the generation (how many times the root pointer was swapped,
+    # right after root_node, so both are swapped with the same single write),
+    # the node format (index of NODE_FORMATS), the free-space map pointer
+    # (go check `modb.freespace`, 0 if there is none), the progress of the
+    # compaction pass (go check `VirtualBNode.compact`, 0 if there is none:
+    # where the pass moves the data from, and the pointer of the last key
+    # done), the shared compression dictionary pointer (go check
+    # `modb.compress`, 0 if there is none), the pointer of the RootExtras of
+    # the database tree (0 if there is none), then reserved bytes (zeros) up
+    # to `size`, for the fields to come.
+    size = 64
+    reserved_size = size - root_node_offset - 7 * U64.length - U8.length
+
     def __init__(
         self,
         signature: Signature,
         btree_order: U16,
         root_node: Pointer,
+        generation: U64 = None,
+        node_format: U8 = None,
+        free_map: Pointer = None,
+        compact_cut: Pointer = None,
+        compact_key: Pointer = None,
+        compress_dict: Pointer = None,
+        extras: Pointer = None,
+        reserved: bytes = b'',
     ):
         self.signature = signature
         self.btree_order = btree_order
         self.root_node = root_node
+        self.generation = generation or U64(0)
+        self.node_format = node_format or U8(0)
+        self.free_map = free_map or Pointer(0)
+        self.compact_cut = compact_cut or Pointer(0)
+        self.compact_key = compact_key or Pointer(0)
+        self.compress_dict = compress_dict or Pointer(0)
+        self.extras = extras or Pointer(0)
+        self.reserved = reserved
+
+    @property
+    def version(self):
+        return 2 if self.signature.name == 'BT2' else 1
 
     @classmethod
     def load(cls, f):
-        return cls(
+        header = cls(
             signature=Signature.load(f),
             btree_order=U16.load(f),
             root_node=Pointer.load(f),
         )
 
+        if header.version == 2:
+            header.generation = U64.load(f)
+            header.node_format = U8.load(f)
+            header.free_map = Pointer.load(f)
+            header.compact_cut = Pointer.load(f)
+            header.compact_key = Pointer.load(f)
+            header.compress_dict = Pointer.load(f)
+            header.extras = Pointer.load(f)
+            header.reserved = f.read(cls.reserved_size)
+
+        return header
+
     def dump(self, f):
         self.signature.dump(f)
         self.btree_order.dump(f)
-        self.root_node.dump(f)
+        self.dump_root(f)
+
+        if self.version == 2:
+            f.write(self.reserved.ljust(self.reserved_size, b'\0'))
+
+    def dump_root(self, f):
+        # root_node, and the other fields up to extras in version 2,
+        # with one single write, so the free-space map (and the compaction
+        # progress) always goes with the tree it describes. `f` must be at
+        # `root_node_offset`.
+        if self.version == 2:
+            f.write(
+                self.root_node.to_bytes()
+                + self.generation.to_bytes()
+                + self.node_format.to_bytes()
+                + self.free_map.to_bytes()
+                + self.compact_cut.to_bytes()
+                + self.compact_key.to_bytes()
+                + self.compress_dict.to_bytes()
+                + self.extras.to_bytes()
+            )
+        else:
+            self.root_node.dump(f)
 
 
 if __name__ == '__main__':
     b = BNodeFormat(
         keys=[
-            Pointer(10001),
+            10001,
         ],
         values=[
-            Pointer(10002),
+            10002,
         ],
         children=[
-            Pointer(10003),
+            10003,
         ],
     )
 
@@ -283,9 +1041,10 @@ if __name__ == '__main__':
     print('Done.')
 
 
-def make_header(root_node_ptr):
+def make_header(root_node_ptr, node_format=0, order=BNODE_ORDER):
     return Header(
-        signature=Signature('BTR'),
-        btree_order=U16(BNODE_ORDER),
+        signature=Signature('BT2'),
+        btree_order=U16(order),
         root_node=Pointer(root_node_ptr),
+        node_format=U8(node_format),
     )
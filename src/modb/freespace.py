@@ -0,0 +1,247 @@
+"""free-space manager, the space of the dropped nodes and of the data nobody
+points to anymore is reused by the next writes, instead of growing the file
+until the next vacuum."""
+
+# local imports
+from modb.format import FreeMapFormat
+from modb.util import f_seek_end
+
+
+# a free extent is filed under its size class, the position of the highest
+# bit of its size, so sizes in [2**c, 2**(c+1)) are in class c.
+SIZE_CLASSES = 40
+
+# what is left of an extent after an allocation is lost (until vacuum) if
+# it is smaller than this.
+MIN_EXTENT = 8
+
+# the map itself takes a power of two bytes, at least MIN_MAP_SIZE, so the
+# next one (a bit bigger, or smaller) mostly fits in the space of the
+# previous one.
+MIN_MAP_SIZE = 256
+
+
+def size_class(size):
+    return min(size.bit_length() - 1, SIZE_CLASSES - 1)
+
+
+def map_size(length):
+    # the space taken by a map of length bytes
+    return max(MIN_MAP_SIZE, 1 << (length - 1).bit_length())
+
+
+# when space is freed, the old version of the tree (the one on the disk) may
+# still point to it, so it is reusable only once a new version is committed
+# (by .freeze) without it. besides, in copy-on-write mode, the read-only
+# snapshots (go check `modb.readers`) may still read an old version, so the
+# space is tagged with the generation of the commit dropping it, and is
+# reusable once no snapshot is older than that generation.
+#
+# note, the data (keys and values) can be shared, a Data object inserted
+# under many keys (go check the FAQ, aliases). such data is never freed, it
+# is `kept`. the files written before the free-space map (whose sharing is
+# unknown) only get the space of their nodes back.
+
+
+class FreeSpace:
+    def __init__(self, tracks_blobs=True):
+        # whether the data (not only the nodes) can be freed, see above.
+        self.tracks_blobs = tracks_blobs
+
+        # the free extents, p -> size, and end -> p (to merge an extent with
+        # its free neighbours).
+        self.extents = {}
+        self.ends = {}
+
+        # size class -> {p: size, ...}
+        self.free = {}
+
+        # [(generation, p, size), ...], freed but not reusable yet.
+        self.pending = []
+
+        # pointers of the data shared by many keys
+        self.kept = set()
+
+        # where the map itself is written, and how many bytes it has there.
+        self.p = 0
+        self.size = 0
+
+        # the reader registry of the file, set by `modb.low.Database`.
+        self.readers = None
+
+        # if set, only the space before it is allocated, so nothing is
+        # written where `modb.low.VirtualBNode.compact` moves the data from.
+        self.limit = None
+
+    @classmethod
+    def load(cls, f, p):
+        f.seek(p)
+        free_map = FreeMapFormat.load(f)
+
+        inst = cls(tracks_blobs=free_map.tracks_blobs)
+        for extent_p, size in free_map.free:
+            # the free end of the file may be cut off (go check
+            # `modb.low.VirtualBNode.compact`) after the map is written.
+            size = min(size, f.end - extent_p)
+            if size > 0:
+                inst.add(extent_p, size)
+        # so may the pending ones, freed by the commit writing the map and
+        # free right after it.
+        for extent_p, size, generation in free_map.pending:
+            size = min(size, f.end - extent_p)
+            if size > 0:
+                inst.pending.append((generation, extent_p, size))
+        inst.kept = set(free_map.kept)
+        inst.p = p
+        # note, the size actually taken (see .write) may be bigger, the rest
+        # is lost until vacuum.
+        inst.size = map_size(f.tell() - p)
+        return inst
+
+    def add(self, p, size):
+        # merged with the free extents right before and right after it.
+
+        # note, an extent freed twice is free once.
+        if p in self.extents:
+            return
+
+        if p in self.ends:
+            before_p = self.ends[p]
+            size += self.remove(before_p)
+            p = before_p
+        if p + size in self.extents:
+            size += self.remove(p + size)
+
+        self.extents[p] = size
+        self.ends[p + size] = p
+        self.free.setdefault(size_class(size), {})[p] = size
+
+    def remove(self, p):
+        # remove the free extent at p, return its size.
+        size = self.extents.pop(p)
+        del self.ends[p + size]
+        del self.free[size_class(size)][p]
+        return size
+
+    def free_bytes(self):
+        return sum(self.extents.values())
+
+    def allocate(self, size):
+        # return the position of size free bytes, None if there is no such
+        # extent.
+
+        # note, the extents of the first class may be smaller than size,
+        # the first one of the other classes is taken (unless it is after
+        # .limit).
+        limit = self.limit
+        for c in range(size_class(size), SIZE_CLASSES):
+            extents = self.free.get(c)
+            if not extents:
+                continue
+
+            for p, extent_size in extents.items():
+                if extent_size >= size and (
+                    limit is None or p + size <= limit
+                ):
+                    break
+            else:
+                continue
+
+            extent_size = self.remove(p)
+            rest = extent_size - size
+            if rest >= MIN_EXTENT:
+                self.add(p + size, rest)
+            return p
+
+        return None
+
+    def allocate_first(self, size, before=None):
+        # same as .allocate, from the first big enough extent of the file
+        # (.limit or not), before `before` if given. used for the map, which
+        # is big and written by every .freeze, and by
+        # `modb.low.VirtualBNode.compact` when nothing fits before the limit,
+        # so nothing ends up in the way of the end of the file being cut
+        # off.
+        fitting = [
+            p for p, extent_size in self.extents.items()
+            if extent_size >= size
+            and (before is None or p + size <= before)
+        ]
+        if not fitting:
+            return None
+
+        p = min(fitting)
+        rest = self.remove(p) - size
+        if rest >= MIN_EXTENT:
+            self.add(p + size, rest)
+        return p
+
+    def release(self, p, size, generation):
+        # p is not used by the tree anymore from the commit of `generation`
+        # on.
+        if p in self.kept or p in self.extents:
+            return
+        self.pending.append((generation, p, size))
+
+    def keep(self, p):
+        # the data at p is shared from now on, it is never freed. note, it
+        # may be freed by the same operation (for example, the value
+        # returned by .delete is inserted under another key, go check the
+        # FAQ), before the commit.
+        self.kept.add(p)
+        self.pending = [
+            extent for extent in self.pending
+            if extent[1] != p
+        ]
+
+    def promote(self):
+        # the freed extents no snapshot can read become free. called right
+        # after a commit.
+        oldest = None
+        if self.readers is not None:
+            oldest = self.readers.oldest()
+
+        pending = []
+        for generation, p, size in self.pending:
+            if oldest is None or generation <= oldest:
+                self.add(p, size)
+            else:
+                pending.append((generation, p, size))
+        self.pending = pending
+
+    def write(self, f, generation):
+        # write the map (in free space if possible), return where it is.
+        # called by .freeze, right before the commit of `generation`.
+
+        # the map written by the last commit is freed by this one. note, even
+        # in thread-safe mode (where `modb.low.free` frees nothing), only the
+        # writer reads the map.
+        if self.p:
+            self.release(self.p, self.size, generation)
+
+        # note, the allocation below removes one extent at most (and adds one
+        # back at most), the map does not grow.
+        size = map_size(len(self.to_format().dumps()))
+        p = self.allocate_first(size)
+        if p is None:
+            p = f_seek_end(f)
+        else:
+            f.seek(p)
+
+        blob = self.to_format().dumps()
+        # the whole size is taken, even at the end of the file.
+        f.write(blob.ljust(size, b'\0'))
+        self.p = p
+        self.size = size
+        return p
+
+    def to_format(self):
+        return FreeMapFormat(
+            tracks_blobs=self.tracks_blobs,
+            free=list(self.extents.items()),
+            pending=[
+                (p, size, generation)
+                for generation, p, size in self.pending
+            ],
+            kept=sorted(self.kept),
+        )
@@ -0,0 +1,202 @@
+"""hash index of the keys of the database tree, an exact-key `search` reads
+one bucket (mostly in RAM already) instead of going down the tree. the
+ordered operations (`range`, `items`) keep using the tree."""
+
+import hashlib
+import struct
+
+# local imports
+from modb.constant import HASH_BUCKET_SIZE
+from modb.format import zigzag_varint
+
+# the type codes (go check `modb.low.TypeHelper.types`) of the keys
+STRING = 0
+BOOLEAN = 4
+BYTES = 5
+INTEGER = 9
+FLOAT64 = 10
+
+
+# linear hashing. the bucket of a key is its hash modulo 2**level, or modulo
+# 2**(level+1) if that bucket is split already (it is before `split`). once
+# the buckets hold HASH_BUCKET_SIZE keys on average, the bucket at `split` is
+# split in two, so the index grows one bucket at a time, nothing is ever
+# hashed again all at once.
+
+# note, a bucket is not merged back when its keys are deleted, .vacuum
+# builds the index again.
+
+# the directory and every bucket are Bytes data (go check
+# `VirtualBNode.write_hash_index`). rough layout,
+#       directory:  level  split  count  n  ( bucket )*n
+#       bucket:     ( key_p  value_p  length  key )*
+# bucket is the pointer of the bucket (0 for an empty one), key the bytes of
+# `index_key`, so a key is found without reading its data.
+
+head_struct = struct.Struct('>BQQQ')
+entry_struct = struct.Struct('>QQI')
+
+
+def index_key(key):
+    # the bytes of a key in the index, its type code then its value, None if
+    # key can not be a key. so True is not the key 1, like in the tree.
+    # (unlike `modb.bloom.key_bytes`, whose false positives are fine.)
+
+    # note, an integral float is the int key, the tree compares the numbers
+    # by value.
+    type_ = type(key)
+    if type_ is float and key.is_integer():
+        key = int(key)
+        type_ = int
+
+    if type_ is str:
+        return bytes([STRING]) + key.encode('utf-8')
+    elif type_ is bytes:
+        return bytes([BYTES]) + key
+    elif type_ is bool:
+        return bytes([BOOLEAN, key])
+    elif type_ is int:
+        return bytes([INTEGER]) + zigzag_varint(key)
+    elif type_ is float:
+        return bytes([FLOAT64]) + struct.pack('>d', key)
+    return None
+
+
+def hash_of(b):
+    return int.from_bytes(hashlib.blake2b(b, digest_size=8).digest(), 'big')
+
+
+class HashIndex:
+    def __init__(self, read=None):
+        # returns the blob of the bucket at a pointer, set by
+        # `VirtualBNode.load_hash_index`.
+        self.read = read
+
+        self.level = 0
+        self.split = 0
+        # how many keys are in the index
+        self.count = 0
+
+        # where the buckets are, and the ones in RAM, index of the bucket ->
+        # {key bytes: (key_p, value_p), ...}
+        self.pointers = [0]
+        self.buckets = {}
+
+        # the buckets changed since they were written, and whether the
+        # directory changed.
+        self.dirty_buckets = set()
+        self.dirty = True
+
+    def bucket_of(self, b):
+        h = hash_of(b)
+        idx = h % (1 << self.level)
+        if idx < self.split:
+            idx = h % (1 << (self.level + 1))
+        return idx
+
+    def bucket(self, idx):
+        bucket = self.buckets.get(idx)
+        if bucket is None:
+            p = self.pointers[idx]
+            bucket = self.loads_bucket(self.read(p)) if p else {}
+            self.buckets[idx] = bucket
+        return bucket
+
+    def get(self, key):
+        # (key_p, value_p) of key, None if key is not in the index.
+        b = index_key(key)
+        if b is None:
+            return None
+        return self.bucket(self.bucket_of(b)).get(b)
+
+    def set(self, key, key_p, value_p):
+        # add key, or give it another value (or key) pointer.
+        b = index_key(key)
+        idx = self.bucket_of(b)
+        bucket = self.bucket(idx)
+        if b not in bucket:
+            self.count += 1
+        bucket[b] = (key_p, value_p)
+        self.touch(idx)
+
+        if self.count > HASH_BUCKET_SIZE * len(self.pointers):
+            self.grow()
+
+    def remove(self, key):
+        b = index_key(key)
+        idx = self.bucket_of(b)
+        if self.bucket(idx).pop(b, None) is not None:
+            self.count -= 1
+            self.touch(idx)
+
+    def touch(self, idx):
+        self.dirty_buckets.add(idx)
+        self.dirty = True
+
+    def grow(self):
+        # split the bucket at .split, its keys stay or go to the new bucket
+        # (at the end, 2**level after it).
+        old = self.bucket(self.split)
+        new_idx = len(self.pointers)
+        self.pointers.append(0)
+
+        modulo = 1 << (self.level + 1)
+        stay = {}
+        new = {}
+        for b, entry in old.items():
+            if hash_of(b) % modulo == self.split:
+                stay[b] = entry
+            else:
+                new[b] = entry
+        self.buckets[self.split] = stay
+        self.buckets[new_idx] = new
+        self.touch(self.split)
+        self.touch(new_idx)
+
+        self.split += 1
+        if self.split == 1 << self.level:
+            self.level += 1
+            self.split = 0
+
+    def rewrite(self):
+        # every bucket is written again by the next .freeze, go check
+        # `VirtualBNode.compact`.
+        for idx in range(len(self.pointers)):
+            self.bucket(idx)
+            self.touch(idx)
+
+    def dumps_bucket(self, idx):
+        # b'' for an empty bucket
+        return b''.join(
+            entry_struct.pack(key_p, value_p, len(b)) + b
+            for b, (key_p, value_p) in self.bucket(idx).items()
+        )
+
+    @staticmethod
+    def loads_bucket(blob):
+        bucket = {}
+        pos = 0
+        while pos < len(blob):
+            key_p, value_p, length = entry_struct.unpack_from(blob, pos)
+            pos += entry_struct.size
+            bucket[blob[pos:pos + length]] = (key_p, value_p)
+            pos += length
+        return bucket
+
+    def dumps(self):
+        # the directory
+        n = len(self.pointers)
+        return (
+            head_struct.pack(self.level, self.split, self.count, n)
+            + struct.pack(f'>{n}Q', *self.pointers)
+        )
+
+    @classmethod
+    def loads(cls, blob, read):
+        inst = cls(read)
+        inst.level, inst.split, inst.count, n = head_struct.unpack_from(blob)
+        inst.pointers = list(
+            struct.unpack_from(f'>{n}Q', blob, head_struct.size)
+        )
+        inst.dirty = False
+        return inst
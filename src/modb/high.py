@@ -13,18 +13,88 @@ class Database:
 
     # go and check low.Database for more information
 
-    def __init__(self, filename, read_only=False):
+    def __init__(
+        self,
+        filename,
+        read_only=False,
+        use_mmap=False,
+        cache_nodes=None,
+        cache_bytes=None,
+        wal=None,
+        wal_group_ms=low.WAL_GROUP_MS,
+        copy_on_write=False,
+        thread_safe=False,
+        inline_keys=True,
+        prefix_keys=False,
+        packed_nodes=False,
+        prefetch_keys=False,
+        order=low.BNODE_ORDER,
+        compress=None,
+        compress_min_size=low.COMPRESS_MIN_SIZE,
+        compress_dict=None,
+        bloom_filter=False,
+        hash_index=False,
+    ):
         self.filename = filename
         self.read_only = read_only
+        self.use_mmap = use_mmap
+        self.cache_nodes = cache_nodes
+        self.cache_bytes = cache_bytes
+        self.wal = wal
+        self.wal_group_ms = wal_group_ms
+        self.copy_on_write = copy_on_write
+        self.thread_safe = thread_safe
+        self.inline_keys = inline_keys
+        self.prefix_keys = prefix_keys
+        self.packed_nodes = packed_nodes
+        self.prefetch_keys = prefetch_keys
+        self.order = order
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.compress_dict = compress_dict
+        self.bloom_filter = bloom_filter
+        self.hash_index = hash_index
 
         self.db = low.Database(
             filename=self.filename,
             read_only=self.read_only,
+            use_mmap=self.use_mmap,
+            cache_nodes=self.cache_nodes,
+            cache_bytes=self.cache_bytes,
+            wal=self.wal,
+            wal_group_ms=self.wal_group_ms,
+            copy_on_write=self.copy_on_write,
+            thread_safe=self.thread_safe,
+            inline_keys=self.inline_keys,
+            prefix_keys=self.prefix_keys,
+            packed_nodes=self.packed_nodes,
+            prefetch_keys=self.prefetch_keys,
+            order=self.order,
+            compress=self.compress,
+            compress_min_size=self.compress_min_size,
+            compress_dict=self.compress_dict,
+            bloom_filter=self.bloom_filter,
+            hash_index=self.hash_index,
         )
 
     def connect(self) -> low.VirtualBNode:
         return self.db.connect()
 
+    def bulk_load(self, pairs, fill_factor=1.0) -> low.VirtualBNode:
+        # fill the empty database with sorted key-value pairs, return the root
+        # node. way faster than calling insert again and again.
+
+        return self.db.bulk_load(
+            pairs,
+            fill_factor=fill_factor,
+        )
+
+    def snapshot(self) -> low.Snapshot:
+        # read-only mode, pin the last committed version of the file, go
+        # check low.Snapshot.
+
+        return self.db.snapshot()
+
     def close(self):
         # close the database file
 
@@ -2,9 +2,14 @@
 
 
 import bisect
+import contextlib
+import functools
 import mmap
 import os
 import io
+import struct
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from weakref import WeakValueDictionary
 import math
@@ -18,6 +23,12 @@ from modb import error
 from modb.format import *
 from modb.log import logger
 from modb.util import *
+from modb.bloom import BloomFilter
+from modb.hashindex import HashIndex
+from modb.compress import Codec
+from modb.freespace import FreeSpace
+from modb.readers import ReaderRegistry
+from modb.wal import Ref, WriteAheadLog, WAL_SUFFIX
 
 
 # note, in this source code, when I say `position` or `pointer`, they are the
@@ -34,6 +45,7 @@ from modb.util import *
 # rough layout of the this on-disk-database file format:
 #       Header:
 #           root btree-node pointer
+#           generation                       (version 2)
 #       then:                                (main part)
 #           ( btree-node | data )+
 # note, `+` means repeat previous thing arbitrary times
@@ -92,18 +104,401 @@ from modb.util import *
 # (type-code 0 means String in my spec)
 
 
-def write_data(f, data):
+def free(f, p, size):
+    # the size bytes at p are not used by the tree anymore, go check
+    # `modb.freespace`.
+
+    # note, not in thread-safe mode, the other threads may still hold a Data
+    # object of a replaced value (between .search and .get) or a node
+    # dropped by a merge (in the middle of .items), which must not be
+    # overwritten by anything else. the space freed before is still reused.
+    free_space = f.free_space
+    if free_space is not None and f.lock is None and p > 0:
+        free_space.release(p, size, f.header.generation.n + 1)
+
+
+def free_data(f, data):
+    # the data (a key or a value) is not used by the tree anymore.
+
+    # note, the trees and the arrays are not freed, nor the data of the files
+    # whose shared data is unknown.
+    free_space = f.free_space
+    if (
+        free_space is None
+        or not free_space.tracks_blobs
+        or data.p.n in free_space.kept
+    ):
+        return
+
+    size = data_size(f, data.p.n)
+    if size is not None:
+        free(f, data.p.n, size)
+
+
+def keep(f, data):
+    # the data is shared (inserted as a Data object), it must not be freed.
+    if f.free_space is not None:
+        f.free_space.keep(data.p.n)
+
+
+def data_size(f, p):
+    # the size of the data at p (type-code included), None for a tree or an
+    # array.
+    f.seek(p)
+    type_ = TypeHelper.types[U8.load(f).n]
+
+    if type_ in [String, Bytes]:
+        return U8.length + U32.length + U32.load(f).n
+    elif type_ in [CompressedString, CompressedBytes]:
+        # the method code, then the length
+        f.seek(p + 2 * U8.length)
+        return 2 * U8.length + U32.length + U32.load(f).n
+    elif type_ is Number:
+        return U8.length + 4
+    elif type_ is Integer:
+        # as many bytes as the int needs
+        Integer.load(f)
+        return f.tell() - p
+    elif type_ is Float64:
+        return U8.length + 8
+    elif type_ is Boolean:
+        return U8.length + U8.length
+    elif type_ is Empty:
+        return U8.length
+    return None
+
+
+def vacuum_data(src, p, f, link_table, kept):
+    # copy the value at p of src to the current position of f (the file
+    # written by `VirtualBNode.vacuum`), return where it is in f.
+
+    # note, a tree or an array goes right there, its head first, then what
+    # it holds, so it stays next to the node holding it.
+
+    if p in link_table:
+        # shared by many keys (or elements), copied once.
+        kept.add(link_table[p])
+        return link_table[p]
+
+    new_p = f.tell()
+    size = data_size(src, p)
+    if size is not None:
+        src.seek(p)
+        f.write(src.read(size))
+        link_table[p] = new_p
+        return new_p
+
+    src.seek(p)
+    obj = TypeHelper.load(src)
+
+    # note, the head is written once what it points to is, its space (and
+    # the space of the pointers of an array) is taken right away, go check
+    # `VirtualBNode._vacuum`.
+    if type(obj) is VirtualBNode:
+        # the filter (go check `modb.bloom`) is built again on the way, and
+        # written right after the tree.
+        bloom = None
+        head_size = U8.length + Pointer.length
+        if obj.bloom is not None or src.bloom_filter:
+            bloom = obj.new_bloom()
+            head_size += Pointer.length
+
+        f.write(bytes(head_size))
+        root_p = obj._vacuum(f, link_table, kept, bloom)
+
+        bloom_p = None
+        if bloom is not None:
+            bloom_p = TypeHelper.dump(bloom.dumps(), f)
+
+        end = f.tell()
+        f.seek(new_p)
+        TypeHelper.make_tree_type(f, root_p, bloom_p)
+    else:
+        # the head, the pointers, then the elements
+        head = Array(
+            power=U8(obj.power),
+            length=U32(obj.length),
+            start=Pointer(0),
+        )
+        head.start = Pointer(new_p + U8.length + len(head.dumps()))
+        max_length = max_array_length(obj.power)
+
+        f.write(bytes(head.start.n + max_length * Pointer.length - new_p))
+        ptrs = [
+            vacuum_data(src, obj.access(idx).p.n, f, link_table, kept)
+            for idx in range(obj.length)
+        ]
+
+        end = f.tell()
+        f.seek(new_p)
+        U8(TypeHelper.types.index(Array)).dump(f)
+        head.dump(f)
+        for ptr in fill(ptrs, max_length, 0):
+            Pointer(ptr).dump(f)
+
+    f.seek(end)
+    link_table[p] = new_p
+    return new_p
+
+
+def inline_of(key):
+    # the inline slot (go check `InlineBNodeFormat`) of a key Data object.
+    if key.cached is None and key.inline is not None:
+        return key.inline
+    return make_inline(key.get(using_cache=True))
+
+
+def write_data(f, data, codec=None):
     # write data(key or value) to the disk
     # , then return the start position of that data
 
+    # the values are written with the Codec of the file (f.codec), the str
+    # and bytes ones may be compressed, go check `modb.compress`. the keys
+    # are never compressed, they are compared all the time.
+
+    # free space first (go check `modb.freespace`), only for the flat types,
+    # the others (dict and list) write more than one thing.
+
+    # note, not with the write-ahead log, the log tells the data written
+    # after the last checkpoint (which may be lost by a crash) by its
+    # position, after the end of the file at the checkpoint.
+    free_space = f.free_space
+    if (
+        free_space is not None
+        and f.wal is None
+        and type(data) in [str, int, float, bytes, bool, type(None)]
+    ):
+        buffer = io.BytesIO()
+        TypeHelper.dump(data, buffer, codec)
+        blob = buffer.getvalue()
+
+        blob_p = free_space.allocate(len(blob))
+        if blob_p is not None:
+            # a Data object of what was there before is not valid anymore.
+            Data.ref.pop((blob_p, f), None)
+            f.seek(blob_p)
+            f.write(blob)
+            return blob_p
+
     f_seek_end(f)
     # ---------------------------------
-    blob_p = TypeHelper.dump(data, f)
+    blob_p = TypeHelper.dump(data, f, codec)
     # ---------------------------------
 
     return blob_p
 
 
+def read_data(f, p):
+    # the data at p, as a python value.
+    f.seek(p)
+    return TypeHelper.load(f)
+
+
+def write_blob(f, data, old_p=0):
+    # write data (bytes) in place of the Bytes data at old_p (0 if none),
+    # return where it is. used for what a tree has besides its nodes (its
+    # Bloom filter, its hash index), which only the tree points to.
+
+    # note, in place if it takes the same space (not in copy-on-write
+    # mode), otherwise somewhere else (free space first), and the old space
+    # is freed. like a node (go check `VirtualBNode.seek_written_position`),
+    # if it is where .compact moves the data from, it goes before, or stays.
+    buffer = io.BytesIO()
+    TypeHelper.dump(data, buffer)
+    blob = buffer.getvalue()
+
+    old_size = data_size(f, old_p) if old_p else 0
+    free_space = f.free_space
+    in_place = old_size == len(blob) and not f.copy_on_write
+    moving = (
+        old_p
+        and free_space is not None
+        and free_space.limit is not None
+        and old_p + old_size > free_space.limit
+    )
+
+    new_p = None
+    if in_place and not moving:
+        new_p = old_p
+    if new_p is None and free_space is not None:
+        new_p = free_space.allocate(len(blob))
+        if new_p is None and free_space.limit is not None:
+            new_p = free_space.allocate_first(
+                len(blob),
+                before=old_p if moving else None,
+            )
+    if new_p is None and in_place:
+        # no room before, left to the next pass.
+        new_p = old_p
+
+    if new_p is None:
+        new_p = f_seek_end(f)
+    else:
+        if new_p != old_p:
+            # a Data object of what was there before is not valid anymore.
+            Data.ref.pop((new_p, f), None)
+        f.seek(new_p)
+    f.write(blob)
+
+    if old_p and new_p != old_p:
+        free(f, old_p, old_size)
+    return new_p
+
+
+def reading(method):
+    # thread-safe mode (`Database(thread_safe=True)`), method only reads, it
+    # runs along with the other readers, never along with a writer.
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.f.lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+
+        lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+
+    return wrapper
+
+
+def reading_steps(method):
+    # same as `reading`, for the generators (.items, .range). the lock is
+    # only held while the next item is computed, so the caller can do
+    # anything (writes included) between two items.
+
+    # note, a write in between may make the stream skip or repeat some keys,
+    # like it does without thread-safe mode.
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.f.lock
+        if lock is None:
+            yield from method(self, *args, **kwargs)
+            return
+
+        it = method(self, *args, **kwargs)
+        while True:
+            lock.acquire_read()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                lock.release_read()
+
+            yield item
+
+    return wrapper
+
+
+def writing(method):
+    # thread-safe mode, method modifies the tree (or the file), it runs
+    # alone.
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.f.lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+
+        lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_write()
+
+    return wrapper
+
+
+def freezing(method):
+    # thread-safe mode, for .freeze. it runs alone among the writers, but the
+    # readers keep running, the parts they must not see are done in
+    # `exclusively(f)`. go check `RWLock.acquire_freeze`.
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.f.lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+
+        lock.acquire_freeze()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_freeze()
+
+    return wrapper
+
+
+def exclusively(f):
+    # context of the few steps of a freeze which run alone, the readers wait
+    # for them (nothing happens without thread-safe mode).
+    if f.lock is None:
+        return contextlib.nullcontext()
+    return f.lock.writing()
+
+
+def wal_record(f, op, target_p, *args):
+    # append a record to the write-ahead log (if enabled) of f, target_p names
+    # the tree or the array the operation is done on. go check `modb.wal` and
+    # `Database.replay` for more information.
+
+    wal = f.wal
+    if wal is None or wal.paused:
+        return
+
+    wal.append(
+        (op, target_p, *[wal_encode(arg, wal) for arg in args])
+    )
+
+
+def wal_encode(value, wal):
+    # make the logged value picklable, Data objects are the only problem.
+
+    type_ = type(value)
+
+    if type_ is Data:
+        # the pointed data is in the database file for sure, log the pointer.
+        if value.p.n < wal.checkpoint_end:
+            return Ref(value.p.n)
+
+        content = value.get()
+        if type(content) in [VirtualBNode, VirtualArray]:
+            # written by a logged operation after the checkpoint, replay
+            # knows where it is written again.
+            return Ref(value.p.n)
+
+        # may be lost in a crash, log the content instead (this just loses
+        # the link, not the data).
+        return content
+
+    elif type_ in [list, tuple]:
+        return type_(wal_encode(el, wal) for el in value)
+    elif type_ is dict:
+        return {k: wal_encode(v, wal) for k, v in value.items()}
+
+    return value
+
+
+def wal_decode(value, f, ptrs):
+    # the reverse of wal_encode, ptrs maps the logged pointers to the ones
+    # written by the replay.
+
+    type_ = type(value)
+
+    if type_ is Ref:
+        return Data(Pointer(ptrs.get(value.p, value.p)), f)
+    elif type_ in [list, tuple]:
+        return type_(wal_decode(el, f, ptrs) for el in value)
+    elif type_ is dict:
+        return {k: wal_decode(v, f, ptrs) for k, v in value.items()}
+
+    return value
+
+
 class TypeHelper:
     # this class load and dump every typed value , plus type conversion between
     # my own types and python types. for example, when you do insert, your
@@ -142,11 +537,19 @@ class TypeHelper:
         Boolean,  # 4
         Bytes,  # 5
         Array,  # 6
+        CompressedString,  # 7
+        CompressedBytes,  # 8
+        Integer,  # 9
+        Float64,  # 10
+        FilteredTree,  # 11
     ]
     # note, you may go and read the docs for more information.
 
     @classmethod
     def load(cls, f):
+        # where the data starts (type-code included), which is the pointer of
+        # the Data object.
+        data_p = f.tell()
         code = U8.load(f).n
         type_ = cls.types[code]
         start_p = f.tell()
@@ -155,9 +558,9 @@ class TypeHelper:
         # convert my format type to python type for user convenience.
         if type_ is String:
             result = obj.s
-        elif type_ is Number:
+        elif type_ in [Number, Integer, Float64]:
             result = obj.n
-        elif type_ is Tree:
+        elif type_ in [Tree, FilteredTree]:
             # very special. we just load it as the VirtualBNode's instance right
             # now because TypeHelper.load is only called when value.get() is
             # called.
@@ -167,7 +570,10 @@ class TypeHelper:
                 f=f,
                 node_p=root_node_p,
                 parent=None,
+                data_p=data_p,
             )
+            if type_ is FilteredTree:
+                vnode.load_bloom(obj.bloom.n)
             vnode.access()
             result = vnode
         elif type_ is Empty:
@@ -180,7 +586,12 @@ class TypeHelper:
             result = VirtualArray(
                 f=f,
                 array_p=start_p,
+                data_p=data_p,
             )
+        elif type_ is CompressedString:
+            result = f.codec.decompress(obj.method, obj.b).decode('utf-8')
+        elif type_ is CompressedBytes:
+            result = f.codec.decompress(obj.method, obj.b)
         else:
             # this else-branch will never be called.
             pass
@@ -189,12 +600,16 @@ class TypeHelper:
 
     # deprecated from version 2022y 4m 21d on
     @classmethod
-    def make_tree_type(cls, f, root_node_p):
+    def make_tree_type(cls, f, root_node_p, bloom_p=None):
+        # bloom_p is the pointer of the Bloom filter of the tree (0 for an
+        # empty one), None if the tree has no filter, go check `modb.bloom`.
         tree_p = f.tell()
-        code = cls.types.index(Tree)
-        U8(code).dump(f)
-
-        Tree(Pointer(root_node_p)).dump(f)
+        if bloom_p is None:
+            head = Tree(Pointer(root_node_p))
+        else:
+            head = FilteredTree(Pointer(root_node_p), Pointer(bloom_p))
+        U8(cls.types.index(type(head))).dump(f)
+        head.dump(f)
 
         return tree_p
 
@@ -211,30 +626,73 @@ class TypeHelper:
         # create an empty tree(of course, BNodeFormat), the process of building
         # the tree is very close to the original tree of the database when you
         # first init the database file.
-        BNodeFormat(
+        f.node_format(
             keys=[],
             values=[],
             children=[],
         ).dump(f)
 
-        return TypeHelper.make_tree_type(f, root_node_p)
+        return TypeHelper.make_tree_type(
+            f,
+            root_node_p,
+            0 if f.bloom_filter else None,
+        )
+
+    @classmethod
+    def dump_head(cls, obj, f):
+        # write the data pointing to the tree (its root node) or the array
+        # (its elements) obj at the current position, used when obj is moved.
+
+        if type(obj) is VirtualBNode and obj.bloom is not None:
+            head = FilteredTree(Pointer(obj.node_p), Pointer(obj.bloom_p))
+        elif type(obj) is VirtualBNode:
+            head = Tree(Pointer(obj.node_p))
+        else:
+            head = Array(
+                power=U8(obj.power),
+                length=U32(obj.length),
+                start=Pointer(obj.start_p),
+            )
+
+        U8(cls.types.index(type(head))).dump(f)
+        head.dump(f)
 
     @classmethod
-    def dump(cls, data, f):
+    def compressed(cls, codec, type_, b):
+        # b compressed by codec, as a type_ (CompressedString or
+        # CompressedBytes) object, None if it is written as it is.
+        if codec is None:
+            return None
+
+        compressed = codec.compress(b)
+        if compressed is None:
+            return None
+        return type_(*compressed)
+
+    @classmethod
+    def dump(cls, data, f, codec=None):
         # the reverse method to the load
 
+        # note, codec (go check `modb.compress`) is given for the values
+        # only, see `write_data`.
+
         type_ = type(data)
 
         if type_ is str:
-            obj = String(data)
-        elif type_ in [int, float]:
-            obj = Number(data)
+            obj = (
+                cls.compressed(codec, CompressedString, data.encode('utf-8'))
+                or String(data)
+            )
+        elif type_ is int:
+            obj = Integer(data)
+        elif type_ is float:
+            obj = Float64(data)
         elif type_ is type(None):
             obj = Empty()
         elif type_ is bool:
             obj = Boolean(data)
         elif type_ is bytes:
-            obj = Bytes(data)
+            obj = cls.compressed(codec, CompressedBytes, data) or Bytes(data)
         elif type_ is list:
             length = len(data)
             power = math.ceil(
@@ -255,7 +713,8 @@ class TypeHelper:
                         Pointer(
                             write_data(
                                 f,
-                                el
+                                el,
+                                codec,
                             )
                         )
                     )
@@ -280,12 +739,15 @@ class TypeHelper:
 
         elif type_ is dict:
             root_node_p = f_seek_end(f)
-            BNodeFormat(
+            f.node_format(
                 keys=[],
                 values=[],
                 children=[],
             ).dump(f)
-            obj = Tree(Pointer(root_node_p))
+            if f.bloom_filter:
+                obj = FilteredTree(Pointer(root_node_p), Pointer(0))
+            else:
+                obj = Tree(Pointer(root_node_p))
 
             code = cls.types.index(type(obj))
             data_p = f.tell()
@@ -299,12 +761,33 @@ class TypeHelper:
             ).get()
             vnode.access()
 
-            for k, v in data.items():
-                vnode.insert(
-                    key=k,
-                    value=v,
-                )
-            vnode.freeze()
+            # the pairs are part of the value, only the operation which
+            # writes the whole value is logged (if the write-ahead log is
+            # enabled).
+            wal = f.wal
+            if wal is not None:
+                wal.paused += 1
+            try:
+                for k, v in data.items():
+                    vnode.insert(
+                        key=k,
+                        value=v,
+                    )
+            finally:
+                if wal is not None:
+                    wal.paused -= 1
+
+            # note, not .freeze, which is a checkpoint of the whole database
+            # when the log is enabled. this tree is brand new, writing it
+            # does not touch anything else.
+            vnode._freeze()
+
+            if vnode.write_bloom() or vnode.node_p != root_node_p:
+                # copy-on-write mode, the root node moved already (or the
+                # filter is written). nothing points to this brand new tree
+                # yet, patch it in place.
+                f.seek(data_p)
+                cls.dump_head(vnode, f)
 
             return data_p
 
@@ -341,6 +824,15 @@ class Data:
         f,
         cached=None,
     ):
+        if 'p' in self.__dict__:
+            # this one is the old (cached) one returned by __new__, do not
+            # reset it, otherwise re-accessing a node (for example, after the
+            # node is evicted from the node cache) would throw away the cached
+            # key or the cached subtree held by this object.
+            if cached is not None:
+                self.cached = cached
+            return
+
         self.p = p
         self.f = f
         self.cached = cached
@@ -358,6 +850,18 @@ class Data:
         # note, like the .is_tree one, this marker will be only set when calling
         # the Data.get once.
 
+        # where self is stored as a value, the root node of the tree (or the
+        # VirtualArray) holding it, and the key Data (or the index) it is
+        # stored under. only used for tree-typed and array-typed values, which
+        # move on .freeze in copy-on-write mode, go check .relocate.
+        self.owner = None
+        self.owner_key = None
+
+        # the first bytes of the key, if self is a key too long to be inline
+        # (go check `modb.format.InlineBNodeFormat`), enough for most of the
+        # comparisons without loading self.
+        self.inline = None
+
         # do a cache on itself, check __new__ for more information
         Data.ref[p.n, f] = self
 
@@ -417,12 +921,22 @@ class Data:
 
             using_cache = True
 
-        if all([
-            self.cached,
-            using_cache,
-        ]):
+        # note, `is not None`, a cached '' or 0 is cached too.
+        if self.cached is not None and using_cache:
             return self.cached
 
+        lock = self.f.lock
+        if lock is None:
+            return self._get(using_cache)
+
+        # thread-safe mode, go check `Database(thread_safe=True)`
+        lock.acquire_read()
+        try:
+            return self._get(using_cache)
+        finally:
+            lock.release_read()
+
+    def _get(self, using_cache):
         f = self.f
         p = self.p.n
 
@@ -442,6 +956,21 @@ class Data:
         if is_array:
             self.is_array = True
 
+        if (is_tree or is_array) and f.access_lock is not None:
+            with f.access_lock:
+                # thread-safe mode, another thread may have loaded it in the
+                # meantime, there must be only one in-memory tree (array).
+                if self.cached is not None:
+                    return self.cached
+                data.source = self
+                self.cached = data
+            return data
+
+        if is_tree or is_array:
+            # keep self alive as long as the tree (or the array) is, self
+            # knows where it is stored (go check .relocate).
+            data.source = self
+
         if (
             is_tree
             or is_array
@@ -451,6 +980,96 @@ class Data:
 
         return data
 
+    def relocate(self, obj):
+        # the tree or the array (obj) self points to is written somewhere else
+        # (copy-on-write mode, go check `VirtualBNode.freeze`). write a new
+        # Data pointing to the new place, and store it in place of self in
+        # the owner, which makes the owner modified in turn. so the change
+        # goes up to the root of the database, whose pointer in the header is
+        # swapped in the end.
+
+        f = self.f
+        owner = self.owner
+
+        if owner is None:
+            # no idea where self is stored (for example, the value is deleted
+            # in the meantime), patch self in place instead.
+            f.seek(self.p.n)
+            TypeHelper.dump_head(obj, f)
+            return self
+
+        buffer = io.BytesIO()
+        TypeHelper.dump_head(obj, buffer)
+        head = buffer.getvalue()
+
+        # free space first (go check `modb.freespace`), and the old head is
+        # not used by the new version of the owner.
+        free_space = f.free_space
+        new_p = None
+        if free_space is not None:
+            new_p = free_space.allocate(len(head))
+            if free_space.tracks_blobs:
+                free(f, self.p.n, len(head))
+
+        if new_p is None:
+            new_p = f_seek_end(f)
+        else:
+            # a Data object of what was there before is not valid anymore.
+            Data.ref.pop((new_p, f), None)
+            f.seek(new_p)
+        f.write(head)
+
+        new = Data(
+            Pointer(new_p),
+            f,
+            cached=obj,
+        )
+        new.is_tree = self.is_tree
+        new.is_array = self.is_array
+        new.owner = owner
+        new.owner_key = self.owner_key
+
+        obj.data_p = new_p
+        obj.source = new
+        if type(obj) is VirtualArray:
+            obj.array_p = new_p + U8.length
+
+        if type(owner) is VirtualArray:
+            if owner.access(self.owner_key) is self:
+                owner.container[self.owner_key] = new
+                f.dirty_roots[owner] = None
+
+        else:
+            try:
+                node, idx = owner._search(
+                    self.owner_key.get(using_cache=True),
+                )
+            except error.KeyNotFound:
+                # deleted in the meantime, nothing holds obj anymore.
+                pass
+            else:
+                if node.values[idx] is self:
+                    node.values[idx] = new
+                    node.modified = True
+                    owner.indexed(
+                        self.owner_key.get(using_cache=True),
+                        node.keys[idx],
+                        new,
+                    )
+
+        return new
+
+    def equals(self, key):
+        # whether self (a key) is key, a python key.
+        if (
+            self.inline is not None
+            and self.cached is None
+            and inline_less(self.inline, key) is not None
+        ):
+            # the first bytes are not the same, or key is shorter.
+            return False
+        return self.get(using_cache=True) == key
+
     def __getattr__(self, key):
         return self.__getitem__(key)
     
@@ -467,6 +1086,10 @@ class Data:
         # implementation.
 
         if type(other) in [str, int, float, bytes]:
+            if self.inline is not None and self.cached is None:
+                less = inline_less(self.inline, other)
+                if less is not None:
+                    return less
             return self.get(using_cache=True) < other
         elif type(other) is Data:
             return self.get(using_cache=True) < other.get(using_cache=True)
@@ -481,10 +1104,96 @@ class MyIO:
     # `MyIO.change_f`, since `vacuum` method will create a new copy of current
     # database file , then a switch from old `f` to new `f` should be done.
 
+    # besides, MyIO keeps its own file position and end-of-file, and a
+    # write-behind buffer for the data appended to the end of the file.
+    # `write_data`, `TypeHelper.dump` and `seek_written_position` seek to the
+    # end again and again, and the format classes do many tiny writes, with
+    # this buffer none of them is a syscall anymore. the buffer is written to
+    # the real file in big sequential chunks (`modb.constant.WRITE_BUFFER_SIZE`)
+    # , or when .flush is called (.freeze and .close do that).
+
+    # note, reading a not-yet-flushed region is served from the buffer, so
+    # callers never notice the buffer.
+
     def __init__(self, f):
         # real one
         self.f = f
 
+        # NodeCache or None, shared by every VirtualBNode using this file.
+        # set by `Database` if a node cache budget is given.
+        self.node_cache = None
+
+        # WriteAheadLog or None, set by `Database` if the log is enabled.
+        self.wal = None
+
+        # set by `Database(copy_on_write=True)`, .freeze never writes a node
+        # in place, go check `VirtualBNode.freeze`.
+        self.copy_on_write = False
+
+        # root nodes (of the database and of the nested trees) and arrays
+        # holding modifications which are not frozen yet, so .freeze only
+        # visits those instead of every accessed node. go check
+        # `VirtualBNode.mark_dirty`.
+        # note, a dict is used as an ordered set.
+        self.dirty_roots = {}
+
+        # the Header of the file, set by `Database`. copy-on-write .freeze
+        # swaps its root_node and generation.
+        self.header = None
+
+        # format of the nodes of the file (go check Header.node_format), set
+        # by `Database`.
+        self.node_format = BNodeFormat
+
+        # if set, the keys of a node are all read when the node is accessed,
+        # go check `VirtualBNode.prefetch_keys`.
+        self.prefetch_keys = False
+
+        # the free-space manager, set by `Database` (None in read-only mode
+        # and for the files of version 1), go check `modb.freespace`.
+        self.free_space = None
+
+        # the Codec the values are written with and read with, set by
+        # `Database`, go check `modb.compress`.
+        self.codec = None
+
+        # set by `Database(bloom_filter=True)`, the new trees get a Bloom
+        # filter of their keys, go check `modb.bloom`.
+        self.bloom_filter = False
+
+        # set by `Database(hash_index=True)`, .vacuum adds a hash index to
+        # the database tree, go check `modb.hashindex`.
+        self.hash_index = False
+
+        # thread-safe mode only (go check `ThreadSafeIO`), RWLock taken by
+        # the public methods of the trees and arrays, and the lock of the
+        # lazy .access of the nodes.
+        self.lock = None
+        self.access_lock = None
+
+        self.reset()
+
+    def reset(self):
+        # (re)start tracking self.f, called when self.f is set.
+
+        # the logical position, what .tell returns.
+        self.position = 0
+
+        # where the real file object is, so we can skip redundant f.seek.
+        # (note, mmap.seek returns None before python 3.13, so .tell)
+        self.f.seek(0, io.SEEK_END)
+        self.f_position = self.f.tell()
+
+        # the logical end of the file (not-yet-flushed data included).
+        self.end = self.f_position
+
+        # the write-behind buffer holds the bytes in [flushed_end, end)
+        self.flushed_end = self.end
+        self.buffer = bytearray()
+
+        # set if something was written since the last flush.
+        self.dirty = False
+
     @property
     def name(self):
         return self.f.name
@@ -494,37 +1203,468 @@ class MyIO:
         # file-used on the fly.
 
         # make sure old one will be closed
-        self.f.close()
+        self.close()
         self.f = new_f
+        self.reset()
 
     def tell(self):
-        return self.f.tell()
+        return self.position
 
     def seek(self, offset, whence=io.SEEK_SET):
-        p = self.f.seek(offset, whence)
-        return p
+        # no syscall at all, the real seek is done when really needed.
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.end + offset
+
+        return self.position
+
+    def read_f(self, p, size):
+        # read from the real file object
+        if self.f_position != p:
+            self.f.seek(p)
 
-    def read(self, size):
         contents = self.f.read(size)
+        self.f_position = p + len(contents)
+
         return contents
 
-    def write(self, b):
+    def write_f(self, p, b):
+        # write to the real file object
+        if self.f_position != p:
+            self.f.seek(p)
+
         self.f.write(b)
+        self.f_position = p + len(b)
+
+    def read(self, size=-1):
+        start = self.position
+        end = self.end if size < 0 else min(start + size, self.end)
+
+        if end <= start:
+            return b''
+
+        self.position = end
+        flushed_end = self.flushed_end
+
+        if end <= flushed_end:
+            # most of the time
+            return self.read_f(start, end - start)
+
+        if start >= flushed_end:
+            # not flushed yet
+            return bytes(
+                self.buffer[start - flushed_end:end - flushed_end]
+            )
+
+        # half and half
+        return (
+            self.read_f(start, flushed_end - start)
+            + bytes(self.buffer[:end - flushed_end])
+        )
+
+    def write(self, b):
+        start = self.position
+        end = start + len(b)
+        flushed_end = self.flushed_end
+
+        self.dirty = True
+
+        if start >= flushed_end:
+            # append (or patch the not-flushed part), goes to the buffer.
+            offset = start - flushed_end
+            if offset > len(self.buffer):
+                # writing after the end, fill the gap like a file does.
+                self.buffer += bytes(offset - len(self.buffer))
+
+            self.buffer[offset:offset + len(b)] = b
+
+            self.position = end
+            if end > self.end:
+                self.end = end
+
+            if len(self.buffer) >= WRITE_BUFFER_SIZE:
+                self.flush_buffer()
+
+            return len(b)
+
+        if end > flushed_end and self.buffer:
+            # overlaps the buffer, keep things simple.
+            self.flush_buffer()
+
+        # in-place overwrite, like .freeze does for modified nodes.
+        self.write_f(start, b)
+
+        self.position = end
+        if end > self.flushed_end:
+            self.flushed_end = end
+        if end > self.end:
+            self.end = end
+
+        return len(b)
+
+    def flush_buffer(self):
+        # write the buffer to the real file object in one go.
+        if self.buffer:
+            self.write_f(self.flushed_end, self.buffer)
+            self.flushed_end = self.end
+            self.buffer = bytearray()
+
+    def flush(self):
+        # make every written data reach the real file object (and the OS).
+        if not self.dirty:
+            return
+
+        self.flush_buffer()
+        self.f.flush()
+        self.dirty = False
+
+    def sync(self):
+        # .flush, then make sure the data reaches the disk itself, used by
+        # the write-ahead log checkpoint.
+        self.flush()
+
+        if type(self.f) is MmapFile:
+            self.f.mm.flush()
+        else:
+            os.fsync(self.f.fileno())
+
+    def truncate(self, size):
+        # drop everything after size, used by `VirtualBNode.compact` to give
+        # the free end of the file back.
+        self.flush()
+
+        self.f.truncate(size)
+        self.f.seek(0, io.SEEK_END)
+        self.f_position = self.f.tell()
+
+        self.end = self.flushed_end = size
+        self.position = min(self.position, size)
+
+    def close(self):
+        # closing twice is fine, `vacuum` does that.
+        if not self.f.closed:
+            self.flush()
+        self.f.close()
+
+
+class ThreadSafeIO(MyIO):
+    # MyIO used by `Database(thread_safe=True)`, many threads can read
+    # through it at the same time: the position is per thread, and the reads
+    # are positional (os.pread, or slicing the mapping), they never move the
+    # position of the real file object.
+
+    # note, writes are not thread-safe on their own, the RWLock (.lock) makes
+    # sure a writer runs alone. but a .freeze writes while the readers run
+    # (go check `freezing`), so the write-behind buffer and the real file
+    # object are only touched under .buffer_lock and .f_lock.
+
+    def __init__(self, f):
+        self.local = threading.local()
+
+        # only used where os.pread does not exist (windows), and to flush
+        # the real file object before a positional read, see .read_f.
+        self.f_lock = threading.Lock()
+
+        # taken by the writes and by the reads of the not-yet-flushed data,
+        # go check .read.
+        self.buffer_lock = threading.RLock()
+
+        # set if something was written to the real file object and may
+        # still be in its own buffer.
+        self.f_dirty = False
+
+        super().__init__(f)
+
+        self.lock = RWLock()
+        self.access_lock = threading.RLock()
+
+    @property
+    def position(self):
+        try:
+            return self.local.position
+        except AttributeError:
+            return 0
+
+    @position.setter
+    def position(self, value):
+        self.local.position = value
+
+    def read(self, size=-1):
+        start = self.position
+        if 0 <= size and start + size <= self.flushed_end:
+            # most of the time, on the real file only. note, .flushed_end
+            # only grows, and what is below it is written already.
+            return super().read(size)
+
+        with self.buffer_lock:
+            return super().read(size)
+
+    def write(self, b):
+        with self.buffer_lock:
+            return super().write(b)
+
+    def flush_buffer(self):
+        with self.buffer_lock:
+            super().flush_buffer()
+
+    def write_f(self, p, b):
+        with self.f_lock:
+            super().write_f(p, b)
+            self.f_dirty = True
+
+    def read_f(self, p, size):
+        f = self.f
+
+        if type(f) is MmapFile:
+            # a write may map the file again (go check `MmapFile.remap`).
+            with self.f_lock:
+                return f.mm[p:p + size]
+        elif type(f) is mmap.mmap:
+            return f[p:p + size]
+        elif hasattr(os, 'pread'):
+            # os.pread reads the file itself, the bytes written in place
+            # (a node by .freeze, data in free space, go check
+            # `modb.freespace`) may still be in the buffer of the file
+            # object, so it is flushed first.
+            if self.f_dirty:
+                with self.f_lock:
+                    if self.f_dirty:
+                        f.flush()
+                        self.f_dirty = False
+            return os.pread(f.fileno(), size, p)
+
+        with self.f_lock:
+            # the writer is not running (go check .lock), but other readers
+            # may be.
+            return super().read_f(p, size)
+
+
+class MmapFile:
+    # writable mmap backend, used by `Database(use_mmap=True)`. it acts like a
+    # normal file object (seek, tell, read, write, close), so MyIO can wrap it
+    # just like it wraps the standard-io one, but every read and write is just
+    # a memory copy instead of a syscall.
+
+    # note, the mapping is always bigger than the real data. when a write goes
+    # past the end of the mapping, the file is extended by big chunks (see
+    # `modb.constant.MMAP_GROW_SIZE`) and mapped again. `self.size` remembers
+    # where the real data ends, so seeking to the end (which `write_data` and
+    # `_freeze` do all the time) still lands on the real end, and the file is
+    # truncated back to `self.size` when closed.
+
+    def __init__(self, f, grow_size=MMAP_GROW_SIZE):
+        # real one
+        self.f = f
+        self.fileno = f.fileno()
+        self.grow_size = grow_size
+
+        # where the real data ends
+        self.size = os.fstat(self.fileno).st_size
+
+        self.mm = None
+        self.capacity = 0
+        self.remap(self.size)
+
+        self.position = 0
+
+    @property
+    def name(self):
+        return self.f.name
+
+    @property
+    def closed(self):
+        return self.mm is None
+
+    def remap(self, needed):
+        # make sure the mapping covers at least `needed` bytes.
+
+        capacity = (
+            math.ceil(needed / self.grow_size) * self.grow_size
+        ) or self.grow_size
+
+        if self.mm is not None:
+            self.mm.close()
+
+        os.ftruncate(self.fileno, capacity)
+        self.mm = mmap.mmap(
+            self.fileno,
+            length=capacity,
+            access=mmap.ACCESS_WRITE,
+        )
+        self.capacity = capacity
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+
+        return self.position
+
+    def read(self, size=-1):
+        start = self.position
+        end = self.size if size < 0 else min(start + size, self.size)
+
+        if end <= start:
+            return b''
+
+        self.position = end
+        return self.mm[start:end]
+
+    def write(self, b):
+        start = self.position
+        end = start + len(b)
+
+        if end > self.capacity:
+            self.remap(end)
+
+        self.mm[start:end] = b
+        self.position = end
+
+        if end > self.size:
+            self.size = end
+
+        return len(b)
+
+    def flush(self):
+        # nothing to do, the written data is already in the (shared) mapping,
+        # the OS writes it back. .close does a real msync.
+        pass
+
+    def truncate(self, size):
+        # the mapping shrinks too (by whole chunks), note, what is left of
+        # the last chunk after size is only dropped when closed.
+        self.size = size
+        self.position = min(self.position, size)
+        self.remap(size)
+        return size
 
     def close(self):
+        # closing twice is fine, `vacuum` does that.
+        if self.mm is None:
+            return
+
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+
+        # drop the not-yet-used part of the last chunk.
+        os.ftruncate(self.fileno, self.size)
         self.f.close()
 
 
+class NodeCache:
+    # bounded LRU of accessed VirtualBNode, used by `Database(cache_nodes=...)`
+    # or `Database(cache_bytes=...)`.
+
+    # without this cache, once a node is accessed, it stays in RAM (with its
+    # keys and its children objects) until the process exits, so a long scan
+    # over a big database pulls the whole index into memory.
+
+    # with this cache, when there are too many accessed nodes, the least
+    # recently used ones are put back to the "not accessed" state (go check
+    # `VirtualBNode.evict`), they will be accessed from the disk again when
+    # needed.
+
+    # note, only clean nodes can be evicted. a modified node must stay in RAM
+    # until .freeze writes it to the disk (that is where the modification
+    # lives). and a node whose children are still accessed or who holds an
+    # accessed Tree / Array value is kept too, go check
+    # `VirtualBNode.evictable`.
+
+    def __init__(self, max_nodes=None, max_bytes=None, node_size=None):
+        limits = []
+        if max_nodes is not None:
+            limits.append(max_nodes)
+        if max_bytes is not None:
+            # rough estimation, one accessed node costs about one on-disk node.
+            limits.append(max_bytes // (node_size or BNodeFormat.size))
+
+        assert limits, 'max_nodes or max_bytes expected.'
+
+        # at least one node, otherwise nothing could be accessed at all.
+        self.limit = max(min(limits), 1)
+
+        # node -> None, from least recently used to most recently used.
+        self.nodes = OrderedDict()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def touch(self, node):
+        # mark node as the most recently used one.
+
+        # root nodes are never evicted, no need to track them.
+        if node.parent is None:
+            return
+
+        # note, one step (no `node in nodes` first), in thread-safe mode the
+        # readers touch the nodes without the access lock, while another
+        # reader may .shrink (under the access lock) at the same time.
+        nodes = self.nodes
+        nodes.pop(node, None)
+        nodes[node] = None
+
+    def discard(self, node):
+        # node is not part of the tree anymore (split or merged away)
+        self.nodes.pop(node, None)
+
+    def shrink(self, keep=None):
+        # evict least recently used nodes till we are under the limit, return
+        # the number of evicted nodes.
+
+        nodes = self.nodes
+        evicted = 0
+
+        # nodes that can not be evicted right now but are still interesting.
+        skipped = []
+
+        while len(nodes) + len(skipped) > self.limit and nodes:
+            node, _ = nodes.popitem(last=False)
+
+            if node is keep:
+                skipped.append(node)
+            elif node.evictable():
+                node.evict()
+                evicted += 1
+            elif not node.modified:
+                skipped.append(node)
+            # else, dirty node, just forget it. `_freeze` will touch it again
+            # once it is written to the disk.
+
+        # put skipped ones back, keeping their order.
+        for node in reversed(skipped):
+            nodes[node] = None
+            nodes.move_to_end(node, last=False)
+
+        return evicted
+
+
 class VirtualArray:
 
     def __init__(
         self,
         f: MyIO,
         array_p: int,
+        data_p=None,
     ):
         self.f = f
         self.array_p = array_p
 
+        # pointer of the Data object self is loaded from, the write-ahead log
+        # uses it to name the array.
+        self.data_p = data_p
+        # and that Data object, set by Data.get.
+        self.source = None
+
         # the 'head' part and will be 'unpacked' later on.
         self.array: Array = self.init_array(
             array_p=self.array_p,
@@ -563,6 +1703,7 @@ class VirtualArray:
         for i in range(self.length):
             yield self.access(i)
 
+    @reading
     def access(self, idx):
         # access the given index of the array just like `arr[idx]` in python
 
@@ -591,19 +1732,23 @@ class VirtualArray:
                 p=Pointer.load(self.f),
                 f=self.f,
             )
+            el.owner = self
+            el.owner_key = idx
 
             # return el (Data) directly since Data.get will do the real
             # `read-then-parse` job
             return el
 
+    @writing
     def append(self, value):
         # append a new element to the end of the array just like `arr.append`
         # method in python
 
         if type(value) is Data:
             data = value
+            keep(self.f, data)
         else:
-            value_p = write_data(self.f, value)
+            value_p = write_data(self.f, value, self.f.codec)
             data = Data(
                 Pointer(value_p),
                 self.f,
@@ -612,12 +1757,24 @@ class VirtualArray:
         self.container.append(
             data
         )
+        data.owner = self
+        data.owner_key = self.length
         self.length += 1
 
         # do check
         if self.length > self.max_length:
             self.reoccupy()
 
+        self.f.dirty_roots[self] = None
+
+        # the index makes the record idempotent, go check
+        # `Database.replay`.
+        wal_record(
+            self.f,
+            'append', self.data_p, value, data.p.n, self.length - 1,
+        )
+
+    @writing
     def set(self, idx, value):
         # change the value of the given idx. just like `arr[idx] = value` in
         # python
@@ -625,7 +1782,7 @@ class VirtualArray:
         # the new written value data (Data Type) will be returned for possible
         # future use.
 
-        value_p = write_data(self.f, value)
+        value_p = write_data(self.f, value, self.f.codec)
 
         value_data = Data(
             Pointer(value_p),
@@ -633,6 +1790,14 @@ class VirtualArray:
         )
 
         self.container[idx] = value_data
+        value_data.owner = self
+        value_data.owner_key = idx
+        self.f.dirty_roots[self] = None
+
+        wal_record(
+            self.f,
+            'set', self.data_p, idx, value, value_p,
+        )
 
         return value_data
 
@@ -688,6 +1853,7 @@ class VirtualArray:
         # indicate new space should be used instead.
         self.new = True
 
+    @writing
     def freeze(self):
         # freeze the array just like VirtualBNode.
 
@@ -696,8 +1862,12 @@ class VirtualArray:
         # so it's natural to know that this VirtualArray.freeze will be called
         # automatically by VirtualBNode.freeze.
 
+        # in copy-on-write mode, nothing is written in place, the elements
+        # and the head go to new space, then the owner points to the new head.
+        copy_on_write = self.f.copy_on_write
+
         # new space should be created, the pointers should be transfered.
-        if self.new is True:
+        if self.new is True or copy_on_write:
             # new
             ptrs = []
             for idx, el in enumerate(self.container):
@@ -735,14 +1905,17 @@ class VirtualArray:
 
             start_p = self.start_p
 
-        # check every element if it's VirtualBNode, if so, freeze it.
-        for el in self.container:
-            if el is not None:
-                el: Data
-                if el.is_tree:
-                    el.get().freeze()
+        # note, the trees inside the array are frozen on their own, they are
+        # in `MyIO.dirty_roots` if modified.
 
-        # at least `length` may change after you do append.
+        self.new = False
+
+        if copy_on_write:
+            # writes the new head
+            self.source.relocate(self)
+            return
+
+        # at least `length` may change after you do append.
         obj = Array(
             power=U8(self.power),
             length=U32(self.length),
@@ -753,8 +1926,6 @@ class VirtualArray:
         )
         obj.dump(self.f)
 
-        self.new = False
-
 
 class VirtualBNode:
     # the class is where all the magic happens in my implementation
@@ -795,12 +1966,39 @@ class VirtualBNode:
         f: MyIO,
         node_p=-1,
         parent=None,
+        data_p=None,
     ):
         self.f = f
 
         # indicate physical position, -1 stands for new physical node
         self.node_p = node_p
 
+        # the space of self on the disk, in bytes. the same for every node,
+        # except with the variable-size node format, whose nodes tell their
+        # size when accessed. go check `PackedBNodeFormat`.
+        self.node_size = f.node_format.size
+
+        # only for the root node of a tree, the pointer of the (Tree typed)
+        # Data object self is loaded from, or 0 for the root node of the
+        # database. the write-ahead log uses it to name the tree.
+        self.data_p = data_p
+        # and that Data object (root node of a nested tree only), set by
+        # Data.get.
+        self.source = None
+
+        # only for the root node of a tree, its BloomFilter (None if it has
+        # none) and where the filter is written (0 if nowhere yet), go check
+        # `modb.bloom`.
+        self.bloom = None
+        self.bloom_p = 0
+
+        # only for the root node of the database, its HashIndex (None if it
+        # has none) and where its directory is written, go check
+        # `modb.hashindex`. and where the RootExtras pointing to both is.
+        self.hash_index = None
+        self.hash_index_p = 0
+        self.extras_p = 0
+
         # another VirtualBNode or None if no parent node
         self.parent = parent
         # quick check
@@ -814,6 +2012,10 @@ class VirtualBNode:
         self.values = []
         self.children = []
 
+        # set if self or any node below self is modified, .freeze only goes
+        # down the dirty nodes. go check .mark_dirty.
+        self.dirty = False
+
         # this marker make .freeze performance better , since .freeze can skip
         # un-modified node confidently
         self.modified = False
@@ -824,11 +2026,26 @@ class VirtualBNode:
         # new node must have these properties since they are not on disk and
         # they must be written to disk when .freeze is called.
         if self.node_p == -1:
-            self.modified = True
+            # note, not using the .modified setter, a new node does not have
+            # its parent yet. the parent is modified anyway (it gets a new
+            # child), which marks the path above.
+            self._modified = True
+            self.dirty = True
             self.accessed = True
 
+    @property
+    def modified(self):
+        return self._modified
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = value
+        if value:
+            self.mark_dirty()
+
     # public method as follows
 
+    @writing
     def insert(self, key, value):
         # insert the key-value pair, return Data object of the inserted value.
 
@@ -854,20 +2071,25 @@ class VirtualBNode:
         # that in the future.
 
         if type(key) is Data:
-            new_key_p = key_p = key.p.n
+            new_key_p = key.p.n
+            # the key data is cached with the python key, not with itself.
+            cached_key = key.get(using_cache=True)
+            keep(self.f, key)
         else:
             new_key_p = write_data(self.f, key)
+            cached_key = key
 
         if type(value) is Data:
             # explained above.
-            new_value_p = value_p = value.p.n
+            new_value_p = value.p.n
+            keep(self.f, value)
         else:
-            new_value_p = write_data(self.f, value)
+            new_value_p = write_data(self.f, value, self.f.codec)
 
         key_data = Data(
             Pointer(new_key_p),
             self.f,
-            cached=key,
+            cached=cached_key,
         )
         value_data = Data(
             Pointer(new_value_p),
@@ -880,9 +2102,151 @@ class VirtualBNode:
             key_data,
             value_data,
         )
+        self.own([key_data], [value_data])
+
+        self.log('insert', key, value, new_value_p)
 
         return value_data
 
+    @writing
+    def insert_many(self, pairs):
+        # insert a batch of key-value pairs, return the list of value Data
+        # objects (same order as `pairs`).
+
+        # this is the bulk-insert mentioned in .insert. three things make it
+        # faster than calling .insert for every pair,
+        # 1. every key and value data is serialized into one in-memory buffer
+        # first, and the buffer is appended to the file with ONE write, no
+        # f-seek-end and tiny writes for every single data.
+        # 2. the batch is sorted by key.
+        # 3. so neighbouring keys mostly go to the same leaf, the leaf found
+        # by the previous key is reused as long as the next key is still
+        # below the leaf's upper bound, no root-to-leaf descent for them.
+
+        # note, duplicate keys inside the batch are checked before anything is
+        # written. but a key which already exists in the tree is only found
+        # when its turn comes, DuplicateKeyFound is raised then, and the pairs
+        # before it are already inserted.
+
+        pairs = list(pairs)
+
+        keys = [
+            key.get(using_cache=True) if type(key) is Data else key
+            for key, _ in pairs
+        ]
+
+        order = sorted(
+            range(len(pairs)),
+            key=keys.__getitem__,
+        )
+
+        for a, b in zip(order, order[1:]):
+            if keys[a] == keys[b]:
+                raise error.DuplicateKeyFound(keys[a])
+
+        # serialize. list and dict can not be serialized into the buffer
+        # (they write nested data at their own positions), they are written
+        # one by one afterwards.
+        flat_types = (str, int, float, bool, bytes, type(None))
+
+        f = self.f
+        base_p = f_seek_end(f)
+        buffer = io.BytesIO()
+
+        key_ps = [None] * len(pairs)
+        value_ps = [None] * len(pairs)
+        nested = []
+
+        for idx in order:
+            key, value = pairs[idx]
+
+            if type(key) is Data:
+                keep(f, key)
+                key_ps[idx] = key.p.n
+            else:
+                key_ps[idx] = base_p + buffer.tell()
+                TypeHelper.dump(key, buffer)
+
+            if type(value) is Data:
+                keep(f, value)
+                value_ps[idx] = value.p.n
+            elif type(value) in flat_types:
+                value_ps[idx] = base_p + buffer.tell()
+                TypeHelper.dump(value, buffer, f.codec)
+            else:
+                nested.append(idx)
+
+        f_seek_end(f)
+        f.write(buffer.getvalue())
+
+        for idx in nested:
+            value_ps[idx] = write_data(f, pairs[idx][1], f.codec)
+
+        # apply to the in-memory tree
+        value_datas = [None] * len(pairs)
+
+        try:
+            self.apply_many(
+                order, keys, key_ps, value_ps, value_datas,
+            )
+        finally:
+            # log the applied pairs, all of them or the ones before the
+            # duplicate key.
+            applied = [
+                idx for idx in order if value_datas[idx] is not None
+            ]
+            if applied:
+                self.log(
+                    'insert_many',
+                    [pairs[idx] for idx in applied],
+                    [value_ps[idx] for idx in applied],
+                )
+
+        return value_datas
+
+    def apply_many(self, order, keys, key_ps, value_ps, value_datas):
+        # the second half of .insert_many, apply the written batch to the
+        # in-memory tree in key order.
+        f = self.f
+        bloom = self.find_root().bloom
+
+        leaf = None
+        bound = None
+        for idx in order:
+            key = keys[idx]
+
+            key_data = Data(
+                Pointer(key_ps[idx]),
+                f,
+                cached=key,
+            )
+            value_data = Data(
+                Pointer(value_ps[idx]),
+                f,
+                cached=None,
+            )
+
+            if (
+                leaf is None
+                or (bound is not None and not key < bound)
+            ):
+                leaf, bound = self.find_leaf_for_insert(key)
+
+            split = leaf.insert_into_leaf(
+                key_data,
+                value_data,
+                key,
+            )
+            if split:
+                leaf = None
+            if bloom is not None:
+                bloom.add(key)
+            self.indexed(key, key_data, value_data)
+
+            self.own([key_data], [value_data])
+            value_datas[idx] = value_data
+
+    @reading
     def search(self, key):
         # search the key
 
@@ -890,9 +2254,35 @@ class VirtualBNode:
         # structure(data) later , otherwise, modb.error.KeyNotFound will be
         # raised.
 
+        if self.hash_index is not None:
+            return self.search_index(key)
+
         node, idx = self._search(key)
         return node.values[idx]
 
+    def search_index(self, key):
+        # .search with the hash index of self (the root node of the
+        # database), no node is read. go check `modb.hashindex`.
+        if self.surely_missing(key):
+            raise error.KeyNotFound(
+                key,
+            )
+
+        found = self.hash_index.get(key)
+        if found is None:
+            raise error.KeyNotFound(
+                key,
+            )
+
+        key_p, value_p = found
+        value = Data(Pointer(value_p), self.f)
+        if value.owner is None:
+            # the node holding value may not be accessed, go check
+            # Data.relocate.
+            value.owner = self
+            value.owner_key = Data(Pointer(key_p), self.f)
+        return value
+
     def __getattr__(self, key):
         return self.__getitem__(key)
 
@@ -941,10 +2331,14 @@ class VirtualBNode:
 
         return value
 
+    @reading_steps
     def items(self, reverse=False):
         # items method acts just like `dict.items` will do , yield list of
         # key-value pairs (all Data typed)
 
+        return self._items(reverse)
+
+    def _items(self, reverse=False):
         # technical details: this method will do an in-order traversal on self.
 
         if reverse:
@@ -982,14 +2376,15 @@ class VirtualBNode:
                 children,
             ):
                 # has child, do recursive call.
-                yield from child.items(reverse)
+                yield from child._items(reverse)
 
                 # same as is_leaf if branch
                 yield key, value
 
             # has child, do recursive call.
-            yield from children[-1].items(reverse)
+            yield from children[-1]._items(reverse)
 
+    @reading_steps
     def range(
         self,
         key_low,
@@ -1001,13 +2396,22 @@ class VirtualBNode:
 
         # if reverse is set, the stream will be efficiently reversed.
 
-        # note, key_high will not be included in the stream.
+        # note, key_high will not be included in the stream. a None bound means
+        # from the first key (key_low) or up to the last key (key_high).
+
+        if (
+            key_low is not None
+            and key_high is not None
+            and not key_low < key_high
+        ):
+            return
 
         if reverse:
             yield from self._range_reversed(key_high, key_low)
         else:
             yield from self._range(key_low, key_high)
 
+    @writing
     def update(self, key, new_value):
         # update the value of the given key.
 
@@ -1021,7 +2425,7 @@ class VirtualBNode:
 
         node, idx = self._search(key)
         old_value_data = node.values[idx]
-        new_value_p = write_data(self.f, new_value)
+        new_value_p = write_data(self.f, new_value, self.f.codec)
         value_data = Data(
             Pointer(new_value_p),
             self.f,
@@ -1029,8 +2433,17 @@ class VirtualBNode:
             cached=None,
         )
         node.values[idx] = value_data
+        # otherwise .freeze would skip the node and the new pointer is lost.
+        node.modified = True
+        self.own([node.keys[idx]], [value_data])
+        self.indexed(key, node.keys[idx], value_data)
+        free_data(self.f, old_value_data)
+
+        self.log('update', key, new_value, new_value_p)
+
         return old_value_data
 
+    @writing
     def vacuum(self):
         # do vacuum, the freed size will be returned.
 
@@ -1072,24 +2485,82 @@ class VirtualBNode:
         t = f'{now.year}_{now.month}_{now.day}_{now.hour}_{now.minute}_{now.second}'
         tmp_path = f'{folder}/{name}.{t}.tmp'
 
-        with open(
-            tmp_path,
-            mode='wb',
-        ) as f:
-            file_start_p = f.tell()
-            make_header(0).dump(f)
-            # -------------------------------
-            # make a link table for _vacuum to use
-            self.tmp_vacuum_link_table = {}
-            # note about link, you can insert two keys with the same data
-            # pointer. I use tmp_vacuum_link_table to avoid duplicates when copying
-            # the data
-            new_node_start_p = self._vacuum(f)
-            # -------------------------------
-            f.seek(file_start_p)
-            make_header(new_node_start_p).dump(f)
-
-            del self.tmp_vacuum_link_table
+        try:
+            with open(
+                tmp_path,
+                mode='wb',
+            ) as f:
+                file_start_p = f.tell()
+                make_header(0).dump(f)
+                # -------------------------------
+                # make a link table for _vacuum to use
+                link_table = {}
+                # note about link, you can insert two keys with the same
+                # data pointer. I use link_table to avoid duplicates when
+                # copying the data
+                # the linked data goes to kept too, the free-space map must
+                # never free it. (go check `modb.freespace`)
+                kept = set()
+                # the filter and the hash index of the database tree are built
+                # again on the way, go check `modb.bloom` and `modb.hashindex`.
+                bloom = None
+                if self.bloom is not None or self.f.bloom_filter:
+                    bloom = self.new_bloom()
+                hash_index = None
+                if self.hash_index is not None or self.f.hash_index:
+                    hash_index = HashIndex()
+                new_node_start_p = self._vacuum(
+                    f, link_table, kept, bloom, hash_index,
+                )
+                extras = RootExtras(bloom=Pointer(0), hash_index=Pointer(0))
+                if bloom is not None:
+                    extras.bloom = Pointer(TypeHelper.dump(bloom.dumps(), f))
+                if hash_index is not None:
+                    # the buckets, then the directory
+                    for idx in range(len(hash_index.pointers)):
+                        blob = hash_index.dumps_bucket(idx)
+                        if blob:
+                            hash_index.pointers[idx] = TypeHelper.dump(blob, f)
+                    extras.hash_index = Pointer(
+                        TypeHelper.dump(hash_index.dumps(), f)
+                    )
+                extras_p = 0
+                if bloom is not None or hash_index is not None:
+                    extras_p = f.tell()
+                    extras.dump(f)
+                # -------------------------------
+                # the compressed values are copied as they are, so is the
+                # dictionary they need (go check `modb.compress`).
+                compress_dict_p = 0
+                if self.f.header is not None and self.f.header.compress_dict.n:
+                    compress_dict_p = vacuum_data(
+                        self.f, self.f.header.compress_dict.n, f, {}, set(),
+                    )
+                # the new file has no free space, but knows its shared data.
+                free_space = FreeSpace()
+                free_space.kept = kept
+                free_space.readers = ReaderRegistry(filename)
+                free_map_p = free_space.write(f, 0)
+
+                f.seek(file_start_p)
+                node_format = self.f.node_format
+                header = make_header(
+                    new_node_start_p,
+                    node_format.code,
+                    node_format.order,
+                )
+                if self.f.header is not None:
+                    # a new version for the read-only snapshots, the ones on
+                    # the old file keep reading it until they are refreshed.
+                    header.generation = U64(self.f.header.generation.n + 1)
+                header.free_map = Pointer(free_map_p)
+                header.compress_dict = Pointer(compress_dict_p)
+                header.extras = Pointer(extras_p)
+                header.dump(f)
+        except BaseException:
+            # the database file is not touched until the copy is done.
+            os.remove(tmp_path)
+            raise
 
         # close then remove right now
         self.f.close()
@@ -1103,29 +2574,157 @@ class VirtualBNode:
             filename,
             mode='r+b',
         )
+        # keep using the same kind of backend as before
+        if type(self.f.f) is MmapFile:
+            new_f = MmapFile(new_f)
         # change the file-used on the fly thanks to the MyIO class
         self.f.change_f(new_f)
+        # the Data objects of the old file are not found by their pointers
+        # anymore, everything moved.
+        for key in list(Data.ref.keys()):
+            if key[1] is self.f:
+                Data.ref.pop(key, None)
+        if self.f.header is not None:
+            self.f.header = header
+        self.f.free_space = free_space
 
         # important: re-start the vnode(self) too
         self.node_p = new_node_start_p
+        self.accessed = False
         self.access()
+        if bloom is not None:
+            bloom.dirty = False
+        if hash_index is not None:
+            hash_index.read = functools.partial(read_data, self.f)
+            hash_index.dirty_buckets.clear()
+            hash_index.dirty = False
+        self.bloom = bloom
+        self.bloom_p = extras.bloom.n
+        self.hash_index = hash_index
+        self.hash_index_p = extras.hash_index.n
+        self.extras_p = extras_p
 
         after_size = f_seek_end(self.f)
 
+        if self.f.wal is not None:
+            # everything moved, the new file is the checkpoint now.
+            self.f.wal.checkpoint(after_size, self.node_p)
+
         logger.info('end vacuuming')
 
         freed_size = before_size - after_size
         # if following assertion fails , file will be broken in a high chance.
-        assert freed_size >= 0, "weird thing happened."
+        # (unless the Bloom filters or the hash index added by this vacuum
+        # take more than what is freed, go check `Database(bloom_filter=True)`
+        # and `Database(hash_index=True)`.)
+        assert (
+            freed_size >= 0 or self.f.bloom_filter or self.f.hash_index
+        ), "weird thing happened."
 
         return freed_size
 
+    def compact(self, max_nodes=COMPACT_STEP_NODES, max_bytes=None):
+        # one step of the online compaction, return True once the file is
+        # compact (the pass is over, or no pass is needed), False if there is
+        # more to do. call it again (for example, between the requests of a
+        # service, or on a timer) until it returns True.
+
+        # unlike .vacuum, the file is never copied, the caller only waits for
+        # one small step. a pass moves the nodes and the data after a cut
+        # (where the file would end without its free space) to the free
+        # space before the cut. every step goes on in key order from where
+        # the last one stopped, and stops after max_nodes nodes or max_bytes
+        # moved bytes (None for no limit), then the free end of the file is
+        # cut off.
+
+        # note, the progress is in the header (written by .freeze), the pass
+        # goes on after the database is opened again.
+
+        # note, the arrays are not moved, nor the data of the files written
+        # before the free-space map (whose shared data is unknown), .vacuum
+        # them once.
+
+        f = self.f
+        if f.lock is not None:
+            # no space is freed in thread-safe mode, go check `free`.
+            raise RuntimeError('compact does not work in thread-safe mode')
+        if f.free_space is None:
+            raise RuntimeError('compact needs a file of version 2')
+
+        root = self.find_root()
+        if root.data_p != 0:
+            raise RuntimeError('compact the root node of the database')
+
+        # what is moved must be on the disk, and the space freed by the last
+        # step reusable.
+        root.freeze()
+        root.cut_free_end()
+
+        header = f.header
+        free_space = f.free_space
+
+        cut = header.compact_cut.n
+        after = None
+        if cut == 0:
+            free_bytes = free_space.free_bytes()
+            if free_bytes < COMPACT_MIN_FREE * f.end:
+                return True
+            cut = f.end - free_bytes
+
+            logger.info(f'start compacting, from {f.end} to {cut}')
+        elif header.compact_key.n:
+            f.seek(header.compact_key.n)
+            after = TypeHelper.load(f)
+
+        step = CompactStep(cut, max_nodes, max_bytes)
+
+        free_space.limit = cut
+        try:
+            done = f.end <= cut or root._compact(step, after)
+
+            # where the next step goes on
+            key_p = header.compact_key.n
+            if key_p:
+                free(f, key_p, data_size(f, key_p))
+            if done:
+                header.compact_cut = Pointer(0)
+                header.compact_key = Pointer(0)
+                # the filter is built again without the deleted keys, and
+                # before the cut.
+                root.rebuild_bloom()
+                if root.hash_index is not None:
+                    root.hash_index.rewrite()
+                    root.mark_dirty()
+                logger.info('end compacting')
+            else:
+                header.compact_cut = Pointer(cut)
+                header.compact_key = Pointer(write_data(f, step.last))
+
+            # the header is written even if nothing moved.
+            end = f.end
+            root.mark_dirty()
+            root.freeze()
+
+            if done and f.copy_on_write and f.end > end:
+                # the nodes written by the last .freeze (the paths up to the
+                # root node) went to the end of the file, when the space
+                # they left was not free yet. it is now.
+                root.mark_after(end)
+                root.freeze()
+        finally:
+            free_space.limit = None
+
+        root.cut_free_end()
+        return done
+
+    @writing
     def delete(self, key):
         # delete the key-value pair by key , then return the deleted value(Data
         # object)
 
         node_targeted, idx = self._search(key)
         node_targeted.modified = True
+        deleted_key_data: Data = node_targeted.keys[idx]
         deleted_value_data: Data = node_targeted.values[idx]
 
         if node_targeted.is_leaf():
@@ -1140,15 +2739,212 @@ class VirtualBNode:
             # try to find inorder predecessor node
 
             predecessor_node = node_targeted.find_inorder_predecessor_node(idx)
+            predecessor_node.modified = True
 
             node_targeted.keys[idx] = predecessor_node.keys.pop(-1)
             node_targeted.values[idx] = predecessor_node.values.pop(-1)
 
             predecessor_node.check_after_delete()
 
+        free_data(self.f, deleted_key_data)
+        free_data(self.f, deleted_value_data)
+
+        index = self.find_root().hash_index
+        if index is not None:
+            index.remove(key)
+
+        self.log('delete', key)
+
         return deleted_value_data
 
+    @writing
+    def bulk_load(self, pairs, fill_factor=1.0):
+        # build the whole tree bottom-up from a sorted stream of key-value
+        # pairs. self must be an empty tree (usually the root node of a fresh
+        # database).
+
+        # compared with calling .insert again and again, there is no
+        # root-to-leaf descent, no bisect and no split at all. the key and
+        # value data are written as they come, every leaf is packed with
+        # `fill_factor` * capacity keys and written right after, then the
+        # internal levels are built from the written leaves, level by level,
+        # and the root is kept in RAM like any other modified node (so
+        # .freeze or .close writes it).
+
+        # note, keys must be strictly increasing, DuplicateKeyFound is raised
+        # for equal keys and RuntimeError for unsorted ones. values can be
+        # anything .insert accepts (Data included).
+
+        if not self.accessed:
+            self.access()
+
+        if self.keys:
+            raise RuntimeError('bulk_load expects an empty tree.')
+
+        f = self.f
+        capacity = f.node_format.capacity
+        min_capacity = f.node_format.min_capacity
+
+        # how many keys per node, never less than the minimum capacity (the
+        # tree would be invalid) and never more than the capacity.
+        fill = min(
+            capacity,
+            max(
+                min_capacity,
+                round(capacity * fill_factor),
+            ),
+        )
+
+        node_format = f.node_format
+        bloom = self.bloom
+        index = self.hash_index
+
+        def write_node(entries, children_p):
+            node_p = f_seek_end(f)
+            node = node_format(
+                keys=[key_p for key_p, _, _ in entries],
+                values=[value_p for _, value_p, _ in entries],
+                children=list(children_p),
+            )
+            if node_format.inlined:
+                node.inline[:len(entries)] = [
+                    make_inline(key) for _, _, key in entries
+                ]
+            node.dump(f)
+            return node_p
+
+        # the leaf level, streamed. every entry is (key_p, value_p, key), the
+        # python key is kept only for the keys which end up in the root.
+
+        # note, one full leaf is kept back (`prev`) before being written, so
+        # that the last two leaves can be balanced in the end.
+        children_p = []
+        separators = []
+        prev = None
+        entries = []
+
+        last_key = None
+        for count, (key, value) in enumerate(pairs):
+            if type(key) is Data:
+                keep(f, key)
+                key_p = key.p.n
+                key = key.get(using_cache=True)
+            else:
+                key_p = None
+
+            if count:
+                if key == last_key:
+                    raise error.DuplicateKeyFound(key)
+                if key < last_key:
+                    raise RuntimeError('bulk_load expects sorted keys.', key)
+            last_key = key
+
+            if key_p is None:
+                key_p = write_data(f, key)
+            if bloom is not None:
+                bloom.add(key)
+
+            if type(value) is Data:
+                keep(f, value)
+                value_p = value.p.n
+            else:
+                value_p = write_data(f, value, f.codec)
+            if index is not None:
+                index.set(key, key_p, value_p)
+
+            if len(entries) == fill:
+                # the current leaf is full, this pair goes one level up.
+                if prev is not None:
+                    children_p.append(write_node(prev, []))
+                prev = entries
+                entries = []
+                separators.append((key_p, value_p, key))
+            else:
+                entries.append((key_p, value_p, key))
+
+        if prev is not None:
+            # balance the last two leaves. the last one may be (almost) empty.
+            merged = prev + [separators.pop()] + entries
+
+            if len(merged) <= capacity:
+                entries = merged
+                if children_p:
+                    children_p.append(write_node(entries, []))
+                    entries = None
+            else:
+                middle_idx = len(merged) // 2
+                children_p.append(write_node(merged[:middle_idx], []))
+                separators.append(merged[middle_idx])
+                children_p.append(write_node(merged[middle_idx+1:], []))
+                entries = None
+
+        # the internal levels. `children_p` are the written nodes of the
+        # level below, and `separators[i]` sits between children_p[i] and
+        # children_p[i+1].
+        min_children = min_capacity + 1
+        while len(children_p) > capacity + 1:
+            count = len(children_p)
+
+            # how many nodes for this level, every one of them must have
+            # between min_children and capacity+1 children.
+            n = min(
+                math.ceil(count / (fill + 1)),
+                count // min_children,
+            )
+
+            next_children_p = []
+            next_separators = []
+            start = 0
+            for idx in range(n):
+                size = count // n + (1 if idx < count % n else 0)
+                end = start + size
+
+                next_children_p.append(
+                    write_node(
+                        separators[start:end-1],
+                        children_p[start:end],
+                    )
+                )
+                if idx != n - 1:
+                    next_separators.append(separators[end-1])
+
+                start = end
+
+            children_p = next_children_p
+            separators = next_separators
+
+        # the root, in RAM.
+        if entries is not None:
+            # everything fits in one leaf
+            separators = entries
+            children_p = []
+
+        self.keys = [
+            Data(Pointer(key_p), f, cached=key)
+            for key_p, _, key in separators
+        ]
+        self.values = [
+            Data(Pointer(value_p), f)
+            for _, value_p, _ in separators
+        ]
+        self.own(self.keys, self.values)
+        self.children = [
+            VirtualBNode(
+                f,
+                node_p=p,
+                parent=self,
+            )
+            for p in children_p
+        ]
+        self.modified = True
+
+        if self.f.wal is not None:
+            # the loaded pairs are not logged (there may be millions of
+            # them), do a checkpoint instead.
+            self.freeze()
+
     # deprecated from version 2022y 4m 21d on
+    @writing
     def create(self, key):
         # note, this method is a special insert method instead of inserting
         # normal type(string, number etc. type) you will insert a empty
@@ -1190,9 +2986,13 @@ class VirtualBNode:
             key_data,
             value_data,
         )
+        self.own([key_data], [value_data])
+
+        self.log('create', key, new_value_p)
 
         return value_data
 
+    @freezing
     def freeze(self):
         # this method moves index to the disk.
 
@@ -1203,10 +3003,127 @@ class VirtualBNode:
         # note, this method involves disk IO operations , call me when it's
         # really needed.
 
+        # note, .freeze writes every modification done through this database
+        # file, whichever node it is called on. the modified trees and arrays
+        # are registered in `MyIO.dirty_roots`, and only the dirty paths of
+        # those trees are visited, so the cost is about the number of the
+        # modified nodes, not the accessed ones.
+
+        # note, in thread-safe mode, the readers keep running while the nodes
+        # are written (go check `freezing`). they use the in-memory nodes, a
+        # node is written in place only once it is accessed, and nothing is
+        # freed in that mode, so they never read a half-written node. only
+        # the steps modifying what they use (a moved tree pointed to again,
+        # the header, the node cache) wait for them, see `exclusively`.
+
+        # note, with the write-ahead log enabled, every freeze is a checkpoint
+        # of the whole database. freezing only a subtree would write the
+        # logged operations over the last checkpoint, and a crash right after
+        # would replay them twice.
+        wal = self.f.wal
+        if (
+            wal is not None
+            and wal.root is not None
+            and wal.root is not self
+        ):
+            wal.root.freeze()
+            return
+
         logger.info('start freezing')
-        self._freeze()
+
+        f = self.f
+        copy_on_write = f.copy_on_write
+
+        # the root node of the database, if it is written.
+        database_root = None
+
+        roots = f.dirty_roots
+        while roots:
+            root = next(iter(roots))
+            del roots[root]
+
+            if root.data_p == 0 and roots:
+                # the root node of the database goes last, in copy-on-write
+                # mode, the other trees and arrays move, which modifies the
+                # trees holding them, up to this one.
+                roots[root] = None
+                continue
+
+            if type(root) is VirtualArray:
+                root.freeze()
+                continue
+
+            old_node_p = root.node_p
+            root._freeze()
+
+            if root.data_p == 0:
+                database_root = root
+                root.write_extras()
+            elif root.write_bloom() or root.node_p != old_node_p:
+                # copy-on-write mode, the tree moved (or its filter did).
+                with exclusively(f):
+                    root.source.relocate(root)
+
+        if copy_on_write and database_root is not None:
+            # the new tree is complete on the disk (fsync) before the header
+            # points to it, then the header is updated with one single write
+            # (fsync again). a crash at any time leaves either the old tree
+            # or the new tree, never a torn one.
+            # the generation is bumped too, so the read-only snapshots know
+            # there is a new version, go check `Snapshot`.
+            # the free-space map goes with the new tree.
+            header = f.header
+            if f.free_space is not None:
+                free_map = f.free_space.write(f, header.generation.n + 1)
+
+            f.sync()
+            with exclusively(f):
+                header.root_node = Pointer(database_root.node_p)
+                header.extras = Pointer(database_root.extras_p)
+                header.generation = U64(header.generation.n + 1)
+                if f.free_space is not None:
+                    header.free_map = Pointer(free_map)
+                f.seek(Header.root_node_offset)
+                header.dump_root(f)
+            f.sync()
+        else:
+            if f.free_space is not None and not copy_on_write:
+                header = f.header
+                free_map = f.free_space.write(f, header.generation.n + 1)
+                with exclusively(f):
+                    if database_root is not None:
+                        # the root node is moved by .compact, if past the
+                        # cut.
+                        header.root_node = Pointer(database_root.node_p)
+                        header.extras = Pointer(database_root.extras_p)
+                    header.free_map = Pointer(free_map)
+                    f.seek(Header.root_node_offset)
+                    header.dump_root(f)
+            f.flush()
+
+        if f.free_space is not None and (
+            database_root is not None or not copy_on_write
+        ):
+            # note, once the header is written, a snapshot opened from now
+            # on reads the new tree (go check `Snapshot.refresh`).
+            with exclusively(f):
+                f.free_space.promote()
+
         logger.info('end freezing')
 
+        if wal is not None:
+            # the log is not needed anymore, but only once the frozen tree
+            # is really on the disk.
+            if wal.sync in ['fsync', 'group'] and not copy_on_write:
+                f.sync()
+            wal.checkpoint(f.end, self.node_p)
+
+        # every node is clean now, so the node cache can evict them again.
+        cache = self.f.node_cache
+        if cache is not None:
+            with exclusively(f):
+                cache.shrink()
+
     def pretty(self, level=0):
         # pretty the tree recursively. return formatted str.
 
@@ -1243,15 +3160,22 @@ class VirtualBNode:
         key_low,
         key_high,
     ):
-        node_a, idx_a = self.peek(key_low)
-        node_b, idx_b = self.peek(key_high)
-
-        if idx_b is not None:
-            stop_indicator = node_b.keys[idx_b]
+        if key_low is None:
+            stream = self._items()
         else:
-            stop_indicator = None
+            node_a, idx_a = self.peek(key_low)
+            if idx_a is None:
+                # greater than every key
+                return
+            stream = node_a.inorder_from(idx_a)
+
+        stop_indicator = None
+        if key_high is not None:
+            node_b, idx_b = self.peek(key_high)
+            if idx_b is not None:
+                stop_indicator = node_b.keys[idx_b]
 
-        for key, value in node_a.inorder_from(idx_a):
+        for key, value in stream:
             if (
                 stop_indicator
                 and key is stop_indicator
@@ -1265,26 +3189,43 @@ class VirtualBNode:
         key_high,
         key_low,
     ):
-        node_a, idx_a = self.peek(key_high)
-        node_b, idx_b = self.peek(key_low)
-
-        stop_indicator = node_b.keys[idx_b]
+        if key_high is None:
+            idx_a = None
+        else:
+            node_a, idx_a = self.peek(key_high)
 
         if idx_a is None:
-            stream = self.items(True)
+            stream = self._items(True)
         else:
             stream = node_a.inorder_from_reversed(idx_a)
 
         for key, value in stream:
+            if key_low is not None and key < key_low:
+                break
+
             yield key, value
 
-            if key is stop_indicator:
-                break
+    def inorder_from_reversed(self, start_idx, below=True):
+        # yield every pair before keys[start_idx], in reverse order. below is
+        # not set when coming up from children[start_idx], which is done
+        # already.
+
+        # note, self may have been evicted by the node cache in the meantime
+        # (go check NodeCache), so make sure it is accessed, and grab
+        # everything we need before yielding anything.
+        if not self.accessed:
+            self.access()
 
-    def inorder_from_reversed(self, start_idx):
         keys = self.keys
         values = self.values
         children = self.children
+        is_leaf = self.is_leaf()
+
+        if self.parent is not None:
+            which_idx = self.find_from_which_branch()
+
+        if below and not is_leaf:
+            yield from children[start_idx]._items(reverse=True)
 
         for idx in range(
             start_idx-1,
@@ -1293,21 +3234,29 @@ class VirtualBNode:
         ):
             yield keys[idx], values[idx]
 
-            if not self.is_leaf():
-                yield from children[idx].items(reverse=True)
+            if not is_leaf:
+                yield from children[idx]._items(reverse=True)
 
         if self.parent is not None:
-            which_idx = self.find_from_which_branch()
             yield from self.parent.inorder_from_reversed(
                 which_idx,
+                below=False,
             )
 
     def inorder_from(self, start_idx):
+        # same as inorder_from_reversed, self may have been evicted.
+        if not self.accessed:
+            self.access()
+
         count = len(self.keys)
 
         keys = self.keys
         values = self.values
         children = self.children
+        is_leaf = self.is_leaf()
+
+        if self.parent is not None:
+            which_idx = self.find_from_which_branch()
 
         for idx in range(
             start_idx,
@@ -1315,38 +3264,61 @@ class VirtualBNode:
         ):
             yield keys[idx], values[idx]
 
-            if not self.is_leaf():
-                yield from children[idx+1].items()
+            if not is_leaf:
+                yield from children[idx+1]._items()
 
         if self.parent is not None:
-            which_idx = self.find_from_which_branch()
             yield from self.parent.inorder_from(
                 which_idx,
             )
 
     def init_node(self, node: BNodeFormat):
-        keys = [
-            Data(p, self.f)
-            for p in node.keys
-            if p.n != 0
-        ]
+        if node.inlined:
+            keys = self.init_inline_keys(node)
+        else:
+            keys = [
+                Data(Pointer(p), self.f)
+                for p in node.keys
+                if p != 0
+            ]
         values = [
-            Data(p, self.f)
+            Data(Pointer(p), self.f)
             for p in node.values
-            if p.n != 0
+            if p != 0
         ]
         children = [
             VirtualBNode(
                 self.f,
-                node_p=p.n,
+                node_p=p,
                 parent=self,
             )
             for p in node.children
-            if p.n != 0
+            if p != 0
         ]
 
+        self.own(keys, values)
+
         return keys, values, children
 
+    def init_inline_keys(self, node):
+        # the key Data objects of a node having its keys inline, the keys
+        # which are all there are cached right away.
+        keys = []
+        for p, inline in zip(node.keys, node.inline):
+            if p == 0:
+                continue
+
+            if inline is not None and inline[2]:
+                key = Data(Pointer(p), self.f, cached=inline_value(inline))
+            else:
+                key = Data(Pointer(p), self.f)
+                if key.cached is None:
+                    key.inline = inline
+
+            keys.append(key)
+
+        return keys
+
     def access(self):
         # this method will grab real bnode from disk.
 
@@ -1367,16 +3339,337 @@ class VirtualBNode:
         # performed directly on the instance for performance reasons, and write
         # it back to the disk when .freeze is called.
 
-        self.accessed = True
+        lock = self.f.access_lock
+        if lock is None:
+            self._access()
+            return
 
+        with lock:
+            # thread-safe mode, many threads may want the same node at the
+            # same time, the first one grabs it.
+            if not self.accessed:
+                self._access()
+
+    def _access(self):
         self.f.seek(self.node_p)
-        node = BNodeFormat.load(self.f)
+        node = self.f.node_format.load(self.f)
         keys, values, children = self.init_node(node)
+        self.node_size = node.slot_size()
 
         self.keys = keys
         self.values = values
         self.children = children
 
+        if self.f.prefetch_keys:
+            self.prefetch_keys()
+
+        self.accessed = True
+
+        # node cache bookkeeping, the just accessed node is the most recently
+        # used one, and it must not be evicted right away.
+        cache = self.f.node_cache
+        if cache is not None:
+            cache.touch(self)
+            cache.shrink(keep=self)
+
+    def prefetch_keys(self):
+        # read every key of self (not cached yet) right now, so bisect runs
+        # on python values. the keys are sorted by pointer, and the ones
+        # close to each other (PREFETCH_GAP) are read in one go, instead of
+        # one small read (two, actually) per key.
+
+        keys = sorted(
+            (key for key in self.keys if key.cached is None),
+            key=lambda key: key.p.n,
+        )
+
+        group = []
+        for key in keys:
+            p = key.p.n
+            if group and (
+                p - group[-1].p.n > PREFETCH_GAP
+                or p - group[0].p.n > PREFETCH_SPAN
+            ):
+                self.load_keys(group)
+                group = []
+            group.append(key)
+
+        if group:
+            self.load_keys(group)
+
+    def load_keys(self, keys):
+        # one read for keys (sorted by pointer), then every key is decoded
+        # from it.
+
+        start_p = keys[0].p.n
+        self.f.seek(start_p)
+        blob = self.f.read(keys[-1].p.n - start_p + PREFETCH_TAIL)
+
+        buffer = io.BytesIO(blob)
+        for key in keys:
+            buffer.seek(key.p.n - start_p)
+            try:
+                value = TypeHelper.load(buffer)
+            except (struct.error, ValueError, IndexError):
+                # cut by the end of blob, left to .get.
+                continue
+
+            # note, a key ending right at the end of blob may be cut too.
+            if buffer.tell() < len(blob):
+                key.cached = value
+
+    def evict(self):
+        # the reverse of .access, drop the in-memory bnode (keys, values and
+        # children objects), the node goes back to the "not accessed" state
+        # and will be grabbed from the disk again on the next .access.
+
+        # note, this method is called by NodeCache, and only when
+        # .evictable() says yes.
+
+        lock = self.f.lock
+        if lock is not None and not lock.is_writer():
+            # thread-safe mode, called by a reader, the other readers may be
+            # reading self right now. self is left as it is, a new (not
+            # accessed) node takes its place in the parent, and self is
+            # dropped once nobody uses it anymore.
+            children = self.parent.children
+            for idx, child in enumerate(children):
+                if child is self:
+                    children[idx] = VirtualBNode(
+                        f=self.f,
+                        node_p=self.node_p,
+                        parent=self.parent,
+                    )
+                    break
+            return
+
+        self.keys = []
+        self.values = []
+        self.children = []
+        self.accessed = False
+
+    def evictable(self):
+        # a node can be put back to the "not accessed" state only if nothing
+        # would be lost by doing so.
+
+        if (
+            not self.accessed
+            or self.modified
+            or self.parent is None
+            or self.node_p == -1
+        ):
+            return False
+
+        for child in self.children:
+            # accessed children hold their own state, and the path from the
+            # root to them must stay accessed.
+            if child.accessed:
+                return False
+
+        for value in self.values:
+            # accessed Tree / Array value lives in the Data object, which
+            # would be dropped together with this node.
+            if value.is_tree or value.is_array:
+                return False
+
+        return True
+
+    def find_root(self):
+        # the root node of the tree self is part of
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def own(self, keys, values):
+        # remember where the values are stored, go check Data.relocate.
+        root = self.find_root()
+        for key, value in zip(keys, values):
+            value.owner = root
+            value.owner_key = key
+
+    def log(self, op, *args):
+        # append the just done operation to the write-ahead log (if enabled),
+        # named after the root node of the tree.
+        wal_record(self.f, op, self.find_root().data_p, *args)
+
+    def mark_dirty(self):
+        # self is modified, mark the path up to the root node dirty, then
+        # register the root node so .freeze can find this tree.
+
+        # note, stops at the first node already dirty, the path above it is
+        # marked already.
+        node = self
+        while not node.dirty:
+            node.dirty = True
+            if node.parent is None:
+                node.f.dirty_roots[node] = None
+                break
+            node = node.parent
+
+    def touch(self):
+        # tell the node cache (if any) that self is used right now.
+        cache = self.f.node_cache
+        if cache is not None:
+            cache.touch(self)
+
+    def forget(self, node):
+        # tell the node cache (if any) that node is not part of the tree
+        # anymore.
+        cache = self.f.node_cache
+        if cache is not None:
+            cache.discard(node)
+
+    def drop(self, node):
+        # node is not part of the tree anymore, neither is its space on the
+        # disk.
+        free(self.f, node.node_p, node.node_size)
+
+    def load_bloom(self, p):
+        # self is a root node, its Bloom filter is at p (0 for an empty one
+        # which is not written yet).
+        if p:
+            self.bloom = BloomFilter.loads(read_data(self.f, p))
+        else:
+            self.bloom = BloomFilter()
+            self.bloom.dirty = False
+        self.bloom_p = p
+
+    def new_bloom(self):
+        # an empty filter for the tree of self (a root node), as big as the
+        # one it replaces (if any).
+        if self.bloom is None:
+            return BloomFilter()
+        return BloomFilter(self.bloom.count())
+
+    def build_bloom(self):
+        # a new filter of the keys of the tree of self (a root node), the
+        # deleted keys are not in it anymore.
+        bloom = self.new_bloom()
+        for key, _ in self._items():
+            bloom.add(key.get(using_cache=True))
+        return bloom
+
+    def rebuild_bloom(self):
+        # replace the filter of self (a root node), if any, by a new one
+        # which is written by the next .freeze.
+        if self.bloom is None:
+            return
+        self.bloom = self.build_bloom()
+        self.mark_dirty()
+
+    def write_bloom(self):
+        # write the filter of self (a root node) if it changed since the last
+        # time, return True if it moved, so what points to it (the Tree data
+        # or the header) must be written again.
+
+        # note, the whole filter is written, about BLOOM_BITS_PER_KEY bits
+        # per inserted key.
+        bloom = self.bloom
+        if bloom is None or not bloom.dirty:
+            return False
+        bloom.dirty = False
+
+        # note, mostly in place, the filter has the same layers (only more
+        # bits set) until a new one is added.
+        old_p = self.bloom_p
+        self.bloom_p = write_blob(self.f, bloom.dumps(), old_p)
+        return self.bloom_p != old_p
+
+    def load_hash_index(self, p):
+        # self is the root node of the database, the directory of its hash
+        # index is at p.
+        self.hash_index = HashIndex.loads(
+            read_data(self.f, p),
+            functools.partial(read_data, self.f),
+        )
+        self.hash_index_p = p
+
+    def write_hash_index(self):
+        # write the changed buckets of the hash index of self (the root node
+        # of the database), then the directory, return True if the directory
+        # moved.
+
+        # note, the directory (8 bytes per bucket) is written by every
+        # .freeze following a modification.
+        index = self.hash_index
+        if index is None or not index.dirty:
+            return False
+
+        f = self.f
+        for idx in sorted(index.dirty_buckets):
+            blob = index.dumps_bucket(idx)
+            old_p = index.pointers[idx]
+            if blob:
+                index.pointers[idx] = write_blob(f, blob, old_p)
+            elif old_p:
+                # an empty bucket is not written
+                free(f, old_p, data_size(f, old_p))
+                index.pointers[idx] = 0
+        index.dirty_buckets.clear()
+        index.dirty = False
+
+        old_p = self.hash_index_p
+        self.hash_index_p = write_blob(f, index.dumps(), old_p)
+        return self.hash_index_p != old_p
+
+    def load_extras(self, p):
+        # self is the root node of the database, its RootExtras is at p.
+        self.f.seek(p)
+        extras = RootExtras.load(self.f)
+        if extras.bloom.n:
+            self.load_bloom(extras.bloom.n)
+        if extras.hash_index.n:
+            self.load_hash_index(extras.hash_index.n)
+        self.extras_p = p
+
+    def write_extras(self):
+        # write the Bloom filter and the hash index of self (the root node of
+        # the database) if they changed, then the RootExtras pointing to
+        # them if they moved. return where it is (0 for nothing), for the
+        # header.
+        bloom_moved = self.write_bloom()
+        index_moved = self.write_hash_index()
+        if self.bloom is None and self.hash_index is None:
+            return self.extras_p
+
+        if bloom_moved or index_moved or not self.extras_p:
+            extras = RootExtras(
+                bloom=Pointer(self.bloom_p),
+                hash_index=Pointer(self.hash_index_p),
+            )
+            # note, not a Bytes data, the size is known.
+            p = None
+            free_space = self.f.free_space
+            if free_space is not None:
+                p = free_space.allocate(RootExtras.size)
+            if p is None:
+                p = f_seek_end(self.f)
+            else:
+                Data.ref.pop((p, self.f), None)
+                self.f.seek(p)
+            extras.dump(self.f)
+
+            if self.extras_p:
+                free(self.f, self.extras_p, RootExtras.size)
+            self.extras_p = p
+
+        return self.extras_p
+
+    def indexed(self, key, key_data, value_data):
+        # the pair is in the tree of self from now on (or value_data is the
+        # new value of key, or key_data moved), go tell the hash index of
+        # the tree, if any.
+        index = self.find_root().hash_index
+        if index is not None:
+            index.set(key, key_data.p.n, value_data.p.n)
+
+    def surely_missing(self, key):
+        # whether key is surely not in the tree of self (a root node), go
+        # check `modb.bloom`.
+        bloom = self.bloom
+        return bloom is not None and key not in bloom
+
     def is_leaf(self):
         if self.accessed:
             return self.children == []
@@ -1389,6 +3682,8 @@ class VirtualBNode:
             # accessed from the disk before finding.
             self.access()
 
+        self.touch()
+
         # quickly check whether our goal is reached.
         if self.is_leaf():
             return self
@@ -1407,26 +3702,77 @@ class VirtualBNode:
         # keep looking till leaf node found (recursively)
         return child.find_closest_leaf_node(key)
 
+    def find_leaf_for_insert(self, key):
+        # like find_closest_leaf_node, but also
+        # 1. raise DuplicateKeyFound if key is already an internal key on the
+        # way down (the leaf check alone can not see those).
+        # 2. return the upper bound of the leaf (the closest internal key
+        # greater than key, or None), insert_many uses it to decide whether
+        # the next key still belongs to the same leaf.
+
+        node = self
+        bound = None
+
+        while True:
+            if not node.accessed:
+                node.access()
+
+            node.touch()
+
+            if node.is_leaf():
+                return node, bound
+
+            idx = bisect.bisect_left(
+                node.keys,
+                key,
+            )
+
+            if idx < len(node.keys):
+                placed = node.keys[idx].get(using_cache=True)
+                if placed == key:
+                    raise error.DuplicateKeyFound(
+                        key,
+                    )
+                bound = placed
+
+            node = node.children[idx]
+
     def _insert(self, key: Data, value: Data):
-        vnode_targeted = self.find_closest_leaf_node(
-            key.get(using_cache=True)
+        requested = key.get(using_cache=True)
+
+        vnode_targeted, _ = self.find_leaf_for_insert(
+            requested,
+        )
+
+        vnode_targeted.insert_into_leaf(
+            key,
+            value,
+            requested,
         )
 
+        bloom = self.find_root().bloom
+        if bloom is not None:
+            bloom.add(requested)
+        self.indexed(requested, key, value)
+
+    def insert_into_leaf(self, key: Data, value: Data, requested):
+        # self must be a leaf node, return True if self is split afterwards
+        # (so self is not the leaf to insert into anymore).
+
         idx = bisect.bisect_left(
-            vnode_targeted.keys,
-            key.get(using_cache=True),
+            self.keys,
+            requested,
         )
 
         # check duplicate key here
-        if idx < len(vnode_targeted.keys):
+        if idx < len(self.keys):
 
             # `placed` is the placed key (already inserted key)
-            placed = vnode_targeted.keys[idx].get(using_cache=True)
+            placed = self.keys[idx].get(using_cache=True)
 
             # `requested` is the requested key (we, the database, are requested
             # to insert that key, or in another expression , that key will be
             # inserted right now if possible)
-            requested = key.get(using_cache=True)
 
             # if following condition is true , the duplicate key must exist.
             # since we do duplicate-key check everytime, we can make sure the
@@ -1436,31 +3782,37 @@ class VirtualBNode:
                     requested,
                 )
 
-        vnode_targeted.keys.insert(
+        self.keys.insert(
             idx,
             key,
         )
-        vnode_targeted.values.insert(
+        self.values.insert(
             idx,
             value,
         )
-        vnode_targeted.modified = True
+        self.modified = True
 
-        vnode_targeted.check_after_insert()
+        split = len(self.keys) > self.f.node_format.capacity
+        self.check_after_insert()
+
+        return split
 
     def check_after_insert(self):
-        if len(self.keys) > BNODE_MAX_CAPACITY:
+        if len(self.keys) > self.f.node_format.capacity:
             self.split_me()
 
     def check_after_delete(self):
         # minimum capacity required except for the root node
         if (
-            len(self.keys) < BNODE_MIN_CAPACITY
+            len(self.keys) < self.min_capacity
             and self.parent is not None
         ):
             self.merge_me()
 
     def find_inorder_predecessor_node(self, idx):
+        if not self.accessed:
+            self.access()
+
         if self.is_leaf():
             return self
 
@@ -1468,13 +3820,32 @@ class VirtualBNode:
         return child.find_inorder_predecessor_node(-1)
 
     def find_from_which_branch(self):
-        children = self.parent.children
-        idx = children.index(self)
+        parent = self.parent
+        if not parent.accessed:
+            # evicted in the meantime
+            parent.access()
+
+        children = parent.children
+        try:
+            idx = children.index(self)
+        except ValueError:
+            # parent was evicted and accessed again, so its children are new
+            # objects now, compare the on-disk position instead.
+            idx = [
+                child.node_p for child in children
+            ].index(self.node_p)
         return idx
 
+    @property
+    def min_capacity(self):
+        # used by merge_me
+        return self.f.node_format.min_capacity
+
     def merge_me(self):
         self.modified = True
-        
+        # parent loses (or changes) one key at least
+        self.parent.modified = True
+
         def change_parent(nodes, new_parent):
             for node in nodes:
                 node.parent = new_parent
@@ -1491,6 +3862,8 @@ class VirtualBNode:
         if idx == 0:
             # find right sibling
             right_sibling = self.parent.children[idx+1]
+            if not right_sibling.accessed:
+                right_sibling.access()
             right_sibling.modified = True
 
             # if right sibling can give me a key
@@ -1537,12 +3910,17 @@ class VirtualBNode:
                 del self.parent.values[0]
                 del self.parent.children[idx+1]
 
+                self.forget(right_sibling)
+                self.drop(right_sibling)
+
                 self.parent: VirtualBNode
                 self.parent.check_after_delete()
 
         else:
             # find left sibling
             left_sibling = self.parent.children[idx-1]
+            if not left_sibling.accessed:
+                left_sibling.access()
             left_sibling.modified = True
 
             # if left sibling can give me a key
@@ -1591,6 +3969,9 @@ class VirtualBNode:
                 del self.parent.values[idx-1]
                 del self.parent.children[idx-1]
 
+                self.forget(left_sibling)
+                self.drop(left_sibling)
+
                 self.parent.check_after_delete()
 
         if len(self.parent.keys) == 0:
@@ -1600,6 +3981,10 @@ class VirtualBNode:
 
             change_parent(self.parent.children, self.parent)
 
+            # the parent took everything, self is not part of the tree anymore
+            self.forget(self)
+            self.drop(self)
+
     def split_me(self):
         # this method is the key to the btree building. if you are for
         # educational comment, go and check another python btree source code.
@@ -1627,7 +4012,7 @@ class VirtualBNode:
             for node in nodes:
                 node.parent = new_parent
 
-        middle_idx = int(BNODE_MAX_CAPACITY / 2)
+        middle_idx = int(self.f.node_format.capacity / 2)
         middle_key = self.keys[middle_idx]
         middle_value = self.values[middle_idx]
 
@@ -1664,11 +4049,15 @@ class VirtualBNode:
         elif self.parent is not None:
             self.parent.modified = True
 
+            # self is replaced by left_node and right_node
+            self.forget(self)
+
             left_node.parent = self.parent
             right_node.parent = self.parent
 
             # space re-used
             left_node.node_p = self.node_p
+            left_node.node_size = self.node_size
 
             idx = bisect.bisect_left(
                 self.parent.keys,
@@ -1694,6 +4083,8 @@ class VirtualBNode:
     def peek(self, key):
         # get exact or closest-right match, used by `search` and `range`
 
+        self.touch()
+
         idx = bisect.bisect_left(
             self.keys,
             key,
@@ -1702,7 +4093,7 @@ class VirtualBNode:
         not_most_right = idx < len(self.keys)
 
         if not_most_right:
-            if self.keys[idx].get(using_cache=True) == key:
+            if self.keys[idx].equals(key):
                 return self, idx
 
         if self.is_leaf():
@@ -1724,22 +4115,30 @@ class VirtualBNode:
                 # not accessed yet. access it right now.
                 child.access()
 
-            node, idx = child.peek(key)
-            if idx is not None:
-                return node, idx
+            # note, not `idx`, if nothing is found below, the closest-right
+            # one is self.keys[idx].
+            node, child_idx = child.peek(key)
+            if child_idx is not None:
+                return node, child_idx
             elif not_most_right:
                 return self, idx
             else:
                 return self, None
 
     def _search(self, key):
+        if self.surely_missing(key):
+            # never inserted, no node is read.
+            raise error.KeyNotFound(
+                key,
+            )
+
         node, idx = self.peek(key)
 
         # note, if idx is None, then the searched key is greater than the max
         # key value in the node.
         if (
             idx is not None and
-            node.keys[idx].get(using_cache=True) == key
+            node.keys[idx].equals(key)
         ):
             return node, idx
 
@@ -1748,17 +4147,56 @@ class VirtualBNode:
                 key,
             )
 
-    def seek_written_position(self):
+    def seek_written_position(self, size):
         # (recap again), if node_p is set to -1 , that means this node have
         # never existed before , so we need to use new disk space , as to new
         # space, the end of the file will be a good choice.
 
         # otherwise, just seek to the old node position for space re-use.
 
-        if self.node_p == -1:
-            start_position = f_seek_end(self.f)
-        else:
-            start_position = self.f.seek(self.node_p)
+        # note, in copy-on-write mode, every written node goes to new space.
+        # so does a node after the limit of the free space, being moved by
+        # .compact, which goes before the limit, or at least before where it
+        # was. (while .compact runs, nothing goes to the end of the file if
+        # it fits somewhere else.)
+
+        # size is the space the node needs now, a variable-size node (go
+        # check `PackedBNodeFormat`) bigger than its slot goes to new space
+        # too.
+
+        free_space = self.f.free_space
+        new = self.node_p == -1
+        moving = (
+            not new
+            and free_space is not None
+            and free_space.limit is not None
+            and self.node_p + self.node_size > free_space.limit
+        )
+        grown = not new and size > self.node_size
+
+        start_position = None
+        if new or self.f.copy_on_write or moving or grown:
+            # free space first, go check `modb.freespace`.
+            if free_space is not None:
+                start_position = free_space.allocate(size)
+            if (
+                start_position is None
+                and free_space is not None
+                and free_space.limit is not None
+            ):
+                start_position = free_space.allocate_first(
+                    size,
+                    before=self.node_p if moving else None,
+                )
+
+            if start_position is None and (
+                self.f.copy_on_write or not moving or grown
+            ):
+                start_position = f_seek_end(self.f)
+
+        if start_position is None:
+            start_position = self.node_p
+        self.f.seek(start_position)
 
         # return the seeked position for future purpose , like we will pass
         # position to so-called parent node, and position be stored as parent's
@@ -1771,7 +4209,35 @@ class VirtualBNode:
 
         # if current node is never be accessed , then its children will never be
         # accessed too , just return the original position will be OK.
-        if not self.accessed:
+
+        # same for a clean node, nothing below it is modified (go check
+        # .mark_dirty), so the traversal only goes down the dirty paths.
+        if not self.accessed or not self.dirty:
+            return self.node_p
+
+        # note, the tree-typed and array-typed values are not traversed here
+        # anymore, a modified one is registered in `MyIO.dirty_roots` and is
+        # frozen on its own by .freeze.
+
+        # (a leaf has no children)
+        children_ptr = []
+        moved = False
+        for child in self.children:
+            child_p = child.node_p
+            ptr = child._freeze()
+            children_ptr.append(ptr)
+            moved = moved or ptr != child_p
+
+        self.dirty = False
+
+        if not self.modified and not moved and not self.f.copy_on_write:
+            # only some node below is modified, they are written in place (a
+            # new child always makes its parent modified), self keeps the
+            # same pointers.
+
+            # note, in copy-on-write mode, the modified children are moved,
+            # so self must be written (moved) too. so must it if a child
+            # grew out of its space (variable-size nodes only).
             return self.node_p
 
         # extract just pointers, which will be written back to the disk using
@@ -1786,160 +4252,573 @@ class VirtualBNode:
         # recap: the actual data is always started with one byte length unsigned
         # integer, that is type code.)
         keys = [
-            each.p for each in self.keys
+            each.p.n for each in self.keys
         ]
         values = [
-            each.p for each in self.values
+            each.p.n for each in self.values
         ]
 
-        # recursive check and traverse tree-typed value
-        for value in self.values:
-            # in my implentation, if .is_tree is set to True , the type of the
-            # value must be Tree and must have been accessed. if value.is_tree
-            # is False , that value may be tree still, but just not be accessed
-            # yet. in this context, `access` means that the value.get() has been
-            # called. (recap: value.get() will return VirtualBNode if value type
-            # is Tree)
-            if value.is_tree:
-                subtree = value.get(using_cache=True)
-                # use following code to debug, you can see the python object id
-                # of the tree
-
-                # print('subtree', subtree)
-
-                # use ._freeze() to avoid logging
-                subtree._freeze()
-
-            if value.is_array:
-                arr: VirtualArray = value.get(using_cache=True)
-                arr.freeze()
+        node_format = self.f.node_format
+        if node_format.inlined:
+            node = node_format(
+                keys=keys,
+                values=values,
+                children=children_ptr,
+                inline=[inline_of(key) for key in self.keys],
+            )
+        else:
+            node = node_format(
+                keys=keys,
+                values=values,
+                children=children_ptr,
+            )
 
-        if self.is_leaf():
-            start_position = self.seek_written_position()
+        start_position = self.seek_written_position(node.slot_size())
+        if node_format.variable and start_position == self.node_p:
+            # in place, the node keeps its slot.
+            node.slot = self.node_size
+        node.dump(self.f)
 
-            if not self.modified:
-                return start_position
+        if start_position != self.node_p:
+            # copy-on-write mode (or moved), the old version is not part of
+            # the new tree.
+            free(self.f, self.node_p, self.node_size)
 
-            BNodeFormat(
-                keys=keys,
-                values=values,
-                children=[],
-            ).dump(self.f)
+        # a new node has its own place on the disk from now on.
+        self.node_p = start_position
+        self.node_size = node.slot_size()
+        self.modified = False
+        self.touch()
 
-            self.modified = False
+        return start_position
 
-            return start_position
+    def _vacuum(
+        self,
+        f: io.RawIOBase,
+        link_table,
+        kept,
+        bloom=None,
+        hash_index=None,
+    ):
+        # write the tree of self (a root node) at the current position of f,
+        # return where its root node is. the pairs are added to bloom (a new
+        # BloomFilter) and hash_index (a new HashIndex), if given.
+
+        # note, the layout is clustered: the internal nodes first, breadth
+        # first, then every leaf followed by its keys and values (preceded
+        # by, for the variable-size nodes), in key order (the pairs of an
+        # internal node go right after the leaf on their left). a range scan reads the file forward. the nested trees
+        # and arrays go where their value goes, go check `vacuum_data`.
+
+        # note, the link table and the kept set are shared by the whole
+        # database, the nested trees included.
+
+        # the internal nodes are written once their children are, their
+        # space is taken right away.
+
+        # note, always by writing (zeros), `TypeHelper.dump` appends to the
+        # end of the file.
+
+        # note, the pointers of a variable-size node (go check
+        # `PackedBNodeFormat`) are not known yet, so neither is its size, it
+        # gets the biggest slot it may need.
+
+        # note, with the node cache, a node may be evicted (and accessed
+        # again, with new children objects) on the way, the nodes are known
+        # by their pointers, and used right after they are accessed.
+        node_format = self.f.node_format
+        positions = {}
+        level = [self]
+        while level:
+            children = []
+            for node in level:
+                if not node.accessed:
+                    node.access()
+                if node.is_leaf():
+                    continue
+
+                if node_format.variable:
+                    size = node_format.max_slot_size(
+                        [
+                            make_inline(key.get(using_cache=True))
+                            for key in node.keys
+                        ],
+                        leaf=False,
+                    )
+                else:
+                    size = node_format.size
+                positions[node.node_p] = (f.tell(), size)
+                f.write(bytes(size))
+                children += node.children
+            level = children
+
+        return self.vacuum_node(
+            f, positions, link_table, kept, bloom, hash_index,
+        )
 
+    def vacuum_node(self, f, positions, link_table, kept, bloom, hash_index):
+        # go check ._vacuum, positions tells where the internal nodes go.
+        if not self.accessed:
+            self.access()
+
+        # self may be evicted while its children are written, go check
+        # ._vacuum.
+        src_keys = self.keys
+        src_values = self.values
+        src_children = self.children
+
+        node_format = self.f.node_format
+        leaf = self.is_leaf()
+        slot = None
+        if not leaf:
+            node_p, slot = positions[self.node_p]
+        elif not node_format.variable:
+            # right here, its pairs right after it.
+            node_p = f.tell()
+            f.write(bytes(node_format.size))
+
+        keys = []
+        values = []
+        inline = []
         children_ptr = []
-        for idx in range(len(self.children)):
-            child = self.children[idx]
-            ptr = child._freeze()
-            children_ptr.append(ptr)
+        for idx, key in enumerate(src_keys):
+            if not leaf:
+                children_ptr.append(
+                    src_children[idx].vacuum_node(
+                        f, positions, link_table, kept, bloom, hash_index,
+                    )
+                )
 
-        start_position = self.seek_written_position()
+            k = key.get(using_cache=True)
+            keys.append(f.tell())
+            TypeHelper.dump(k, f)
+            inline.append(make_inline(k))
+            if bloom is not None:
+                bloom.add(k)
 
-        if not self.modified:
-            return start_position
+            values.append(
+                vacuum_data(self.f, src_values[idx].p.n, f, link_table, kept)
+            )
+            if hash_index is not None:
+                hash_index.set(k, keys[-1], values[-1])
+
+        if not leaf:
+            children_ptr.append(
+                src_children[-1].vacuum_node(
+                    f, positions, link_table, kept, bloom, hash_index,
+                )
+            )
 
-        BNodeFormat(
+        # note, the same format (and order) as the file being vacuumed.
+        if node_format.inlined:
+            extra = {'inline': inline}
+        else:
+            extra = {}
+        node = node_format(
             keys=keys,
             values=values,
-            children=[Pointer(p) for p in children_ptr],
-        ).dump(self.f)
+            children=children_ptr,
+            **extra,
+        )
 
-        self.modified = False
+        if leaf and node_format.variable:
+            # right after its pairs, its size is known now.
+            node_p = f.tell()
+            node.dump(f)
+            return node_p
 
-        return start_position
+        if node_format.variable:
+            node.slot = slot
+
+        end = f.tell()
+        f.seek(node_p)
+        node.dump(f)
+        f.seek(end)
+
+        return node_p
+
+    def _compact(self, step, after=None, whole=False):
+        # a step of .compact on the subtree of self, only the pairs after the
+        # key `after` (every pair if None). return True if the subtree is
+        # done, False if the step is over first. a whole subtree (a nested
+        # tree) is done in one go.
 
-    def _vacuum(self, f: io.RawIOBase):
         if not self.accessed:
             self.access()
+        step.nodes += 1
 
-        keys = []
-        values = []
-        for data in self.keys:
-            p = data.p.n
-            # --------------------------
-            self.f.seek(p)
-            k = TypeHelper.load(self.f)
-            # --------------------------
+        size = self.node_size
+        if self.node_p + size > step.cut:
+            # written before the cut by .freeze, go check
+            # .seek_written_position. the parent points to the new place.
+            self.modified = True
+            if self.parent is not None:
+                self.parent.modified = True
+            step.moved += size
+
+        # note, with the node cache, self may be evicted (it is clean, its
+        # children are not accessed anymore) while a child is compacted, it
+        # is accessed again before it is used.
+        leaf = self.is_leaf()
+        for idx in range(len(self.keys)):
+            if not self.accessed:
+                self.access()
+            key = self.keys[idx].get(using_cache=True)
+            if after is not None and not after < key:
+                # done by a step before, so is the child before the key.
+                continue
 
-            start_position = f.tell()
-            TypeHelper.dump(k, f)
-            keys.append(start_position)
+            if not leaf and not self.children[idx]._compact(
+                step, after, whole,
+            ):
+                return False
 
-        for data in self.values:
+            if not self.accessed:
+                self.access()
+            self.compact_pair(idx, step)
+            step.last = key
 
-            p = data.p.n
-            # --------------------------
-            if p in self.tmp_vacuum_link_table:
-                values.append(
-                    self.tmp_vacuum_link_table[p]
-                )
-                continue
+            if not whole and step.exhausted():
+                return False
 
-            self.f.seek(p)
-            v = TypeHelper.load(self.f)
-            # --------------------------
+        if not leaf:
+            if not self.accessed:
+                self.access()
+            return self.children[-1]._compact(step, after, whole)
+        return True
 
-            if type(v) is VirtualBNode:
-                node_p = v._vacuum(f)
-                start_position = TypeHelper.make_tree_type(f, node_p)
+    def mark_after(self, cut):
+        # the accessed nodes of the subtree of self (the nested trees
+        # included) which are after cut are moved by the next .freeze.
+        if not self.accessed:
+            return
 
-            else:
-                start_position = f.tell()
-                TypeHelper.dump(v, f)
+        if self.node_p + self.node_size > cut:
+            self.modified = True
 
-            self.tmp_vacuum_link_table[p] = start_position
-            values.append(start_position)
+        for child in self.children:
+            child.mark_after(cut)
+        for value in self.values:
+            if value.is_tree and value.cached is not None:
+                value.cached.mark_after(cut)
 
-        keys = [
-            Pointer(p) for p in keys
-        ]
-        values = [
-            Pointer(p) for p in values
-        ]
+    def compact_pair(self, idx, step):
+        # move the key and the value at idx before the cut, if they are
+        # after it.
+        f = self.f
 
-        if self.is_leaf():
-            start_position = f.tell()
+        value = self.values[idx]
+        if data_size(f, value.p.n) is None:
+            # a tree (or an array, not moved)
+            obj = value.get()
+            if type(obj) is VirtualBNode:
+                obj._compact(step, whole=True)
+                obj.rebuild_bloom()
+                if value.p.n >= step.cut:
+                    # stored in self in place of value.
+                    value.relocate(obj)
+            # self may be evicted by the node cache meanwhile (go check
+            # ._compact), the Data objects are the same once it is accessed
+            # again.
+            if not self.accessed:
+                self.access()
+            value = self.values[idx]
+        else:
+            value = self.compact_data(value, step)
 
-            BNodeFormat(
-                keys=keys,
-                values=values,
-                children=[],
-            ).dump(f)
+        key = self.compact_data(self.keys[idx], step)
+
+        if key is not self.keys[idx] or value is not self.values[idx]:
+            self.keys[idx] = key
+            self.values[idx] = value
+            self.own([key], [value])
+            self.indexed(key.get(using_cache=True), key, value)
+            self.modified = True
 
-            return start_position
+    def compact_data(self, data, step):
+        # return data, or a copy of it before the cut if it is after it.
 
-        children_ptr = []
-        for idx in range(len(self.children)):
-            child = self.children[idx]
-            ptr = child._vacuum()
-            children_ptr.append(ptr)
+        # note, the shared data (go check `modb.freespace`) stays where it
+        # is, every Data object pointing to it would have to move.
+        f = self.f
+        free_space = f.free_space
+        p = data.p.n
+        if (
+            p < step.cut
+            or not free_space.tracks_blobs
+            or p in free_space.kept
+        ):
+            return data
 
-        print('wat'*20, children_ptr)
+        size = data_size(f, p)
+        new_p = free_space.allocate(size)
+        if new_p is None:
+            new_p = free_space.allocate_first(size, before=p)
+        if new_p is None:
+            # no room before it, left to the next pass.
+            return data
 
-        start_position = f.tell()
+        f.seek(p)
+        blob = f.read(size)
+        # a Data object of what was there before is not valid anymore.
+        Data.ref.pop((new_p, f), None)
+        f.seek(new_p)
+        f.write(blob)
+        free(f, p, size)
+        step.moved += size
+
+        new = Data(Pointer(new_p), f, cached=data.cached)
+        new.inline = data.inline
+        return new
+
+    def cut_free_end(self):
+        # give the free end of the file (if any) back to the file system.
+        f = self.f
+        p = f.free_space.ends.get(f.end)
+        if p is None:
+            return
 
-        BNodeFormat(
-            keys=keys,
-            values=values,
-            children=[Pointer(p) for p in children_ptr],
-        ).dump(f)
+        f.free_space.remove(p)
+        f.truncate(p)
 
-        return start_position
+        if f.wal is not None:
+            # the log tells the data written after the checkpoint by where
+            # the file ended, which moved.
+            f.wal.checkpoint(f.end, self.node_p)
+
+
+class CompactStep:
+    # what one step of `VirtualBNode.compact` has done so far.
+
+    def __init__(self, cut, max_nodes, max_bytes):
+        # everything after cut is moved before it
+        self.cut = cut
+
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.nodes = 0
+        self.moved = 0
+
+        # the last key done
+        self.last = None
+
+    def exhausted(self):
+        return (
+            self.max_nodes is not None and self.nodes >= self.max_nodes
+        ) or (
+            self.max_bytes is not None and self.moved >= self.max_bytes
+        )
+
+
+class Snapshot:
+    # a read-only view of one version of the database, while another process
+    # keeps writing to the file (with `copy_on_write`, so a committed node is
+    # never overwritten). .node is the root node of that version, it never
+    # changes until .refresh moves the snapshot to the last committed
+    # version.
+
+    # note, every snapshot is pinned to its generation in the reader registry
+    # (`modb.readers`), so the writer knows which old versions are still
+    # read. .close unpins it.
+
+    def __init__(self, db):
+        self.db = db
+        self.name = db.readers.new_name()
+
+        self.f = None
+        self.root_p = None
+        self.generation = None
+        self.node = None
+
+        db.snapshots[self.name] = self
+        self.refresh()
+
+    def refresh(self):
+        # move to the last committed version, return True if there is a new
+        # one.
+
+        while True:
+            f, root_p, generation = self.db.latest()
+            if (
+                f is self.f
+                and root_p == self.root_p
+                and generation == self.generation
+            ):
+                return False
+
+            # pinned before the tree is read, then the header is read again,
+            # if the writer committed in between, it may not have seen the
+            # pin (go check `modb.freespace`), try again.
+            self.db.readers.pin(self.name, generation)
+            if self.db.latest() == (f, root_p, generation):
+                break
+
+        node = VirtualBNode(
+            f=f,
+            node_p=root_p,
+            parent=None,
+            data_p=0,
+        )
+        node.access()
+        # note, the header read by .latest, the one of root_p.
+        if f.header.extras.n:
+            node.load_extras(f.header.extras.n)
+
+        self.f = f
+        self.root_p = root_p
+        self.generation = generation
+        self.node = node
+        return True
+
+    def close(self):
+        self.db.readers.unpin(self.name)
+        self.db.snapshots.pop(self.name, None)
+        self.node = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class Database:
     # relatively high-level api that users can use directly.
 
-    def __init__(self, filename, read_only=False):
+    def __init__(
+        self,
+        filename,
+        read_only=False,
+        use_mmap=False,
+        cache_nodes=None,
+        cache_bytes=None,
+        wal=None,
+        wal_group_ms=WAL_GROUP_MS,
+        copy_on_write=False,
+        thread_safe=False,
+        inline_keys=True,
+        prefix_keys=False,
+        packed_nodes=False,
+        prefetch_keys=False,
+        order=BNODE_ORDER,
+        compress=None,
+        compress_min_size=COMPRESS_MIN_SIZE,
+        compress_dict=None,
+        bloom_filter=False,
+        hash_index=False,
+    ):
         self.filename = filename
         self.read_only = read_only
 
+        # opt-in writable mmap backend, only meaningful when not read_only
+        # (read_only mode is always using mmap).
+        self.use_mmap = use_mmap
+
+        # budget of the node cache, in nodes or in bytes (or both, the
+        # smaller one wins). None means no limit, every accessed node stays
+        # in RAM. go check `NodeCache`.
+        self.cache_nodes = cache_nodes
+        self.cache_bytes = cache_bytes
+
+        # sync policy of the write-ahead log, None means no log at all. go
+        # check `modb.wal`.
+        self.wal = wal
+        self.wal_group_ms = wal_group_ms
+        self.wal_filename = self.filename + WAL_SUFFIX
+
+        # if set, .freeze never overwrites a node in place, modified nodes go
+        # to new space and the root pointer in the header is swapped last.
+        # go check `VirtualBNode.freeze`.
+        self.copy_on_write = copy_on_write
+
+        # if set, many threads can use the database at the same time, go
+        # check `ThreadSafeIO` and `RWLock`.
+        self.thread_safe = thread_safe
+
+        # new files only, if set, the nodes hold the short keys (and the
+        # first bytes of the long ones), go check `InlineBNodeFormat`. the
+        # format of an existing file is in its header.
+        self.inline_keys = inline_keys
+
+        # new files only, if set, the nodes hold their keys front-coded
+        # (each one written as what it shares with the key before it plus
+        # the rest), so the long keys with a common beginning are whole in
+        # the node, go check `PrefixBNodeFormat`. wins over inline_keys.
+        self.prefix_keys = prefix_keys
+
+        # new files only, if set, a node only takes the space its keys need
+        # (the keys front-coded too), not the space of a full node, go check
+        # `PackedBNodeFormat`. wins over prefix_keys and inline_keys.
+        self.packed_nodes = packed_nodes
+
+        # if set, all the keys of a node are read (in a few big reads) when
+        # the node is accessed, go check `VirtualBNode.prefetch_keys`.
+        self.prefetch_keys = prefetch_keys
+
+        # new files only, the order (fanout) of the nodes, bigger nodes mean
+        # fewer levels (faster lookups), smaller ones mean less to rewrite per
+        # modified node. the order of an existing file is in its header, go
+        # check `modb.tune` to pick one.
+        self.order = order
+
+        # the str and bytes values of at least compress_min_size bytes are
+        # written compressed with compress ('zlib' or 'lzma'), go check
+        # `modb.compress`. compress_dict (bytes, zlib only) is for new files
+        # only, it is written in the file, the dictionary of an existing
+        # file is the one in its header.
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.compress_dict = compress_dict
+
+        # if set, the new trees (the one of a new file included) get a Bloom
+        # filter of their keys, so searching a missing key mostly reads no
+        # node, go check `modb.bloom`. the filter of an existing tree is kept
+        # up to date whatever bloom_filter says, .vacuum adds the missing
+        # ones.
+        self.bloom_filter = bloom_filter
+
+        # if set, a new file gets a hash index of the keys of its tree, so
+        # .search (exact key) reads no node at all, go check
+        # `modb.hashindex`. the index of an existing file is kept up to date
+        # whatever hash_index says, .vacuum adds it if missing.
+        self.hash_index = hash_index
+
         if not os.path.exists(self.filename):
             self.init_database_file()
 
+        self.open_f()
+
+        self.header = self.f.header
+        self.root_p = self.header.root_node.n
+
+        # read-only mode, the files replaced by `vacuum` (MyIO, original file
+        # object) which some snapshots may still be reading.
+        self.old_files = []
+
+        # read-only mode, the snapshots not closed yet, go check `Snapshot`.
+        self.snapshots = {}
+        self.readers = ReaderRegistry(self.filename)
+        if self.f.free_space is not None:
+            self.f.free_space.readers = self.readers
+            # the space freed by the last commit is reusable right away, that
+            # commit is on the disk already (unless a snapshot still reads an
+            # older version).
+            self.f.free_space.promote()
+
+        # will be VirtualBNode instance after .connect() is called.
+        self.vnode = None
+
+        if self.wal is not None and not self.read_only:
+            self.open_wal()
+        elif os.path.exists(self.wal_filename):
+            logger.warning(
+                f'{self.wal_filename} is not replayed, '
+                'open the database with the wal parameter to do so.'
+            )
+
+    def open_f(self):
+        # open the database file, set self._f and self.f
+
         # original file object
         self._f = open(
             self.filename,
@@ -1948,7 +4827,7 @@ class Database:
 
         # note,
         # self._f is definitely original file object
-        # self.f is mmap object or self._f
+        # self.f is mmap object, MmapFile object or self._f
 
         if self.read_only:
             # using mmap-io is faster for query on disk
@@ -1957,22 +4836,273 @@ class Database:
                 length=0,
                 access=mmap.ACCESS_READ,
             )
+        elif self.use_mmap:
+            # reads and writes become memory copies, the mapping grows in big
+            # chunks when data is appended. go check `MmapFile`.
+            self.f = MmapFile(self._f)
         else:
             # do nothing, just using stardard-io
             self.f = self._f
 
         # wrapper, go check `MyIO` class for more information
-        self.f = MyIO(self.f)
+        if self.thread_safe:
+            self.f = ThreadSafeIO(self.f)
+        else:
+            self.f = MyIO(self.f)
+
+        self.f.copy_on_write = self.copy_on_write
+        self.f.prefetch_keys = self.prefetch_keys
+        self.f.bloom_filter = self.bloom_filter
+        self.f.hash_index = self.hash_index
 
+        self.f.header = self.read_header()
+        self.f.node_format = node_format_of(self.f.header)
+
+        header = self.f.header
+        if not self.read_only and header.version == 2:
+            if header.free_map.n:
+                self.f.free_space = FreeSpace.load(self.f, header.free_map.n)
+            else:
+                # written before the free-space map, the map is written by
+                # the first .freeze.
+                self.f.free_space = FreeSpace(tracks_blobs=False)
+
+        # note, what is compressed already is read whatever self.compress
+        # says, and nothing is written in read-only mode.
+        dictionary = None
+        if header.version == 2 and header.compress_dict.n:
+            self.f.seek(header.compress_dict.n)
+            dictionary = TypeHelper.load(self.f)
+        self.f.codec = Codec(
+            method=None if self.read_only else self.compress,
+            min_size=self.compress_min_size,
+            dictionary=dictionary,
+        )
+
+        if (
+            self.cache_nodes is not None
+            or self.cache_bytes is not None
+        ):
+            self.f.node_cache = NodeCache(
+                max_nodes=self.cache_nodes,
+                max_bytes=self.cache_bytes,
+                node_size=self.f.node_format.size,
+            )
+
+    def read_header(self):
         # make sure we are at the beginning
         # , then read the header
-        self.f.seek(0, io.SEEK_SET)
 
-        self.header = Header.load(self.f)
-        self.root_p = self.header.root_node.n
+        # note, in read-only mode, a writer may be swapping the root pointer
+        # right now, read until two reads agree.
+        raw = None
+        while True:
+            self.f.seek(0, io.SEEK_SET)
+            new_raw = self.f.read(Header.size)
+            if new_raw == raw or not self.read_only:
+                break
+            raw = new_raw
 
-        # will be VirtualBNode instance after .connect() is called.
-        self.vnode = None
+        return Header.loads(new_raw)
+
+    def latest(self):
+        # read-only mode, return the MyIO, the root node pointer and the
+        # generation of the last version committed by the writer.
+
+        if (
+            os.stat(self.filename).st_ino
+            != os.fstat(self._f.fileno()).st_ino
+        ):
+            # replaced by `vacuum`, open the new file. the old one stays
+            # open for the snapshots still reading it.
+            self.old_files.append((self.f, self._f))
+            self.open_f()
+        else:
+            header = self.read_header()
+            if header.dumps() != self.f.header.dumps():
+                # the new nodes are after the end of the mapping, map the
+                # file again (the old content never changes in copy-on-write
+                # mode, so the snapshots still on the old version are fine
+                # with the new mapping).
+                new_f = mmap.mmap(
+                    self._f.fileno(),
+                    length=0,
+                    access=mmap.ACCESS_READ,
+                )
+
+                lock = self.f.lock
+                if lock is None:
+                    self.f.change_f(new_f)
+                else:
+                    # thread-safe mode, not while other threads read.
+                    with lock.writing():
+                        self.f.change_f(new_f)
+            self.f.header = header
+
+        header = self.f.header
+        return self.f, header.root_node.n, header.generation.n
+
+    def snapshot(self):
+        # read-only mode, return a Snapshot of the last committed version.
+        assert self.read_only, 'snapshots are for read-only databases'
+        return Snapshot(self)
+
+    def oldest_reader(self):
+        # the oldest generation a snapshot (of any process) is pinned to,
+        # None if there is no reader. the versions from that one on are
+        # still read.
+        return self.readers.oldest()
+
+    def open_wal(self):
+        # start the write-ahead log, replay it first if the last run did not
+        # end with a checkpoint (crashed).
+
+        wal = self.f.wal = WriteAheadLog(
+            self.wal_filename,
+            sync=self.wal,
+            group_ms=self.wal_group_ms,
+        )
+
+        records = wal.records()
+        if records and records[0][0] == 'checkpoint':
+            _, _, wal.checkpoint_end, root_p = records[0]
+            records = records[1:]
+
+            if root_p != self.root_p:
+                # the root node moved after the checkpoint of the log, that
+                # is a later checkpoint (copy-on-write mode) is in the file
+                # already, the crash happened before the log was emptied.
+                logger.warning(
+                    f'ignore {self.wal_filename}, it is older than the file'
+                )
+                records = []
+
+        if not records:
+            wal.checkpoint(self.f.end, self.root_p)
+            return
+
+        logger.warning(
+            f'replay {len(records)} operations from {self.wal_filename}'
+        )
+
+        self.connect()
+        self.replay(records)
+
+        # a checkpoint right away, so the replayed operations are never
+        # replayed again.
+        self.vnode.freeze()
+
+    def replay(self, records):
+        # redo the logged operations (the ones done after the last
+        # checkpoint) on the in-memory tree.
+
+        # note, the operations may be in the file already, a crash after
+        # .freeze wrote the tree (in place) but before the log was emptied.
+        # so an operation already done is skipped: an insert (create) of a
+        # key which is there, a delete of a key which is not, an append of
+        # an index which is there. (an update or a set is done again.) the
+        # tree ends up the same either way, the last operation on a key
+        # wins.
+
+        f = self.f
+        wal = f.wal
+
+        # logged pointer -> replayed pointer, of the values written by the
+        # replayed operations, so that later records can find the trees and
+        # arrays created after the checkpoint.
+        ptrs = {}
+
+        def decode(value):
+            return wal_decode(value, f, ptrs)
+
+        def python_key(key):
+            # a key may be a Data object (go check the FAQ, aliases)
+            if type(key) is Data:
+                return key.get(using_cache=True)
+            return key
+
+        with wal.pause():
+            for op, target_p, *args in records:
+                # the tree or the array to do the operation on
+                if target_p == 0:
+                    target = self.vnode
+                else:
+                    p = ptrs.get(target_p, target_p)
+                    if p >= wal.checkpoint_end and target_p not in ptrs:
+                        # nested in a value written after the checkpoint,
+                        # which is not logged on its own.
+                        logger.warning(f'skip {op} on a lost value at {p}')
+                        continue
+                    target = Data(Pointer(p), f).get()
+
+                if op == 'insert':
+                    key, value, value_p = args
+                    key = decode(key)
+                    try:
+                        new_value = target.insert(key, decode(value))
+                    except error.DuplicateKeyFound:
+                        new_value = target.search(python_key(key))
+                    ptrs[value_p] = new_value.p.n
+
+                elif op == 'insert_many':
+                    pairs, value_ps = args
+                    pairs = decode(pairs)
+                    done = [
+                        python_key(key) in target for key, _ in pairs
+                    ]
+                    new_values = iter(target.insert_many(
+                        [
+                            pair for pair, in_tree in zip(pairs, done)
+                            if not in_tree
+                        ]
+                    ))
+                    for (key, _), in_tree, value_p in zip(
+                        pairs, done, value_ps,
+                    ):
+                        if in_tree:
+                            new_value = target.search(python_key(key))
+                        else:
+                            new_value = next(new_values)
+                        ptrs[value_p] = new_value.p.n
+
+                elif op == 'update':
+                    key, value, value_p = args
+                    key = python_key(decode(key))
+                    try:
+                        target.update(key, decode(value))
+                    except error.KeyNotFound:
+                        # deleted later on
+                        continue
+                    ptrs[value_p] = target.search(key).p.n
+
+                elif op == 'delete':
+                    key, = args
+                    try:
+                        target.delete(python_key(decode(key)))
+                    except error.KeyNotFound:
+                        pass
+
+                elif op == 'create':
+                    key, value_p = args
+                    key = decode(key)
+                    try:
+                        new_value = target.create(key)
+                    except error.DuplicateKeyFound:
+                        new_value = target.search(python_key(key))
+                    ptrs[value_p] = new_value.p.n
+
+                elif op == 'append':
+                    value, value_p, idx = args
+                    if idx >= target.length:
+                        target.append(decode(value))
+                    ptrs[value_p] = target.access(idx).p.n
+
+                elif op == 'set':
+                    idx, value, value_p = args
+                    ptrs[value_p] = target.set(idx, decode(value)).p.n
+
+                else:
+                    raise RuntimeError('Unknown log record', op)
 
     def connect(self):
         # return the VirtualBNode instance of current database
@@ -1982,12 +5112,38 @@ class Database:
 
         # go and check VirtualBNode for more information.
 
+        # note, the same instance is returned if already connected (for
+        # example, .__init__ connects to replay the write-ahead log), two
+        # in-memory trees of the same file would overwrite each other.
+        if self.vnode is not None:
+            return self.vnode
+
         self.vnode = VirtualBNode(
             f=self.f,
             node_p=self.root_p,
             parent=None,
+            data_p=0,
         )
         self.vnode.access()
+        if self.header.extras.n:
+            self.vnode.load_extras(self.header.extras.n)
+
+        if self.f.wal is not None:
+            self.f.wal.root = self.vnode
+
+        return self.vnode
+
+    def bulk_load(self, pairs, fill_factor=1.0):
+        # fill an empty database with a sorted stream of key-value pairs, go
+        # check VirtualBNode.bulk_load for more information.
+
+        if self.vnode is None:
+            self.connect()
+
+        self.vnode.bulk_load(
+            pairs,
+            fill_factor=fill_factor,
+        )
 
         return self.vnode
 
@@ -1998,36 +5154,103 @@ class Database:
         # there's a high chance that your inserted data will be lost.
 
         if self.read_only:
-            pass
+            for snapshot in list(self.snapshots.values()):
+                snapshot.close()
+
+            for f, _f in self.old_files:
+                f.close()
+                _f.close()
+
+            self.readers.cleanup()
         else:
             # if database connected
             if self.vnode:
                 # make sure the index will be written to the disk
                 self.vnode.freeze()
 
-                # try to close file that node's using
-                self.vnode.f.close()
+        # try to close file that node's using (note, the mmap backend must be
+        # closed even if we never connected, it truncates the file back to
+        # its real size)
+        self.f.close()
+
+        if self.f.wal is not None:
+            # the freeze above was the last checkpoint, the log is not needed
+            # anymore.
+            self.f.wal.close()
+            os.remove(self.wal_filename)
 
         # try to close initial file
         self._f.close()
 
     @classmethod
-    def write_initial_database_header(cls, f):
+    def write_initial_database_header(
+        cls,
+        f,
+        node_format=0,
+        order=BNODE_ORDER,
+        compress_dict=None,
+        bloom_filter=False,
+        hash_index=False,
+    ):
         file_start_p = f.tell()
-        make_header(0).dump(f)
+        header = make_header(0, node_format, order)
+        node_format_cls = node_format_of(header)
+        header.dump(f)
         node_start_p = f.tell()
         # empty node
-        BNodeFormat(
+        node_format_cls(
             keys=[],
             values=[],
             children=[],
         ).dump(f)
+        # empty free-space map, go check `modb.freespace`.
+        free_map_p = FreeSpace().write(f, 0)
+        # the shared compression dictionary, go check `modb.compress`.
+        compress_dict_p = 0
+        if compress_dict:
+            compress_dict_p = TypeHelper.dump(compress_dict, f)
+        # the (empty) Bloom filter and hash index of the tree, go check
+        # `modb.bloom` and `modb.hashindex`.
+        extras_p = 0
+        if bloom_filter or hash_index:
+            extras = RootExtras(bloom=Pointer(0), hash_index=Pointer(0))
+            if bloom_filter:
+                extras.bloom = Pointer(
+                    TypeHelper.dump(BloomFilter().dumps(), f)
+                )
+            if hash_index:
+                extras.hash_index = Pointer(
+                    TypeHelper.dump(HashIndex().dumps(), f)
+                )
+            extras_p = f.tell()
+            extras.dump(f)
         f.seek(file_start_p)
-        make_header(node_start_p).dump(f)
+        header = make_header(node_start_p, node_format, order)
+        header.free_map = Pointer(free_map_p)
+        header.compress_dict = Pointer(compress_dict_p)
+        header.extras = Pointer(extras_p)
+        header.dump(f)
 
     def init_database_file(self):
         logger.info('start init database file')
+
+        if self.packed_nodes:
+            node_format = PackedBNodeFormat.code
+        elif self.prefix_keys:
+            node_format = PrefixBNodeFormat.code
+        elif self.inline_keys:
+            node_format = InlineBNodeFormat.code
+        else:
+            node_format = BNodeFormat.code
+        # check the order before any file is created.
+        make_node_format(NODE_FORMATS[node_format], self.order)
+
         with open(self.filename, mode='wb') as f:
             Database.write_initial_database_header(
-                f
+                f,
+                node_format=node_format,
+                order=self.order,
+                compress_dict=self.compress_dict,
+                bloom_filter=self.bloom_filter,
+                hash_index=self.hash_index,
             )
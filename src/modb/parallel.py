@@ -0,0 +1,215 @@
+"""parallel scans, the tree is cut into key ranges which are scanned by a pool
+of processes, each one with its own read-only (mmap) handle of the file."""
+
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# local imports
+from modb import low
+
+
+# the partitions per process, more partitions than processes keep every
+# process busy even if some ranges are slower than the others.
+PARTITIONS_PER_PROCESS = 4
+
+
+def split_keys(node, n):
+    # return up to n-1 keys cutting the tree (node) into n ranges of about
+    # the same size.
+
+    # the keys of the upper levels (root node, then the internal nodes
+    # below, level by level) are used, they cut the tree into subtrees of the
+    # same height, so of about the same size. only the levels needed to get
+    # n-1 keys are accessed.
+
+    if n <= 1:
+        return []
+
+    depth = 0
+    while True:
+        keys, complete = separators(node, depth)
+        if len(keys) >= n - 1 or complete:
+            break
+        depth += 1
+
+    if len(keys) <= n - 1:
+        return keys
+
+    # every `step` keys, so the ranges are balanced
+    step = len(keys) / n
+    return [keys[int(step * i)] for i in range(1, n)]
+
+
+def separators(node, depth):
+    # the keys of the nodes up to `depth` levels below node, in order. and
+    # whether the leaves are reached.
+
+    if not node.accessed:
+        node.access()
+
+    keys = [key.get(using_cache=True) for key in node.keys]
+    if node.is_leaf():
+        return keys, True
+    if depth == 0:
+        return keys, False
+
+    result = []
+    complete = True
+    for idx, child in enumerate(node.children):
+        child_keys, child_complete = separators(child, depth - 1)
+        result += child_keys
+        complete = complete and child_complete
+
+        if idx < len(keys):
+            result.append(keys[idx])
+
+    return result, complete
+
+
+def to_python(value):
+    # nested trees and arrays can not leave the process, they are converted
+    # to dict and list.
+
+    type_ = type(value)
+    if type_ is low.VirtualBNode:
+        return {
+            key.get(): to_python(value.get())
+            for key, value in value.items()
+        }
+    elif type_ is low.VirtualArray:
+        return [to_python(el.get()) for el in value]
+
+    return value
+
+
+# the root node of the scanned version, one per process, set by `start`.
+root = None
+
+
+def start(filename, root_p):
+    # runs once in every process of the pool.
+
+    # note, the root node pointer is the one read by the caller, so every
+    # process scans the same version even if a writer (copy-on-write mode)
+    # commits a new one in the meantime.
+
+    global root
+
+    db = low.Database(filename, read_only=True)
+    root = low.VirtualBNode(
+        f=db.f,
+        node_p=root_p,
+        parent=None,
+        data_p=0,
+    )
+    root.access()
+
+
+def pairs_of(key_low, key_high):
+    for key, value in root.range(key_low, key_high):
+        yield key.get(), value.get()
+
+
+def scan(mapper, key_low, key_high):
+    # runs in the pool, one partition.
+    return mapper(pairs_of(key_low, key_high))
+
+
+def collect(pairs):
+    return [
+        (key, to_python(value))
+        for key, value in pairs
+    ]
+
+
+def make_ranges(filename, key_low, key_high, n):
+    # return the root node pointer and the [low, high) ranges.
+
+    db = low.Database(filename, read_only=True)
+    try:
+        root_p = db.root_p
+        keys = split_keys(db.connect(), n)
+    finally:
+        db.close()
+
+    keys = [
+        key for key in keys
+        if (key_low is None or key_low < key)
+        and (key_high is None or key < key_high)
+    ]
+
+    bounds = [key_low] + keys + [key_high]
+    return root_p, list(zip(bounds[:-1], bounds[1:]))
+
+
+def run(filename, mapper, key_low, key_high, processes, n):
+    # yield the result of mapper on every partition, in key order.
+
+    processes = processes or os.cpu_count() or 1
+    n = n or processes * PARTITIONS_PER_PROCESS
+
+    root_p, ranges = make_ranges(filename, key_low, key_high, n)
+    ranges = iter(ranges)
+
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=start,
+        initargs=(filename, root_p),
+    ) as executor:
+        # only a few partitions ahead of the caller, the results of a whole
+        # scan may not fit in RAM.
+        futures = []
+        for low_, high_ in ranges:
+            futures.append(executor.submit(scan, mapper, low_, high_))
+            if len(futures) == processes * 2:
+                break
+
+        while futures:
+            result = futures.pop(0).result()
+            for low_, high_ in ranges:
+                futures.append(executor.submit(scan, mapper, low_, high_))
+                break
+            yield result
+
+
+def map_reduce(
+    filename,
+    mapper,
+    reducer=None,
+    key_low=None,
+    key_high=None,
+    processes=None,
+    partitions=None,
+):
+    # mapper gets an iterator of (key, value) pairs of one partition (the
+    # actual values, not Data objects) and returns anything picklable.
+    # return reducer applied to the results of the partitions (in key
+    # order), or the list of the results if reducer is None.
+
+    # note, mapper and reducer must be picklable, that is defined at the top
+    # level of a module.
+
+    results = run(filename, mapper, key_low, key_high, processes, partitions)
+
+    if reducer is None:
+        return list(results)
+    return functools.reduce(reducer, results)
+
+
+def items(
+    filename,
+    key_low=None,
+    key_high=None,
+    processes=None,
+    partitions=None,
+):
+    # yield every (key, value) pair in [key_low, key_high) in key order,
+    # like `VirtualBNode.range`, the partitions are loaded in parallel.
+
+    # note, the nested trees and arrays are given as dict and list.
+
+    for pairs in run(
+        filename, collect, key_low, key_high, processes, partitions,
+    ):
+        yield from pairs
@@ -0,0 +1,109 @@
+"""registry of the read-only snapshots opened on a database file, so the
+writer knows which versions of the tree are still in use."""
+
+import itertools
+import os
+
+# local imports
+from modb.log import logger
+
+
+# the registry lives next to the database file, `<filename>.readers`, it is a
+# folder holding one small file per snapshot:
+#       <pid>-<n>
+# whose content is the generation (see `modb.format.Header`) the snapshot is
+# pinned to, in ascii. go check `modb.low.Snapshot`.
+READERS_SUFFIX = '.readers'
+
+# numbers the snapshots of this process
+counter = itertools.count()
+
+
+def pid_alive(pid):
+    if os.name != 'posix':
+        # note, os.kill(pid, 0) terminates the process on windows, so every
+        # reader is kept there, close your snapshots.
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class ReaderRegistry:
+    def __init__(self, filename):
+        self.folder = filename + READERS_SUFFIX
+
+    def new_name(self):
+        return f'{os.getpid()}-{next(counter)}'
+
+    def pin(self, name, generation):
+        path = os.path.join(self.folder, name)
+        tmp_path = path + '.tmp'
+
+        while True:
+            os.makedirs(self.folder, exist_ok=True)
+            try:
+                with open(tmp_path, mode='w') as f:
+                    f.write(str(generation))
+                break
+            except FileNotFoundError:
+                # the folder was removed by .cleanup of another process
+                # right now.
+                continue
+
+        # the writer never sees a half-written file.
+        os.replace(tmp_path, path)
+
+    def unpin(self, name):
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+        # remove the folder if no snapshot is left.
+        self.pinned()
+        try:
+            os.rmdir(self.folder)
+        except OSError:
+            pass
+
+    def pinned(self):
+        # return {name: generation} of every snapshot still open, the ones
+        # left by dead processes are removed.
+
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return {}
+
+        result = {}
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+
+            path = os.path.join(self.folder, name)
+            pid = int(name.split('-')[0])
+            if not pid_alive(pid):
+                logger.warning(f'remove {path}, its process is gone')
+                self.unpin(name)
+                continue
+
+            try:
+                with open(path) as f:
+                    result[name] = int(f.read())
+            except (FileNotFoundError, ValueError):
+                # closed (or being pinned again) right now.
+                continue
+
+        return result
+
+    def oldest(self):
+        # the oldest generation still pinned, None if there is no reader.
+        return min(self.pinned().values(), default=None)
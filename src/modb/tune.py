@@ -0,0 +1,158 @@
+"""pick the order (fanout) of the nodes of a new database file, every
+candidate order is benchmarked against a sample of the workload."""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# local imports
+from modb import high
+from modb.format import NODE_FORMATS, make_node_format
+
+
+# the orders tried by default. note, a node of order 64 is about 1.5KB
+# (2.6KB with inline keys), a node of order 256 is about 6KB (10KB).
+ORDERS = (32, 64, 128, 256, 512)
+
+
+def depth_of(node):
+    # number of levels of the tree
+    depth = 1
+    while True:
+        if not node.accessed:
+            node.access()
+        if node.is_leaf():
+            return depth
+        node = node.children[0]
+        depth += 1
+
+
+def benchmark(order, pairs, lookups, folder, inline_keys=True):
+    # build a database of `order` with pairs (inserted one by one, in the
+    # given order), then search every key of lookups in the reopened
+    # database. return the measures.
+
+    filename = os.path.join(folder, f'tune-{order}')
+
+    db = high.Database(filename, order=order, inline_keys=inline_keys)
+    start = time.perf_counter()
+    node = db.connect()
+    for key, value in pairs:
+        node.insert(key, value)
+    node.freeze()
+    db.close()
+    write_s = time.perf_counter() - start
+
+    # note, a new database object, no node is in RAM. (the OS may still have
+    # the file in its page cache, so the disk itself is hardly measured.)
+    db = high.Database(filename, read_only=True)
+    start = time.perf_counter()
+    node = db.connect()
+    for key in lookups:
+        node.search(key).get()
+    read_s = time.perf_counter() - start
+
+    depth = depth_of(node)
+    db.close()
+
+    result = {
+        'order': order,
+        'node_size': make_node_format(
+            NODE_FORMATS[1 if inline_keys else 0],
+            order,
+        ).size,
+        'depth': depth,
+        'file_size': os.path.getsize(filename),
+        # seconds per operation
+        'write': write_s / max(len(pairs), 1),
+        'read': read_s / max(len(lookups), 1),
+    }
+
+    os.remove(filename)
+    return result
+
+
+def recommend(
+    pairs,
+    read_ratio=0.5,
+    orders=ORDERS,
+    lookups=None,
+    inline_keys=True,
+    folder=None,
+):
+    # pairs is a sample of the (key, value) pairs to be stored, in the order
+    # they would be inserted. read_ratio is the share of the lookups in the
+    # workload (1.0 for a read-only file, 0.0 for a write-only one), lookups
+    # the keys searched (a sample of the keys of pairs by default).
+
+    # return the best order and the measures of every order (see
+    # `benchmark`), with their `cost`: the average time of one operation of
+    # the workload.
+
+    assert 0 <= read_ratio <= 1, 'read_ratio must be in [0, 1]'
+
+    pairs = list(pairs)
+    if lookups is None:
+        keys = [key for key, _ in pairs]
+        lookups = random.sample(keys, min(len(keys), 1000))
+
+    with tempfile.TemporaryDirectory(dir=folder) as tmp_folder:
+        results = [
+            benchmark(order, pairs, lookups, tmp_folder, inline_keys)
+            for order in orders
+        ]
+
+    for result in results:
+        result['cost'] = (
+            read_ratio * result['read']
+            + (1 - read_ratio) * result['write']
+        )
+
+    best = min(results, key=lambda result: result['cost'])
+    return best['order'], results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='recommend the order of a new modb database file, '
+        'using a synthetic workload.',
+    )
+    parser.add_argument('--keys', type=int, default=20000,
+                        help='number of (random string) keys inserted')
+    parser.add_argument('--key-size', type=int, default=16)
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--read-ratio', type=float, default=0.5)
+    parser.add_argument('--orders', type=int, nargs='+', default=ORDERS)
+    parser.add_argument('--no-inline-keys', action='store_true')
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    keys = {
+        ''.join(rand.choices(alphabet, k=args.key_size))
+        for _ in range(args.keys)
+    }
+    pairs = [(key, 'v' * args.value_size) for key in keys]
+
+    order, results = recommend(
+        pairs,
+        read_ratio=args.read_ratio,
+        orders=args.orders,
+        inline_keys=not args.no_inline_keys,
+    )
+
+    print('order  node size  depth  file size  write(us)  read(us)  cost(us)')
+    for result in results:
+        print(
+            f"{result['order']:>5}  {result['node_size']:>9}  "
+            f"{result['depth']:>5}  {result['file_size']:>9}  "
+            f"{result['write'] * 1e6:>9.1f}  {result['read'] * 1e6:>8.1f}  "
+            f"{result['cost'] * 1e6:>8.1f}"
+        )
+    print(f'recommended order: {order}')
+
+
+if __name__ == '__main__':
+    main()
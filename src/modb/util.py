@@ -1,4 +1,6 @@
 import io
+import threading
+from contextlib import contextmanager
 
 # local imports
 import modb.constant
@@ -19,4 +21,155 @@ def max_array_length(power):
     return 2 ** power
 
 def make_indent(level):
-    return modb.constant.INDENT_TEMPLATE * level
\ No newline at end of file
+    return modb.constant.INDENT_TEMPLATE * level
+
+class RWLock:
+    # many readers or one writer, used by `Database(thread_safe=True)`.
+
+    # note, the writer thread can read (and write again) while it holds the
+    # lock, and a reader can read again while it holds the lock, even if a
+    # writer is waiting. but a reader can not write, release first.
+
+    # besides, a freeze (go check `VirtualBNode.freeze`) only keeps the
+    # other writers away, the readers run along with it. the freezing thread
+    # takes the lock for writing (and waits for the readers) only for the
+    # short parts the readers must not see.
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+
+        # number of threads reading right now
+        self.readers = 0
+        self.waiting_writers = 0
+
+        # ident of the thread writing right now, and how many times it
+        # acquired the lock.
+        self.writer = None
+        self.writer_depth = 0
+
+        # ident of the thread freezing right now, and how many times it
+        # acquired the lock for freezing.
+        self.freezer = None
+        self.freezer_depth = 0
+
+        # how many times the current thread acquired the lock for reading.
+        self.local = threading.local()
+
+    def is_writer(self):
+        return self.writer == threading.get_ident()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        if self.writer == me or self.freezer == me:
+            return
+
+        depth = getattr(self.local, 'depth', 0)
+        if not depth:
+            with self.cond:
+                # writers go first, otherwise a steady stream of readers
+                # would starve them.
+                while self.writer is not None or self.waiting_writers:
+                    self.cond.wait()
+                self.readers += 1
+
+        self.local.depth = depth + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        if self.writer == me or self.freezer == me:
+            return
+
+        self.local.depth -= 1
+        if not self.local.depth:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self.writer == me:
+            self.writer_depth += 1
+            return
+
+        if getattr(self.local, 'depth', 0):
+            raise RuntimeError('can not write while reading')
+
+        with self.cond:
+            # note, not counted as waiting while a freeze runs, the readers
+            # would wait for the whole freeze otherwise.
+            while self.freezer not in (None, me):
+                self.cond.wait()
+
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+
+            self.writer = me
+            self.writer_depth = 1
+
+    def release_write(self):
+        self.writer_depth -= 1
+        if not self.writer_depth:
+            with self.cond:
+                self.writer = None
+                self.cond.notify_all()
+
+    def acquire_freeze(self):
+        me = threading.get_ident()
+        if self.freezer == me:
+            self.freezer_depth += 1
+            return
+        if self.writer == me:
+            # already alone
+            return
+
+        if getattr(self.local, 'depth', 0):
+            raise RuntimeError('can not write while reading')
+
+        with self.cond:
+            while (
+                self.writer is not None
+                or self.freezer is not None
+                or self.waiting_writers
+            ):
+                self.cond.wait()
+
+            self.freezer = me
+            self.freezer_depth = 1
+
+    def release_freeze(self):
+        if self.freezer != threading.get_ident():
+            # taken while writing
+            return
+
+        self.freezer_depth -= 1
+        if not self.freezer_depth:
+            with self.cond:
+                self.freezer = None
+                self.cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    @contextmanager
+    def freezing(self):
+        self.acquire_freeze()
+        try:
+            yield
+        finally:
+            self.release_freeze()
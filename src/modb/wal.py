@@ -0,0 +1,190 @@
+"""write-ahead log, makes the operations done after the last freeze survive
+a crash."""
+
+import os
+import pickle
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+# local imports
+from modb.constant import WAL_GROUP_MS
+from modb.log import logger
+
+
+# the log lives next to the database file, `<filename>.wal`
+WAL_SUFFIX = '.wal'
+
+# none:  records are written whenever python's buffer is full.
+# flush: every record is handed to the OS right away (survives a crash of the
+#        process, not a power loss).
+# fsync: every record is fsync-ed (survives everything, slowest).
+# group: like flush, and one fsync for all the records of the last
+#        `group_ms` milliseconds, done by a background thread.
+SYNC_POLICIES = ('none', 'flush', 'fsync', 'group')
+
+
+# rough layout of the log file:
+#       ( length  crc32  record )*
+# length and crc32 are U32 (big endian), record is a pickled tuple like
+#       ('insert', tree_p, key, value, value_p)
+# go check `modb.low.Database.replay` for every kind of record.
+#
+# note, a record is only appended once its operation is done, so a torn
+# record (crash while writing it) at the end of the log is just ignored.
+#
+# the log is emptied on every checkpoint, that is every .freeze of the root
+# node, since everything it holds is in the database file from then on. the
+# first record is always
+#       ('checkpoint', None, end, root_p)
+# where end is the end of the database file at that checkpoint, and root_p
+# the root node pointer of the database. (in copy-on-write mode, if the root
+# node in the header is not root_p, the log is older than the file.)
+# otherwise, a crash between a .freeze and its checkpoint leaves records
+# which are in the file already, the replay skips them.
+
+
+class Ref:
+    # stands for a Data object inside a record, which is the pointer of the
+    # data. go check `modb.low.wal_encode`.
+
+    def __init__(self, p):
+        self.p = p
+
+
+class WriteAheadLog:
+    frame = struct.Struct('>II')
+
+    def __init__(self, filename, sync='flush', group_ms=WAL_GROUP_MS):
+        assert sync in SYNC_POLICIES, f'sync must be one of {SYNC_POLICIES}'
+
+        self.filename = filename
+        self.sync = sync
+        self.group_ms = group_ms
+
+        mode = 'r+b' if os.path.exists(filename) else 'w+b'
+        self.f = open(filename, mode=mode)
+
+        # root VirtualBNode of the database, set by `Database.connect`.
+        self.root = None
+
+        # the end of the database file at the last checkpoint. data before
+        # it survives a crash for sure, the data after it may not.
+        self.checkpoint_end = 0
+
+        # if set, no record is logged (see `modb.low.wal_record`). used while
+        # replaying, and while an
+        # operation calls other operations internally (only the outer one is
+        # logged).
+        self.paused = 0
+
+        self.lock = threading.Lock()
+
+        # set if some records are not fsync-ed yet (group policy only)
+        self.unsynced = False
+
+        self.stopped = threading.Event()
+        self.thread = None
+        if sync == 'group':
+            self.thread = threading.Thread(
+                target=self.run,
+                daemon=True,
+            )
+            self.thread.start()
+
+    def records(self):
+        # return every complete record of the log, from the oldest one.
+
+        self.f.seek(0)
+        contents = self.f.read()
+
+        records = []
+        position = 0
+        while position + self.frame.size <= len(contents):
+            length, crc = self.frame.unpack_from(contents, position)
+            start = position + self.frame.size
+            payload = contents[start:start + length]
+
+            if (
+                len(payload) != length
+                or zlib.crc32(payload) != crc
+            ):
+                break
+
+            records.append(pickle.loads(payload))
+            position = start + length
+
+        if position != len(contents):
+            logger.warning(
+                f'ignore the torn end of {self.filename} '
+                f'({len(contents) - position} bytes)'
+            )
+
+        # new records go after the last complete one.
+        self.f.seek(position)
+        self.f.truncate()
+
+        return records
+
+    def write(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.f.write(
+            self.frame.pack(len(payload), zlib.crc32(payload))
+        )
+        self.f.write(payload)
+
+    def append(self, record):
+        with self.lock:
+            self.write(record)
+
+            if self.sync == 'none':
+                return
+
+            self.f.flush()
+
+            if self.sync == 'fsync':
+                os.fsync(self.f.fileno())
+            elif self.sync == 'group':
+                self.unsynced = True
+
+    @contextmanager
+    def pause(self):
+        self.paused += 1
+        try:
+            yield
+        finally:
+            self.paused -= 1
+
+    def checkpoint(self, end, root_p):
+        # everything logged so far is in the database file now, which ends
+        # at `end`. start an empty log.
+
+        with self.lock:
+            self.f.seek(0)
+            self.f.truncate()
+            self.write(('checkpoint', None, end, root_p))
+            self.f.flush()
+
+            if self.sync in ['fsync', 'group']:
+                os.fsync(self.f.fileno())
+            self.unsynced = False
+
+        self.checkpoint_end = end
+
+    def run(self):
+        # group commit, one fsync for every record appended during the last
+        # `group_ms` milliseconds.
+        while not self.stopped.wait(self.group_ms / 1000):
+            with self.lock:
+                if self.unsynced and not self.f.closed:
+                    os.fsync(self.f.fileno())
+                    self.unsynced = False
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        with self.lock:
+            self.f.close()
@@ -1,7 +1,20 @@
+import asyncio
+import collections
 import os
+import random
+import subprocess
+import sys
+import threading
+
+import pytest
 
 # local imports
 import modb
+from modb import parallel
+from modb.aio import AsyncDatabase
+
+# the test files go there, the folder is not tracked.
+os.makedirs('./tmp', exist_ok=True)
 
 
 class TestClass:
@@ -38,3 +51,1600 @@ class TestClass:
     def test_search_in_subtree(self):
         sub = self.node.search('sub').get()
         assert sub.search('sub_a').get() == 'sub_a_value'
+
+
+class TestBNodeFormat:
+
+    def test_dump_is_byte_compatible(self):
+        from modb.format import BNodeFormat, Pointer
+
+        node = BNodeFormat(keys=[11, 12], values=[21, 22], children=[31])
+
+        legacy = b''.join(
+            Pointer(p).to_bytes()
+            for p in node.keys + node.values + node.children
+        )
+        assert node.dumps() == legacy
+        assert len(legacy) == BNodeFormat.size
+
+    def test_load_returns_ints(self):
+        from modb.format import BNodeFormat
+
+        blob = BNodeFormat(keys=[11], values=[21], children=[]).dumps()
+        node = BNodeFormat.loads(blob)
+
+        assert node.keys[:2] == [11, 0]
+        assert node.values[:2] == [21, 0]
+        assert set(node.children) == {0}
+
+
+class TestMmapBackend:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/mmap'
+        cls.db = modb.Database(cls.filename, use_mmap=True)
+        cls.node = cls.db.connect()
+
+    @classmethod
+    def teardown_class(cls):
+        os.remove(cls.filename)
+
+    def test_insert_and_search(self):
+        for i in range(500):
+            self.node.insert(f'k{i:04}', f'v{i}')
+
+        for i in range(500):
+            assert self.node.search(f'k{i:04}').get() == f'v{i}'
+
+    def test_reopen_without_mmap(self):
+        self.db.close()
+
+        # the over-allocated chunk must be gone after close
+        size = os.path.getsize(self.filename)
+        assert size < modb.constant.MMAP_GROW_SIZE
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        try:
+            assert node.search('k0123').get() == 'v123'
+            assert len(list(node.items())) == 500
+        finally:
+            db.close()
+
+
+class TestNodeCache:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/cache'
+        db = modb.Database(cls.filename)
+        node = db.connect()
+        for i in range(2000):
+            node.insert(f'k{i:05}', i)
+        db.close()
+
+        cls.db = modb.Database(cls.filename, cache_nodes=4)
+        cls.node = cls.db.connect()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.db.close()
+        os.remove(cls.filename)
+
+    def test_scan_is_bounded(self):
+        count = 0
+        for key, value in self.node.items():
+            assert key.get() == f'k{int(value.get()):05}'
+            count += 1
+
+        assert count == 2000
+        assert len(self.db.db.f.node_cache) <= 4
+
+    def test_search_after_eviction(self):
+        for i in range(0, 2000, 37):
+            assert self.node.search(f'k{i:05}').get() == i
+
+    def test_dirty_nodes_are_kept_until_freeze(self):
+        for i in range(2000, 2300):
+            self.node.insert(f'k{i:05}', i)
+
+        self.node.freeze()
+        assert len(self.db.db.f.node_cache) <= 4
+
+        for i in range(0, 2300, 23):
+            assert self.node.search(f'k{i:05}').get() == i
+
+
+class TestBulkLoad:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/bulk'
+
+    @classmethod
+    def teardown_class(cls):
+        if os.path.exists(cls.filename):
+            os.remove(cls.filename)
+
+    def test_bulk_load(self):
+        db = modb.Database(self.filename)
+        db.bulk_load(
+            ((f'k{i:05}', f'v{i}') for i in range(3000)),
+            fill_factor=0.8,
+        )
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        try:
+            keys = [key.get() for key, _ in node.items()]
+            assert keys == [f'k{i:05}' for i in range(3000)]
+
+            assert node.search('k01234').get() == 'v1234'
+
+            # still a normal tree afterwards
+            node.insert('k99999', 'last')
+            node.delete('k00000')
+            assert 'k00000' not in node
+        finally:
+            db.close()
+            os.remove(self.filename)
+
+    def test_unsorted_pairs(self):
+        db = modb.Database(self.filename)
+        try:
+            with pytest.raises(RuntimeError):
+                db.bulk_load([('b', 1), ('a', 2)])
+        finally:
+            db.close()
+            os.remove(self.filename)
+
+    def test_duplicate_keys(self):
+        db = modb.Database(self.filename)
+        try:
+            with pytest.raises(modb.error.DuplicateKeyFound):
+                db.bulk_load([('a', 1), ('a', 2)])
+        finally:
+            db.close()
+            os.remove(self.filename)
+
+
+class TestInsertMany:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/many'
+        cls.db = modb.Database(cls.filename)
+        cls.node = cls.db.connect()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.db.close()
+        os.remove(cls.filename)
+
+    def test_insert_many(self):
+        pairs = [(f'k{i:05}', f'v{i}') for i in range(3000)]
+        pairs.reverse()
+        values = self.node.insert_many(pairs + [('sub', {'a': 'b'})])
+
+        assert values[0].get() == 'v2999'
+        assert values[-1].get().search('a').get() == 'b'
+
+        keys = [key.get() for key, _ in self.node.items()]
+        assert keys == sorted(f'k{i:05}' for i in range(3000)) + ['sub']
+
+    def test_duplicate_in_batch(self):
+        with pytest.raises(modb.error.DuplicateKeyFound):
+            self.node.insert_many([('x', 1), ('y', 2), ('x', 3)])
+
+        assert 'y' not in self.node
+
+    def test_duplicate_in_tree(self):
+        # internal keys must be found too, not only the ones in leaves
+        for key in [self.node.keys[0].get(), 'k00042']:
+            with pytest.raises(modb.error.DuplicateKeyFound):
+                self.node.insert_many([(key, 'again')])
+            with pytest.raises(modb.error.DuplicateKeyFound):
+                self.node.insert(key, 'again')
+
+
+class TestWriteBuffer:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/buffered'
+        cls.db = modb.Database(cls.filename)
+        cls.node = cls.db.connect()
+
+    @classmethod
+    def teardown_class(cls):
+        os.remove(cls.filename)
+
+    def test_read_unflushed(self):
+        # appended data stays in the write buffer, reads must see it anyway
+        value = self.node.insert('hello', 'world')
+        assert len(self.node.f.buffer) > 0
+        assert value.get(using_cache=False) == 'world'
+
+    def test_survives_reopen(self):
+        for i in range(1000):
+            self.node.insert(f'k{i}', f'v{i}')
+        self.db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert node.search('hello').get() == 'world'
+        assert node.search('k999').get() == 'v999'
+        db.close()
+
+
+class TestWriteAheadLog:
+
+    filename = './tmp/logged'
+
+    def crash(self, db):
+        # stop without freezing, the not-yet-flushed data is lost too.
+        db.f.wal.close()
+        db._f.close()
+
+    def teardown_method(self):
+        for filename in [self.filename, self.filename + '.wal']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    @pytest.mark.parametrize('sync', ['flush', 'fsync', 'group'])
+    def test_replay(self, sync):
+        db = modb.low.Database(self.filename, wal=sync)
+        node = db.connect()
+        node.insert('before', 'checkpoint')
+        node.freeze()
+
+        for i in range(200):
+            node.insert(f'k{i}', f'v{i}')
+        node.update('k1', 'updated')
+        node.delete('k2')
+        node.insert('sub', {'a': 'b'})
+        node.search('sub').get().insert('c', 'd')
+        self.crash(db)
+
+        db = modb.low.Database(self.filename, wal=sync)
+        node = db.connect()
+        assert node.search('before').get() == 'checkpoint'
+        assert node.search('k199').get() == 'v199'
+        assert node.search('k1').get() == 'updated'
+        assert 'k2' not in node
+        sub = node.search('sub').get()
+        assert sub.search('a').get() == 'b'
+        assert sub.search('c').get() == 'd'
+        db.close()
+
+        assert not os.path.exists(self.filename + '.wal')
+
+    def test_torn_record(self):
+        db = modb.low.Database(self.filename, wal='flush')
+        node = db.connect()
+        node.insert('a', 1)
+        node.insert('b', 2)
+        self.crash(db)
+
+        # cut the last record in half
+        size = os.path.getsize(self.filename + '.wal')
+        with open(self.filename + '.wal', mode='r+b') as f:
+            f.truncate(size - 3)
+
+        db = modb.low.Database(self.filename, wal='flush')
+        node = db.connect()
+        assert 'a' in node
+        assert 'b' not in node
+        db.close()
+
+    def test_crash_before_checkpoint(self, monkeypatch):
+        db = modb.low.Database(self.filename, wal='flush')
+        node = db.connect()
+        node.insert('before', 'checkpoint')
+        node.insert('gone', 'x')
+        node.freeze()
+
+        node.insert_many([(f'k{i}', f'v{i}') for i in range(100)])
+        node.update('k1', 'updated')
+        node.delete('gone')
+        node.insert('sub', {'a': 'b'})
+        node.search('sub').get().insert('c', 'd')
+        node.insert('array', [1])
+        node.search('array').get().append(2)
+
+        # the tree is written, the log is not emptied.
+        monkeypatch.setattr(db.f.wal, 'checkpoint', lambda *args: None)
+        node.freeze()
+        self.crash(db)
+        monkeypatch.undo()
+
+        db = modb.low.Database(self.filename, wal='flush')
+        node = db.connect()
+        assert node.search('k99').get() == 'v99'
+        assert node.search('k1').get() == 'updated'
+        assert 'gone' not in node
+        sub = node.search('sub').get()
+        assert sub.search('c').get() == 'd'
+        array = node.search('array').get()
+        assert array.length == 2
+        assert array.access(1).get() == 2
+        db.close()
+
+
+class TestDirtyFreeze:
+
+    @classmethod
+    def setup_class(cls):
+        cls.filename = './tmp/dirty'
+        cls.db = modb.Database(cls.filename)
+        cls.node = cls.db.connect()
+        cls.node.insert_many((f'k{i:05}', i) for i in range(5000))
+        cls.node.insert('sub', {'a': 'b'})
+        cls.node.insert('arr', [1])
+        cls.node.freeze()
+
+    @classmethod
+    def teardown_class(cls):
+        os.remove(cls.filename)
+
+    def dirty_nodes(self, node):
+        if node.dirty:
+            yield node
+            for child in node.children:
+                yield from self.dirty_nodes(child)
+
+    def test_only_the_path_is_dirty(self):
+        # warm up, every node accessed
+        for _ in self.node.items():
+            pass
+        assert list(self.dirty_nodes(self.node)) == []
+
+        depth = 1
+        leaf = self.node
+        while not leaf.is_leaf():
+            leaf = leaf.children[0]
+            depth += 1
+
+        self.node.insert('k00000a', 'new')
+        # the path from the root to the leaf, nothing else
+        dirty = list(self.dirty_nodes(self.node))
+        assert len(dirty) == depth and dirty[-1] is leaf
+
+        self.node.freeze()
+        assert list(self.dirty_nodes(self.node)) == []
+        assert len(self.node.f.dirty_roots) == 0
+
+    def test_nested_values_are_frozen(self):
+        self.node.search('sub').get().insert('c', 'd')
+        self.node.search('arr').get().append(2)
+        assert len(self.node.f.dirty_roots) == 2
+        # the root tree itself is not modified
+        assert not self.node.dirty
+
+        self.db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert node.search('sub').get().search('c').get() == 'd'
+        assert len(node.search('arr').get()) == 2
+        db.close()
+
+
+class TestCopyOnWrite:
+
+    filename = './tmp/cow'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def test_nested_values_move(self):
+        db = modb.Database(self.filename, copy_on_write=True)
+        node = db.connect()
+        node.insert('a', {'b': {'c': 'd'}})
+        node.insert('arr', [1, {'x': 'y'}])
+        db.close()
+
+        for i in range(3):
+            db = modb.Database(self.filename, copy_on_write=True)
+            node = db.connect()
+            node.search('a').get().search('b').get().insert(f'k{i}', i)
+            node.search('arr').get().append(i)
+            node.search('arr').get()[1].get().insert(f'k{i}', i)
+            db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        b = node.search('a').get().search('b').get()
+        assert [key.get() for key, _ in b.items()] == ['c', 'k0', 'k1', 'k2']
+        arr = node.search('arr').get()
+        assert len(arr) == 5
+        assert len(list(arr[1].get().items())) == 4
+        db.close()
+
+    def test_crash_while_freezing(self, monkeypatch):
+        db = modb.Database(self.filename, copy_on_write=True)
+        node = db.connect()
+        for i in range(1000):
+            node.insert(f'k{i:04}', i)
+        db.close()
+
+        db = modb.Database(self.filename, copy_on_write=True)
+        node = db.connect()
+        for i in range(1000, 2000):
+            node.insert(f'k{i:04}', i)
+
+        # crash after a few nodes are written
+        written = []
+        dump = modb.low.BNodeFormat.dump
+
+        def crashing_dump(self, f):
+            if len(written) == 5:
+                raise KeyboardInterrupt
+            written.append(self)
+            dump(self, f)
+
+        monkeypatch.setattr(modb.low.BNodeFormat, 'dump', crashing_dump)
+        with pytest.raises(KeyboardInterrupt):
+            node.freeze()
+        monkeypatch.undo()
+        node.f.flush()
+        db.db._f.close()
+
+        # the old tree, complete
+        db = modb.Database(self.filename)
+        node = db.connect()
+        keys = [key.get() for key, _ in node.items()]
+        assert keys == [f'k{i:04}' for i in range(1000)]
+        db.close()
+
+
+class TestSnapshot:
+
+    filename = './tmp/snapshot'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def keys(self, snapshot):
+        return [key.get() for key, _ in snapshot.node.items()]
+
+    def test_refresh(self):
+        writer = modb.Database(self.filename, copy_on_write=True)
+        node = writer.connect()
+        for i in range(1000):
+            node.insert(i, 'old')
+        node.freeze()
+
+        reader = modb.Database(self.filename, read_only=True)
+        old = reader.snapshot()
+        assert writer.db.oldest_reader() == old.generation
+
+        for i in range(1000, 3000):
+            node.insert(i, 'new')
+        for i in range(500):
+            node.update(i, 'new')
+        node.freeze()
+
+        # pinned, the old version is still there
+        assert self.keys(old) == list(range(1000))
+        assert old.node.search(0).get() == 'old'
+
+        new = reader.snapshot()
+        assert new.generation == old.generation + 1
+        assert self.keys(new) == list(range(3000))
+        assert new.node.search(0).get() == 'new'
+
+        assert old.refresh()
+        assert not old.refresh()
+        assert old.node.search(0).get() == 'new'
+
+        old.close()
+        new.close()
+        assert writer.db.oldest_reader() is None
+
+        reader.close()
+        writer.close()
+        assert not os.path.exists(self.filename + '.readers')
+
+    def test_concurrent_writer(self):
+        db = modb.Database(self.filename)
+        db.connect()
+        db.close()
+
+        writer = subprocess.Popen([
+            sys.executable, '-c',
+            'import modb\n'
+            f'db = modb.Database({self.filename!r}, copy_on_write=True)\n'
+            'node = db.connect()\n'
+            'for b in range(50):\n'
+            '    node.insert_many([(b * 50 + i, b) for i in range(50)])\n'
+            '    node.freeze()\n'
+            'db.close()\n',
+        ])
+
+        reader = modb.Database(self.filename, read_only=True)
+        snapshot = reader.snapshot()
+        while True:
+            done = writer.poll() is not None
+            snapshot.refresh()
+            keys = self.keys(snapshot)
+            # a whole batch, or nothing of it
+            assert keys == list(range(len(keys)))
+            assert len(keys) % 50 == 0
+            if done:
+                break
+
+        assert writer.returncode == 0
+        assert len(keys) == 2500
+        reader.close()
+
+
+class TestThreadSafe:
+
+    filename = './tmp/threads'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    @pytest.mark.parametrize('use_mmap', [False, True])
+    def test_readers_and_writer(self, use_mmap):
+        db = modb.Database(
+            self.filename,
+            use_mmap=use_mmap,
+            cache_nodes=20,
+            thread_safe=True,
+        )
+        node = db.connect()
+        node.insert_many([(i, f'v{i}') for i in range(5000)])
+        node.freeze()
+
+        errors = []
+        done = threading.Event()
+
+        def read(seed):
+            try:
+                k = seed
+                while not done.is_set():
+                    k = (k * 7919 + 1) % 5000
+                    assert node.search(k).get() in [f'v{k}', f'u{k}']
+                    if k % 100 == 0:
+                        assert len(list(node.range(k, k + 50))) == 50
+            except Exception as e:
+                errors.append(e)
+                raise
+
+        readers = [
+            threading.Thread(target=read, args=(i,)) for i in range(4)
+        ]
+        for reader in readers:
+            reader.start()
+
+        for i in range(1000):
+            node.update(i * 5, f'u{i * 5}')
+            node.insert(5000 + i, 'new')
+            if i % 250 == 0:
+                node.freeze()
+
+        done.set()
+        for reader in readers:
+            reader.join()
+
+        assert not errors
+        assert len(list(node.items())) == 6000
+        db.close()
+
+    def test_touch_while_shrinking(self):
+        db = modb.Database(self.filename, cache_nodes=4, thread_safe=True)
+        node = db.connect()
+        node.insert_many([(i, f'v{i}') for i in range(500)])
+        node.freeze()
+        child = node.children[0]
+        cache = db.db.f.node_cache
+
+        class Racing(collections.OrderedDict):
+            # another reader evicts the node (.shrink) right after it is
+            # looked up.
+            def __contains__(self, key):
+                found = super().__contains__(key)
+                self.pop(key, None)
+                return found
+
+        cache.touch(child)
+        cache.nodes = Racing(cache.nodes)
+        cache.touch(child)
+        assert list(cache.nodes)[-1] is child
+        db.close()
+
+
+class TestAsync:
+
+    filename = './tmp/async'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def test_async(self, monkeypatch):
+        searched = []
+        search = modb.low.VirtualBNode.search
+
+        def counting_search(self, key):
+            searched.append(key)
+            return search(self, key)
+
+        async def main():
+            async with AsyncDatabase(self.filename) as db:
+                node = await db.connect()
+                await node.insert_many([(i, f'v{i}') for i in range(1000)])
+                await node.insert(-1, {'a': 'b'})
+
+                monkeypatch.setattr(
+                    modb.low.VirtualBNode, 'search', counting_search,
+                )
+                values = await asyncio.gather(
+                    *[node.get(5) for _ in range(50)]
+                )
+                assert values == ['v5'] * 50
+                assert searched.count(5) < 50
+                monkeypatch.undo()
+
+                await node.update(5, 'new')
+                assert await node.get(5) == 'new'
+
+                sub = await node.get(-1)
+                assert await sub.get('a') == 'b'
+
+                pairs = [
+                    pair async for pair in node.range(10, 700, chunk_size=64)
+                ]
+                assert pairs == [(i, f'v{i}') for i in range(10, 700)]
+
+                keys = [key async for key, _ in node.items(reverse=True)]
+                assert keys[0] == 999
+
+        asyncio.run(main())
+
+        db = modb.Database(self.filename)
+        assert db.connect().search(5).get() == 'new'
+        db.close()
+
+    def test_lookup_during_freeze(self, monkeypatch):
+        # the freeze stops at its first node until the lookup is done, it
+        # would wait for nothing (the timeout) if it blocked the reads.
+        started = threading.Event()
+        looked_up = threading.Event()
+        seek_written_position = modb.low.VirtualBNode.seek_written_position
+
+        def slow_seek_written_position(self, size):
+            if not started.is_set():
+                started.set()
+                looked_up.wait(timeout=5)
+            return seek_written_position(self, size)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            async with AsyncDatabase(self.filename) as db:
+                node = await db.connect()
+                await node.insert_many([(i, f'v{i}') for i in range(5000)])
+
+                monkeypatch.setattr(
+                    modb.low.VirtualBNode,
+                    'seek_written_position',
+                    slow_seek_written_position,
+                )
+                freezing = asyncio.ensure_future(node.freeze())
+                assert await loop.run_in_executor(None, started.wait, 5)
+
+                assert await node.get(5) == 'v5'
+                assert not freezing.done()
+                looked_up.set()
+
+                await freezing
+                monkeypatch.undo()
+
+        asyncio.run(main())
+
+        db = modb.Database(self.filename)
+        assert db.connect().search(4999).get() == 'v4999'
+        db.close()
+
+
+def count_pairs(pairs):
+    return sum(1 for _ in pairs)
+
+
+def add(a, b):
+    return a + b
+
+
+class TestParallel:
+
+    filename = './tmp/parallel'
+
+    def setup_method(self):
+        db = modb.Database(self.filename)
+        db.bulk_load((i, f'v{i}') for i in range(20000))
+        db.connect().insert(-1, {'a': [1, 2]})
+        db.close()
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def test_split_keys(self):
+        db = modb.Database(self.filename, read_only=True)
+        keys = parallel.split_keys(db.connect(), 8)
+        db.close()
+
+        assert len(keys) == 7
+        bounds = [-1] + keys + [20000]
+        sizes = [high - low for low, high in zip(bounds, bounds[1:])]
+        assert max(sizes) < 2 * min(sizes)
+
+    def test_map_reduce(self):
+        assert parallel.map_reduce(
+            self.filename, count_pairs, add, processes=2,
+        ) == 20001
+
+        counts = parallel.map_reduce(
+            self.filename, count_pairs, key_low=100, processes=2,
+        )
+        assert len(counts) > 1
+        assert sum(counts) == 19900
+
+    def test_items(self):
+        pairs = list(parallel.items(
+            self.filename, key_high=15000, processes=2,
+        ))
+        assert pairs[0] == (-1, {'a': [1, 2]})
+        assert pairs[1:] == [(i, f'v{i}') for i in range(15000)]
+
+    def test_range_bounds(self):
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        keys = [float(i) for i in range(-1, 20000)]
+
+        for low, high in [(5.5, 700.5), (None, 10), (19990, None)]:
+            expected = [
+                key for key in keys
+                if (low is None or low <= key)
+                and (high is None or key < high)
+            ]
+            for reverse in [False, True]:
+                got = [
+                    key.get()
+                    for key, _ in node.range(low, high, reverse=reverse)
+                ]
+                assert got == (expected[::-1] if reverse else expected)
+        db.close()
+
+
+class TestInlineKeys:
+
+    filename = './tmp/inline_keys'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def fill(self, **kwargs):
+        keys = sorted(
+            [f'user:{i:06d}' for i in range(3000)]
+            + ['x' * 20 + str(i) for i in range(100)]
+            + ['', 'y' * 16]
+        )
+        db = modb.Database(self.filename, **kwargs)
+        db.bulk_load((key, idx) for idx, key in enumerate(keys))
+        db.close()
+        return keys
+
+    @pytest.mark.parametrize('inline_keys', [True, False])
+    def test_search(self, inline_keys, monkeypatch):
+        from modb.low import TypeHelper
+
+        keys = self.fill(inline_keys=inline_keys)
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+
+        loads = []
+        load = TypeHelper.load.__func__
+        monkeypatch.setattr(
+            TypeHelper, 'load',
+            classmethod(lambda cls, f: loads.append(1) or load(cls, f)),
+        )
+        for key in keys[::7]:
+            assert node.search(key).p.n != 0
+        with pytest.raises(modb.error.KeyNotFound):
+            node.search('user:9')
+        monkeypatch.undo()
+
+        if inline_keys:
+            # only the long keys sharing their first bytes are read.
+            assert len(loads) < len(keys[::7]) // 4
+        else:
+            assert len(loads) > len(keys[::7])
+
+        node.insert('user:', 'new')
+        node.insert('x' * 40, 'new')
+        node.freeze()
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == sorted(
+            keys + ['user:', 'x' * 40]
+        )
+        assert node.search('x' * 40).get() == 'new'
+        db.close()
+
+
+class TestPrefetchKeys:
+
+    filename = './tmp/prefetch_keys'
+
+    def setup_method(self):
+        keys = [f'key{i:05d}' for i in range(2000)]
+        # long keys go past PREFETCH_TAIL, they are read on their own.
+        keys += ['z' * 1000 + str(i) for i in range(100)]
+        random.Random(0).shuffle(keys)
+        self.keys = keys
+
+        db = modb.Database(self.filename, inline_keys=False)
+        node = db.connect()
+        for key in keys:
+            node.insert(key, 'v' * 50)
+        node.freeze()
+        db.close()
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def count_reads(self, monkeypatch, prefetch_keys):
+        from modb.low import MyIO
+
+        db = modb.Database(self.filename, prefetch_keys=prefetch_keys)
+        node = db.connect()
+
+        reads = []
+        read = MyIO.read
+        monkeypatch.setattr(
+            MyIO, 'read',
+            lambda self, *args: reads.append(1) or read(self, *args),
+        )
+        for key in self.keys[::10]:
+            assert key in node
+        assert 'key' not in node
+        monkeypatch.undo()
+
+        if prefetch_keys:
+            assert all(key.cached is not None for key in node.keys)
+        assert sorted(key.get() for key, _ in node.items()) == sorted(
+            self.keys
+        )
+        db.close()
+
+        return len(reads)
+
+    def test_prefetch(self, monkeypatch):
+        assert (
+            self.count_reads(monkeypatch, True)
+            < self.count_reads(monkeypatch, False)
+        )
+
+
+class TestOrder:
+
+    filename = './tmp/order'
+
+    def teardown_method(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    @pytest.mark.parametrize('inline_keys', [True, False])
+    def test_order(self, inline_keys):
+        keys = list(range(2000))
+        random.Random(0).shuffle(keys)
+
+        db = modb.Database(self.filename, order=8, inline_keys=inline_keys)
+        node = db.connect()
+        for key in keys:
+            node.insert(key, str(key))
+        for key in keys[:1000]:
+            node.delete(key)
+        node.freeze()
+        db.close()
+
+        # the order of the file wins
+        db = modb.Database(self.filename, order=128)
+        node = db.connect()
+        assert db.db.f.node_format.order == 8
+        assert len(node.keys) <= 7
+        assert [key.get() for key, _ in node.items()] == sorted(keys[1000:])
+        for key in keys[1000:1100]:
+            assert node.search(key).get() == str(key)
+        db.close()
+
+    def test_bad_order(self):
+        with pytest.raises(AssertionError):
+            modb.Database(self.filename, order=2)
+        assert not os.path.exists(self.filename)
+
+    def test_recommend(self):
+        from modb import tune
+
+        pairs = [(f'key{i}', i) for i in range(500)]
+        order, results = tune.recommend(
+            pairs, read_ratio=0.9, orders=[8, 64], folder='./tmp',
+        )
+        assert order in [8, 64]
+        assert [result['order'] for result in results] == [8, 64]
+        assert results[0]['depth'] > results[1]['depth']
+
+
+class TestFreeSpace:
+
+    filename = './tmp/free_space'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_update_heavy(self, copy_on_write):
+        rand = random.Random(0)
+
+        db = modb.Database(self.filename, copy_on_write=copy_on_write)
+        node = db.connect()
+        node.insert_many([(i, 'x' * rand.randint(10, 200)) for i in range(2000)])
+        node.freeze()
+
+        values = {}
+        sizes = []
+        for _ in range(20):
+            for _ in range(300):
+                k = rand.randrange(2000)
+                values[k] = 'y' * rand.randint(10, 200)
+                node.update(k, values[k])
+            for k in range(2000, 2300):
+                node.insert(k, 'z')
+            for k in range(2000, 2300):
+                node.delete(k)
+            node.freeze()
+            sizes.append(os.path.getsize(self.filename))
+        db.close()
+
+        # without the free-space map, every round appends about 40KB.
+        assert sizes[-1] - sizes[4] < 100 * 1024
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        for k, value in values.items():
+            assert node.search(k).get() == value
+        assert len(list(node.items())) == 2000
+        db.close()
+
+    def test_shared_data(self):
+        db = modb.Database(self.filename)
+        node = db.connect()
+        for i in range(100):
+            node.insert(i, f'v{i}')
+        node.insert(-1, node.search(1))
+        node.insert(-2, node.delete(2))
+        node.freeze()
+
+        node.delete(1)
+        node.freeze()
+        for i in range(3, 100):
+            node.update(i, f'u{i}')
+        node.freeze()
+        for i in range(3, 100):
+            node.update(i, f'w{i}')
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert node.search(-1).get() == 'v1'
+        assert node.search(-2).get() == 'v2'
+        assert node.search(50).get() == 'w50'
+        db.close()
+
+    def test_thread_safe(self):
+        # the data written in free space (in place) must be read back by
+        # the positional reads.
+        db = modb.Database(self.filename, thread_safe=True)
+        node = db.connect()
+        for i in range(200):
+            node.insert(f'k{i:04}', f'v{i}')
+        node.freeze()
+
+        node.update('k0001', 'new')
+        assert node.search('k0001').get() == 'new'
+        for i in range(100):
+            node.insert(f'n{i:04}', f'x{i}')
+            assert node.search(f'n{i:04}').get() == f'x{i}'
+        db.close()
+
+
+class TestCompaction:
+
+    filename = './tmp/compaction'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def fill(self, copy_on_write=False):
+        db = modb.Database(self.filename, copy_on_write=copy_on_write)
+        node = db.connect()
+        node.insert_many([(i, 'x' * (i % 300)) for i in range(5000)])
+        node.insert(-1, {'a': 'b' * 100})
+        node.freeze()
+
+        # the first keys (at the start of the file) are deleted, so the data
+        # at the end has somewhere to go.
+        for i in range(2500):
+            node.delete(i)
+        node.freeze()
+        return db, node
+
+    def check(self):
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == (
+            [-1] + list(range(2500, 5000))
+        )
+        for i in range(2500, 5000, 7):
+            assert node.search(i).get() == 'x' * (i % 300)
+        assert node.search(-1).get().search('a').get() == 'b' * 100
+        db.close()
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_steps(self, copy_on_write):
+        db, node = self.fill(copy_on_write)
+        before = os.path.getsize(self.filename)
+
+        steps = 1
+        while not node.compact(max_nodes=20):
+            steps += 1
+        db.close()
+
+        assert steps > 1
+        assert os.path.getsize(self.filename) < before * 0.75
+        self.check()
+
+    def test_resume(self):
+        db, node = self.fill()
+        assert not node.compact(max_nodes=20)
+        db.close()
+
+        db = modb.Database(self.filename)
+        assert db.db.header.compact_cut.n != 0
+        node = db.connect()
+        while not node.compact(max_bytes=64 * 1024):
+            pass
+        assert db.db.header.compact_cut.n == 0
+        db.close()
+        self.check()
+
+    def test_vacuum(self):
+        db, node = self.fill()
+        assert node.vacuum() > 0
+        db.close()
+        self.check()
+
+    def test_vacuum_layout(self):
+        keys = list(range(3000))
+        random.Random(0).shuffle(keys)
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        for key in keys:
+            node.insert(key, f'v{key}')
+        node.insert(-1, [1, {'a': [2, 3]}])
+        node.vacuum()
+        db.close()
+
+        # the pairs are in key order in the file, one after the other.
+        db = modb.Database(self.filename)
+        node = db.connect()
+        ptrs = []
+        for key, value in node.items():
+            ptrs += [key.p.n, value.p.n]
+        assert ptrs == sorted(ptrs)
+
+        array = node.search(-1).get()
+        assert array.access(0).get() == 1
+        sub = array.access(1).get().search('a').get()
+        assert [sub.access(i).get() for i in range(2)] == [2, 3]
+        assert node.search(1234).get() == 'v1234'
+        db.close()
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    @pytest.mark.parametrize('cache_nodes', [None, 4])
+    @pytest.mark.parametrize('vacuum', [False, True])
+    def test_random(self, copy_on_write, cache_nodes, vacuum):
+        # random writes, with compaction steps (or vacuums) and reopens in
+        # between.
+        rand = random.Random(4)
+        params = {'copy_on_write': copy_on_write, 'cache_nodes': cache_nodes}
+
+        db = modb.Database(self.filename, **params)
+        node = db.connect()
+        values = {}
+        for _ in range(3000):
+            r = rand.random()
+            k = f'key{rand.randrange(400):05}'
+            if r < 0.4:
+                if k not in values:
+                    values[k] = 'x' * rand.randint(1, 300)
+                    node.insert(k, values[k])
+            elif r < 0.65:
+                if k in values:
+                    values[k] = 'y' * rand.randint(1, 300)
+                    node.update(k, values[k])
+            elif r < 0.85:
+                if k in values:
+                    node.delete(k)
+                    del values[k]
+            elif r < 0.93:
+                node.freeze()
+            elif r < 0.99:
+                if vacuum:
+                    node.vacuum()
+                else:
+                    for _ in range(rand.randint(1, 5)):
+                        if node.compact(max_nodes=rand.randint(1, 8)):
+                            break
+            else:
+                db.close()
+                db = modb.Database(self.filename, **params)
+                node = db.connect()
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        for k, value in values.items():
+            assert node.search(k).get() == value
+        assert len(list(node.items())) == len(values)
+        db.close()
+
+
+class TestCompression:
+
+    filename = './tmp/compression'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    @staticmethod
+    def value(i):
+        return f'{{"id": {i}, "name": "user {i}"}}'
+
+    def fill(self, **kwargs):
+        db = modb.Database(self.filename, **kwargs)
+        node = db.connect()
+        for i in range(500):
+            node.insert(f'user:{i:03d}', self.value(i) * 20)
+        node.insert('short', 'abc')
+        node.insert('bytes', b'\1' * 1000)
+        node.insert('list', ['x' * 300, b'y' * 300])
+        node.insert('tree', {'a': 'z' * 300})
+        node.update('user:000', 'w' * 300)
+        db.close()
+
+    def check(self, **kwargs):
+        db = modb.Database(self.filename, **kwargs)
+        node = db.connect()
+        assert node.search('user:000').get() == 'w' * 300
+        for i in range(1, 500, 7):
+            assert node.search(f'user:{i:03d}').get() == self.value(i) * 20
+        assert node.search('short').get() == 'abc'
+        assert node.search('bytes').get() == b'\1' * 1000
+        array = node.search('list').get()
+        assert [array.access(i).get() for i in range(2)] == [
+            'x' * 300, b'y' * 300,
+        ]
+        assert node.search('tree').get().search('a').get() == 'z' * 300
+        db.close()
+
+    @pytest.mark.parametrize('compress', ['zlib', 'lzma'])
+    def test_round_trip(self, compress):
+        self.fill()
+        plain = os.path.getsize(self.filename)
+        os.remove(self.filename)
+
+        self.fill(compress=compress)
+        assert os.path.getsize(self.filename) < plain / 2
+        self.check()
+        self.check(read_only=True)
+
+    def test_dict(self):
+        # small values, compressed with a dictionary of what they look like.
+        db = modb.Database(
+            self.filename,
+            compress='zlib',
+            compress_min_size=16,
+            compress_dict=b'{"id": , "name": "user "}',
+        )
+        node = db.connect()
+        for i in range(500):
+            node.insert(f'user:{i:03d}', self.value(i))
+        db.close()
+
+        db = modb.Database(self.filename)
+        assert db.db.f.codec.dictionary == b'{"id": , "name": "user "}'
+        node = db.connect()
+        node.vacuum()
+        db.close()
+
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        for i in range(0, 500, 7):
+            assert node.search(f'user:{i:03d}').get() == self.value(i)
+        db.close()
+
+
+class TestPrefixKeys:
+
+    filename = './tmp/prefix_keys'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def test_search(self, monkeypatch):
+        from modb.low import TypeHelper
+
+        keys = [
+            f'tenant/{t:03d}/user/{u:04d}/profile'
+            for t in range(10) for u in range(300)
+        ] + ['z' * 300]
+        db = modb.Database(self.filename, prefix_keys=True)
+        db.bulk_load((key, idx) for idx, key in enumerate(keys))
+        db.close()
+
+        db = modb.Database(self.filename)
+        assert db.db.f.node_format.code == 2
+        node = db.connect()
+
+        loads = []
+        load = TypeHelper.load.__func__
+        monkeypatch.setattr(
+            TypeHelper, 'load',
+            classmethod(lambda cls, f: loads.append(1) or load(cls, f)),
+        )
+        for key in keys[:-1:7]:
+            assert node.search(key).p.n != 0
+        monkeypatch.undo()
+        # the keys are whole in the nodes
+        assert loads == []
+
+        for key in keys[:100]:
+            node.delete(key)
+        node.insert('tenant/', 'new')
+        node.freeze()
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == (
+            ['tenant/'] + keys[100:]
+        )
+        assert node.search('z' * 300).get() == len(keys) - 1
+        db.close()
+
+
+class TestNumbers:
+
+    filename = './tmp/numbers'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    @pytest.mark.parametrize('prefix_keys', [False, True])
+    def test_exact(self, prefix_keys):
+        from modb.low import data_size
+
+        keys = [1700000000000 + i * 37 for i in range(2000)] + [-5, 2 ** 70]
+        random.shuffle(keys)
+        db = modb.Database(self.filename, prefix_keys=prefix_keys)
+        node = db.connect()
+        for key in keys:
+            node.insert(key, key / 3)
+        node.insert(0.1, 7)
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == sorted(keys + [0.1])
+        for key in keys[::11]:
+            assert node.search(key).get() == key / 3
+        assert node.search(2 ** 70).get() == 2 ** 70 / 3
+        value = node.search(0.1)
+        assert value.get() == 7 and type(value.get()) is int
+        # a small int takes one byte (plus its type code)
+        assert data_size(db.db.f, value.p.n) == 2
+        db.close()
+
+    def test_number(self):
+        # the binary32 Number of the files written before
+        from modb.format import Number, U8
+        from modb.low import Data, Pointer, TypeHelper
+
+        db = modb.Database(self.filename)
+        f = db.db.f
+        p = f.seek(0, os.SEEK_END)
+        U8(TypeHelper.types.index(Number)).dump(f)
+        Number(1.5).dump(f)
+        assert Data(Pointer(p), f).get() == 1.5
+        db.close()
+
+
+class TestPackedNodes:
+
+    filename = './tmp/packed_nodes'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def fill(self, **kwargs):
+        keys = [f'user:{i:05d}' for i in range(5000)]
+        random.Random(0).shuffle(keys)
+        db = modb.Database(self.filename, **kwargs)
+        node = db.connect()
+        for idx, key in enumerate(keys):
+            node.insert(key, idx)
+            if idx % 1000 == 0:
+                # the nodes grow out of their slots between the freezes
+                node.freeze()
+        db.close()
+        return keys
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_grow(self, copy_on_write):
+        keys = self.fill()
+        inline_size = os.path.getsize(self.filename)
+        os.remove(self.filename)
+
+        keys = self.fill(packed_nodes=True, copy_on_write=copy_on_write)
+        if not copy_on_write:
+            assert os.path.getsize(self.filename) < inline_size * 0.8
+
+        db = modb.Database(self.filename, copy_on_write=copy_on_write)
+        assert db.db.f.node_format.code == 3
+        node = db.connect()
+        for key in keys[:2000]:
+            node.delete(key)
+        node.insert('user:', 'new')
+        db.close()
+
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == (
+            ['user:'] + sorted(keys[2000:])
+        )
+        for idx in range(2000, 5000, 7):
+            assert node.search(keys[idx]).get() == idx
+        db.close()
+
+    def test_vacuum(self):
+        keys = self.fill(packed_nodes=True)
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        node.insert('nested', {f'k{i}': i for i in range(200)})
+        node.vacuum()
+        node.insert('user:', 'new')
+        db.close()
+
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        assert [key.get() for key, _ in node.items()] == (
+            sorted(keys + ['nested', 'user:'])
+        )
+        assert node.search(keys[1234]).get() == 1234
+        assert node.search('nested').get().search('k150').get() == 150
+        db.close()
+
+
+class TestBloom:
+
+    filename = './tmp/bloom'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    def count_descents(self, monkeypatch):
+        descents = []
+        peek = modb.low.VirtualBNode.peek
+        monkeypatch.setattr(
+            modb.low.VirtualBNode, 'peek',
+            lambda self, key: descents.append(key) or peek(self, key),
+        )
+        return descents
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_missing_keys(self, monkeypatch, copy_on_write):
+        db = modb.Database(
+            self.filename,
+            bloom_filter=True,
+            copy_on_write=copy_on_write,
+        )
+        node = db.connect()
+        for i in range(3000):
+            node.insert(f'k{i}', i)
+        node.insert('sub', {'a': 1})
+        node.create('empty')
+        node.search('empty').get().insert(1, 'one')
+        db.close()
+
+        db = modb.Database(self.filename, copy_on_write=copy_on_write)
+        node = db.connect()
+        descents = self.count_descents(monkeypatch)
+        assert not any(f'x{i}' in node for i in range(3000))
+        monkeypatch.undo()
+        # the false positives only
+        assert len(set(descents)) < 150
+
+        assert all(f'k{i}' in node for i in range(3000))
+        assert 1.0 in node.search('empty').get()
+        sub = node.search('sub').get()
+        assert 'a' in sub and 'b' not in sub
+        with pytest.raises(modb.error.KeyNotFound):
+            node.delete('x')
+        db.close()
+
+    def test_rebuild(self):
+        db = modb.Database(self.filename, bloom_filter=True)
+        node = db.connect()
+        node.insert_many((f'k{i}', i) for i in range(3000))
+        node.insert('sub', {f's{i}': i for i in range(500)})
+        sub = node.search('sub').get()
+        for i in range(2000):
+            node.delete(f'k{i}')
+        for i in range(400):
+            sub.delete(f's{i}')
+        node.freeze()
+        while not node.compact():
+            pass
+        assert node.bloom.count() == 1001
+        assert node.search('sub').get().bloom.count() == 100
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert node.bloom.count() == 1001
+        assert all(f'k{i}' in node for i in range(2000, 3000))
+        node.delete('sub')
+        node.vacuum()
+        assert node.bloom.count() == 1000
+        db.close()
+
+    def test_added_by_vacuum(self):
+        db = modb.Database(self.filename)
+        node = db.connect()
+        node.insert('a', 1)
+        node.insert('t', {'b': 2})
+        db.close()
+
+        db = modb.Database(self.filename, bloom_filter=True)
+        node = db.connect()
+        assert node.bloom is None
+        node.vacuum()
+        db.close()
+
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        assert node.bloom.count() == 2
+        assert node.search('t').get().bloom.count() == 1
+        assert 'a' in node and 'c' not in node
+        db.close()
+
+
+class TestHashIndex:
+
+    filename = './tmp/hash_index'
+
+    def teardown_method(self):
+        os.remove(self.filename)
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_search(self, monkeypatch, copy_on_write):
+        db = modb.Database(
+            self.filename,
+            hash_index=True,
+            copy_on_write=copy_on_write,
+        )
+        node = db.connect()
+        node.insert_many((i, f'v{i}') for i in range(3000))
+        for i in range(3000, 4000):
+            node.insert(i, f'v{i}')
+        node.insert(-1, {'a': 1})
+        for i in range(500):
+            node.delete(i)
+        for i in range(500, 1000):
+            node.update(i, f'u{i}')
+        db.close()
+
+        db = modb.Database(self.filename, copy_on_write=copy_on_write)
+        node = db.connect()
+        assert node.hash_index.count == 3501
+
+        peeks = []
+        peek = modb.low.VirtualBNode.peek
+        monkeypatch.setattr(
+            modb.low.VirtualBNode, 'peek',
+            lambda self, key: peeks.append(key) or peek(self, key),
+        )
+        for i in range(0, 4000, 7):
+            if i < 500:
+                assert i not in node
+            else:
+                prefix = 'u' if i < 1000 else 'v'
+                assert node.search(i).get() == f'{prefix}{i}'
+        assert node.search(1000.0).get() == 'v1000'
+        monkeypatch.undo()
+        # the tree is not read
+        assert peeks == []
+
+        # True is not the key 1, like in the tree
+        node.insert(1, 'one')
+        assert node.search(1).get() == 'one'
+        with pytest.raises(modb.error.KeyNotFound):
+            node.search(True)
+
+        # a nested tree found by the index moves like any other
+        node.search(-1).get().insert('b', 2)
+        db.close()
+
+        db = modb.Database(self.filename, read_only=True)
+        node = db.connect()
+        assert node.search(-1).get().search('b').get() == 2
+        assert [key.get() for key, _ in node.range(995, 1005)] == list(
+            range(995, 1005)
+        )
+        db.close()
+
+    def test_compact_and_vacuum(self):
+        db = modb.Database(self.filename)
+        node = db.connect()
+        node.insert_many((f'k{i}', i) for i in range(3000))
+        db.close()
+
+        db = modb.Database(self.filename, hash_index=True)
+        node = db.connect()
+        assert node.hash_index is None
+        node.vacuum()
+        for i in range(2000):
+            node.delete(f'k{i}')
+        node.freeze()
+        while not node.compact():
+            pass
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert node.hash_index.count == 1000
+        for i in range(2000, 3000):
+            assert node.search(f'k{i}').get() == i
+        node.vacuum()
+        assert node.search('k2999').get() == 2999
+        db.close()
+
+    @pytest.mark.parametrize('copy_on_write', [False, True])
+    def test_vacuum_empty(self, copy_on_write):
+        db = modb.Database(
+            self.filename,
+            hash_index=True,
+            copy_on_write=copy_on_write,
+        )
+        node = db.connect()
+        node.vacuum()
+        node.insert('a', 1)
+        node.freeze()
+        node.delete('a')
+        node.vacuum()
+        assert node.hash_index.count == 0
+        db.close()
+
+        db = modb.Database(self.filename)
+        node = db.connect()
+        assert 'a' not in node
+        db.close()